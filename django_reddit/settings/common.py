@@ -202,4 +202,34 @@ ADMIN_URL = r'^admin/'
 
 LOGIN_URL = '/login/'
 
+# LISTINGS
+# ------------------------------------------------------------------------------
+# Number of top submissions of every listing each worker keeps in memory,
+# 0 disables the in-process listing index.
+LISTING_INDEX_SIZE = env.int('DJANGO_LISTING_INDEX_SIZE', default=0)
+
+# THREADS
+# ------------------------------------------------------------------------------
+# Seconds a rendered comment tree stays cached, 0 disables the cache.
+THREAD_CACHE_TIMEOUT = env.int('DJANGO_THREAD_CACHE_TIMEOUT', default=0)
+
+# MARKDOWN
+# ------------------------------------------------------------------------------
+# Number of rendered markdown bodies each process keeps, 0 disables the LRU.
+MARKDOWN_LRU_SIZE = env.int('DJANGO_MARKDOWN_LRU_SIZE', default=1024)
+# Seconds rendered markdown stays in the shared cache, 0 disables it.
+MARKDOWN_CACHE_TIMEOUT = env.int('DJANGO_MARKDOWN_CACHE_TIMEOUT', default=0)
+# Render html stored by an older markdown.RENDER_VERSION again when it's read.
+MARKDOWN_LAZY_RENDER = env.bool('DJANGO_MARKDOWN_LAZY_RENDER', default=False)
+
+# VOTES
+# ------------------------------------------------------------------------------
+# Seconds between batched writes of vote counters and karma,
+# 0 writes them in the voting request.
+VOTE_BUFFER_INTERVAL = env.float('DJANGO_VOTE_BUFFER_INTERVAL', default=0)
+# Seconds between batched writes of author karma, which takes it out of
+# the voting request even when the vote counters are written in place.
+# 0 writes karma together with the vote counters.
+KARMA_FLUSH_INTERVAL = env.float('DJANGO_KARMA_FLUSH_INTERVAL', default=0)
+
 # Your common stuff: Below this line define 3rd party library settings
@@ -92,6 +92,23 @@ CACHES = {
     }
 }
 
+# LISTINGS
+# ------------------------------------------------------------------------------
+LISTING_INDEX_SIZE = env.int('DJANGO_LISTING_INDEX_SIZE', default=2000)
+
+# THREADS
+# ------------------------------------------------------------------------------
+THREAD_CACHE_TIMEOUT = env.int('DJANGO_THREAD_CACHE_TIMEOUT', default=300)
+
+# MARKDOWN
+# ------------------------------------------------------------------------------
+MARKDOWN_CACHE_TIMEOUT = env.int('DJANGO_MARKDOWN_CACHE_TIMEOUT', default=86400)
+MARKDOWN_LAZY_RENDER = env.bool('DJANGO_MARKDOWN_LAZY_RENDER', default=True)
+
+# KARMA
+# ------------------------------------------------------------------------------
+KARMA_FLUSH_INTERVAL = env.float('DJANGO_KARMA_FLUSH_INTERVAL', default=5)
+
 # LOGGING CONFIGURATION
 # ------------------------------------------------------------------------------
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#logging
@@ -1,6 +1,6 @@
 from django.contrib.contenttypes.models import ContentType
-from mptt.models import MPTTModel
 from django.db import models
+from django.db.models import Case, Value, When
 
 
 class ContentTypeAware(models.Model):
@@ -23,14 +23,25 @@ class ContentTypeAware(models.Model):
         abstract = True
 
 
-class MttpContentTypeAware(MPTTModel):
-    def get_content_type(self):
-        """:return: Content type for this instance."""
-        return ContentType.objects.get_for_model(self)
-
-    def get_content_type_id(self):
-        """:return: Content type ID for this instance"""
-        return self.get_content_type().pk
-
-    class Meta:
-        abstract = True
+def bulk_update_column(model, field_name, values, queryset=None):
+    """
+    Write a different value of a single column to many rows
+    with one UPDATE ... CASE statement.
+
+    :param model: Model class the rows belong to
+    :param field_name: Name of the column to update
+    :param values: New column values keyed by primary key
+    :type values: dict
+    :param queryset: Only rows of this queryset are written, by default
+                     any row of the model
+    :return: Number of updated rows
+    :rtype: int
+    """
+    if not values:
+        return 0
+    if queryset is None:
+        queryset = model.objects.all()
+    field = model._meta.get_field(field_name)
+    whens = [When(pk=pk, then=Value(value)) for pk, value in values.items()]
+    return queryset.filter(pk__in=list(values)).update(
+        **{field_name: Case(*whens, output_field=field)})
@@ -0,0 +1,74 @@
+from random import random, randrange
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from reddit.models import Comment, Submission
+from reddit.utils.benchmark import summary, time_calls
+from reddit.utils.comment_tree import iter_thread_chunks, load_thread, \
+    render_comment_chunks
+from users.models import RedditUser
+
+
+class Command(BaseCommand):
+    help = 'Measures how long loading and rendering a comment thread ' \
+           'takes, the way the thread page and the streamed whole ' \
+           'thread do it. Inserts a synthetic thread of every size and ' \
+           'deletes it afterwards, do not use it on a real database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000',
+                            help='Comma separated thread sizes')
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='benchmark')
+        author, _ = RedditUser.objects.get_or_create(user=user)
+
+        for size in [int(size) for size in options['sizes'].split(',')]:
+            submission = self.populate(author, size)
+            try:
+                comments = Comment.objects.filter(submission_id=submission.id)
+                thread, _ = load_thread(comments)
+                # Every third comment has a vote of the viewing user
+                votes = {comment.id: 1 if comment.id % 2 else -1
+                         for comment in thread[::3]}
+
+                stages = (
+                    ('load', lambda: load_thread(comments)),
+                    ('render', lambda: ''.join(
+                        render_comment_chunks([thread], votes))),
+                    ('stream', lambda: ''.join(render_comment_chunks(
+                        iter_thread_chunks(comments), votes))),
+                )
+                for label, run in stages:
+                    samples = time_calls(run, options['runs'])
+                    self.stdout.write("{:>7} comments  {:<8}{}".format(
+                        size, label, summary(samples)))
+            finally:
+                submission.delete()
+
+    def populate(self, author, size):
+        """
+        Insert a random thread. Replies mostly go to recent comments,
+        so the thread has both long reply chains and wide top levels.
+        """
+        with transaction.atomic():
+            submission = Submission.objects.create(
+                author=author, author_name=author.user.username,
+                title='benchmark thread')
+            comments = []
+            for i in range(size):
+                roll = random()
+                if not comments or roll < 0.1:
+                    parent = submission
+                elif roll < 0.5:
+                    parent = comments[-1]
+                else:
+                    parent = comments[randrange(max(0, i - 50), i)]
+                comment = Comment.create(author, 'comment', parent)
+                comment.ups = comment.score = randrange(100)
+                comment.save()
+                comments.append(comment)
+        return submission
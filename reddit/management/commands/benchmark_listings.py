@@ -0,0 +1,102 @@
+from datetime import timedelta
+from random import randint
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.utils import timezone
+
+from reddit import views
+from reddit.models import Submission
+from reddit.utils.benchmark import summary, time_calls
+from reddit.utils.pagination import KeysetPaginator
+from users.models import RedditUser
+
+
+class Command(BaseCommand):
+    help = 'Measures frontpage latency of every listing sort and of ' \
+           'top over every period, on the first page and on a deep ' \
+           'page. Optionally inserts synthetic submissions first, do ' \
+           'not use --populate on a real database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--populate', type=int, default=0,
+                            help='Number of synthetic submissions to insert')
+        parser.add_argument('--runs', type=int, default=200)
+        parser.add_argument('--depth', type=int, default=400,
+                            help='Page number used for the deep page runs')
+
+    def handle(self, *args, **options):
+        if options['populate']:
+            self.populate(options['populate'])
+
+        # Every sort, and top limited to each of its periods
+        listings = [(sort, {}) for sort in sorted(views.LISTING_SORTS)]
+        listings += [('top', {'t': period})
+                     for period, max_age in sorted(views.TOP_PERIODS.items())
+                     if max_age]
+
+        factory = RequestFactory()
+        for sort, listing_params in listings:
+            name = sort
+            if listing_params:
+                name += '?t=' + listing_params['t']
+            deep_cursor = self.find_cursor(sort, listing_params.get('t'),
+                                           options['depth'])
+
+            for label, params in (('first', {}),
+                                  ('deep', {'after': deep_cursor})):
+                if label == 'deep' and not deep_cursor:
+                    continue
+                params.update(listing_params)
+                request = factory.get('/', params)
+                request.user = AnonymousUser()
+                samples = time_calls(lambda: views.frontpage(request, sort=sort),
+                                     options['runs'])
+                self.stdout.write("{:<14}{:<6}{}".format(name, label,
+                                                         summary(samples)))
+
+    def find_cursor(self, sort, period, depth):
+        """
+        Walk the listing depth pages deep and return that page's cursor,
+        or the last page's if the listing is shorter
+        """
+        sort_key = views.LISTING_SORTS[sort]
+        max_age = views.RISING_PERIOD if sort == 'rising' \
+            else views.TOP_PERIODS.get(period)
+        submissions = Submission.objects.all()
+        if max_age:
+            submissions = submissions.filter(
+                timestamp__gte=timezone.now() - max_age)
+        paginator = KeysetPaginator(submissions.only('id', sort_key),
+                                    sort_key, 25, key_index=not max_age)
+        cursor = None
+        for _ in range(depth - 1):
+            next_cursor = paginator.page(after=cursor).next_cursor
+            if not next_cursor:
+                break
+            cursor = next_cursor
+        return cursor
+
+    def populate(self, count, batch_size=10000):
+        user, _ = User.objects.get_or_create(username='benchmark')
+        author, _ = RedditUser.objects.get_or_create(user=user)
+        now = timezone.now()
+
+        for offset in range(0, count, batch_size):
+            batch = []
+            for _ in range(min(batch_size, count - offset)):
+                # Older submissions have had longer to collect votes,
+                # so the top scores of all time aren't the recent ones
+                age = randint(0, 30 * 86400)
+                votes = 500 + age // 50
+                ups, downs = randint(0, votes), randint(0, votes // 2)
+                submission = Submission(
+                    author=author, author_name=user.username,
+                    title='benchmark submission',
+                    ups=ups, downs=downs, score=ups - downs,
+                    timestamp=now - timedelta(seconds=age))
+                submission.set_sort_keys()
+                batch.append(submission)
+            Submission.objects.bulk_create(batch)
+            self.stdout.write("Inserted {} submissions".format(offset + len(batch)))
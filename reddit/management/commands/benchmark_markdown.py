@@ -0,0 +1,62 @@
+from random import choice, randrange
+
+import mistune
+from django.core.management.base import BaseCommand
+
+from reddit.utils import markdown
+from reddit.utils.benchmark import summary, time_calls
+
+SAMPLE_PARAGRAPHS = (
+    "Has anyone **benchmarked** this? I'd like to see [numbers](http://example.com).",
+    "> quoted reply\n\nI disagree, see the `docs` for details.",
+    "* first point\n* second point\n* third point",
+    "1. step one\n2. step two\n\n    code block\n    more code",
+    "Plain text comment without any markup at all, just words.",
+)
+
+
+class Command(BaseCommand):
+    help = 'Measures markdown rendering of generated comment bodies: the ' \
+           'old mistune.markdown call per body against the shared ' \
+           'renderer alone and behind a cold and a warm LRU.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bodies', type=int, default=1000,
+                            help='Number of bodies rendered per run')
+        parser.add_argument('--repeated', type=float, default=0.3,
+                            help='Share of bodies copied from earlier ones, '
+                                 'like bots posting the same text')
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        bodies = self.generate_bodies(options['bodies'], options['repeated'])
+
+        def render_all(render):
+            return lambda: [render(body) for body in bodies]
+
+        def cold():
+            markdown.clear()
+            render_all(markdown.render)()
+
+        stages = (
+            ('per call', render_all(mistune.markdown)),
+            ('renderer', render_all(markdown.render_uncached)),
+            ('cold lru', cold),
+            ('warm lru', render_all(markdown.render)),
+        )
+        for label, run in stages:
+            samples = time_calls(run, options['runs'])
+            self.stdout.write("{:>6} bodies  {:<10}{}".format(
+                len(bodies), label, summary(samples)))
+        self.stdout.write("hit ratio {:.2f}".format(markdown.hit_ratio()))
+
+    def generate_bodies(self, count, repeated):
+        bodies = []
+        for i in range(count):
+            if bodies and randrange(100) < repeated * 100:
+                bodies.append(choice(bodies))
+            else:
+                paragraphs = [choice(SAMPLE_PARAGRAPHS)
+                              for _ in range(randrange(1, 4))]
+                bodies.append("\n\n".join(paragraphs) + " #{}".format(i))
+        return bodies
@@ -0,0 +1,58 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from django_reddit.utils.model_utils import bulk_update_column
+from reddit.models import Submission
+from reddit.utils import listing_index
+
+SORT_KEYS = Submission.SORT_KEYS
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored listing sort keys (hot rank, ' \
+           'controversy and rising rank) of recent submissions. ' \
+           'Needed after changing the ranking formulas or their constants.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7,
+                            help='Only submissions newer than this, 0 for all')
+        parser.add_argument('--chunk_size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        submissions = Submission.objects.all()
+        if options['days']:
+            cutoff = timezone.now() - timedelta(days=options['days'])
+            submissions = submissions.filter(timestamp__gte=cutoff)
+
+        fields = ('pk', 'score', 'ups', 'downs', 'timestamp') + SORT_KEYS
+        last_pk = 0
+        updated = set()
+        while True:
+            chunk = list(submissions.filter(pk__gt=last_pk)
+                         .order_by('pk')
+                         .values(*fields)[:options['chunk_size']])
+            if not chunk:
+                break
+
+            changes = {key: {} for key in SORT_KEYS}
+            for row in chunk:
+                submission = Submission(score=row['score'], ups=row['ups'],
+                                        downs=row['downs'],
+                                        timestamp=row['timestamp'])
+                submission.set_sort_keys()
+                for key in SORT_KEYS:
+                    if getattr(submission, key) != row[key]:
+                        changes[key][row['pk']] = getattr(submission, key)
+
+            with transaction.atomic():
+                for key, values in changes.items():
+                    bulk_update_column(Submission, key, values)
+                    updated.update(values)
+            last_pk = chunk[-1]['pk']
+
+        if updated:
+            listing_index.invalidate_all()
+        self.stdout.write("Updated {} submissions".format(len(updated)))
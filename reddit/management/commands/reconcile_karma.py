@@ -0,0 +1,90 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from django_reddit.utils.model_utils import bulk_update_column
+from reddit.models import Comment, Vote
+from reddit.utils import karma
+from users.models import RedditUser
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the link and comment karma of every user from ' \
+           'the votes cast on their submissions and comments, and fixes ' \
+           'the stored values that drifted. Votes cast during the run ' \
+           'are kept as long as karma is written in the vote ' \
+           'transaction. With KARMA_FLUSH_INTERVAL set, workers hold the ' \
+           'diffs of votes that are already committed and add them on ' \
+           'top of the fixed values, run it only while no worker serves ' \
+           'votes then.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk_size', type=int, default=500,
+                            help='Number of users recomputed per query')
+
+    def handle(self, *args, **options):
+        if karma.enabled():
+            self.stdout.write("KARMA_FLUSH_INTERVAL is set, karma diffs "
+                              "buffered by running workers are counted twice")
+
+        last_pk = 0
+        updated = set()
+        while True:
+            with transaction.atomic():
+                # Locked before the votes are read, a vote committing
+                # during the chunk waits to add its karma until the
+                # recomputed value is written, and adds it on top
+                chunk = list(RedditUser.objects.select_for_update()
+                             .filter(pk__gt=last_pk)
+                             .order_by('pk')
+                             .values_list('pk', 'link_karma', 'comment_karma')
+                             [:options['chunk_size']])
+                if not chunk:
+                    break
+                updated.update(self.reconcile(chunk))
+            last_pk = chunk[-1][0]
+
+        self.stdout.write("Updated {} users".format(len(updated)))
+
+    def reconcile(self, chunk):
+        """
+        :param chunk: (pk, link_karma, comment_karma) of the users
+        :return: IDs of the users whose karma was fixed
+        :rtype: set
+        """
+        author_ids = [pk for pk, _, _ in chunk]
+
+        link_karma = dict(
+            Vote.objects.filter(kind=Vote.SUBMISSION,
+                                submission__author_id__in=author_ids)
+            .values_list('submission__author_id')
+            .annotate(Sum('value'))
+            .order_by())
+
+        comments = Comment.objects.filter(author_id__in=author_ids)
+        comment_authors = dict(comments.values_list('id', 'author_id'))
+        comment_karma = Counter()
+        comment_scores = (
+            Vote.objects.filter(kind=Vote.COMMENT,
+                                object_id__in=comments.values('id'))
+            .values_list('object_id')
+            .annotate(Sum('value'))
+            .order_by())
+        for comment_id, score in comment_scores:
+            comment_karma[comment_authors[comment_id]] += score
+
+        changes = {'link_karma': {}, 'comment_karma': {}}
+        for pk, stored_link, stored_comment in chunk:
+            link = link_karma.get(pk) or 0
+            if link != stored_link:
+                changes['link_karma'][pk] = link
+            if comment_karma[pk] != stored_comment:
+                changes['comment_karma'][pk] = comment_karma[pk]
+
+        updated = set()
+        for field, values in changes.items():
+            bulk_update_column(RedditUser, field, values)
+            updated.update(values)
+        return updated
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from django_reddit.utils.model_utils import bulk_update_column
+from reddit.models import Comment, Submission
+
+
+class Command(BaseCommand):
+    help = 'Recounts the comments of every submission from the comment ' \
+           'table and fixes the stored comment counts that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk_size', type=int, default=500,
+                            help='Number of submissions recounted per query')
+
+    def handle(self, *args, **options):
+        last_pk = 0
+        updated = set()
+        while True:
+            chunk = list(Submission.objects.filter(pk__gt=last_pk)
+                         .order_by('pk')
+                         .values_list('pk', 'comment_count')
+                         [:options['chunk_size']])
+            if not chunk:
+                break
+
+            counts = dict(
+                Comment.objects.filter(submission_id__in=[pk for pk, _ in chunk])
+                .values_list('submission')
+                .annotate(Count('id'))
+                .order_by())
+
+            changes = {}
+            for pk, stored in chunk:
+                count = counts.get(pk, 0)
+                if count != stored:
+                    changes[pk] = count
+
+            with transaction.atomic():
+                bulk_update_column(Submission, 'comment_count', changes)
+            updated.update(changes)
+            last_pk = chunk[-1][0]
+
+        self.stdout.write("Updated {} submissions".format(len(updated)))
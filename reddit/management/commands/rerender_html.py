@@ -0,0 +1,178 @@
+import json
+import os
+from collections import OrderedDict, deque
+from functools import partial, reduce
+from operator import or_
+from multiprocessing import Pool, cpu_count
+from timeit import default_timer
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Q
+
+from django_reddit.utils.model_utils import bulk_update_column
+from reddit.models import Comment, Submission
+from reddit.utils import markdown, thread_cache
+from users.models import RedditUser
+
+# Model, markdown column, html column and the column naming the
+# thread whose cached comment tree shows the html
+TARGETS = OrderedDict((
+    ('submissions', (Submission, 'text', 'text_html', None)),
+    ('comments', (Comment, 'raw_comment', 'html_comment', 'submission_id')),
+    ('users', (RedditUser, 'about_text', 'about_html', None)),
+))
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 10
+
+
+def render_chunk(rows):
+    """
+    Render the markdown of a chunk of rows, runs in the worker processes.
+
+    :param rows: (pk, markdown, stored html) tuples
+    :return: The new html of the rows whose html changed, keyed by pk
+    :rtype: dict
+    """
+    changes = {}
+    for pk, text, html in rows:
+        new_html = markdown.render_uncached(text)
+        if new_html != html:
+            changes[pk] = new_html
+    return changes
+
+
+class Command(BaseCommand):
+    help = 'Regenerates the stored html of submissions, comments and ' \
+           'user profiles from their markdown, needed after changing ' \
+           'markdown settings or upgrading mistune. Rows are streamed in ' \
+           'primary key chunks and rendered in a process pool, only ' \
+           'changed html is written back. With --checkpoint an ' \
+           'interrupted run continues where it stopped. Bump ' \
+           'markdown.RENDER_VERSION before a run, the rows are tagged ' \
+           'with it and the shared markdown cache is keyed by it. With ' \
+           'MARKDOWN_LAZY_RENDER set the run is optional, rows of an ' \
+           'older version are rendered again when they are read.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='*',
+                            help='What to rerender out of {}, all of them '
+                                 'by default'.format(', '.join(TARGETS)))
+        parser.add_argument('--chunk_size', type=int, default=500,
+                            help='Number of rows rendered per task')
+        parser.add_argument('--workers', type=int, default=cpu_count(),
+                            help='Rendering processes, 1 renders in this one')
+        parser.add_argument('--checkpoint',
+                            help='File storing the last written pk of each '
+                                 'target, read on start to resume')
+
+    def handle(self, *args, **options):
+        targets = options['targets'] or list(TARGETS)
+        for name in targets:
+            if name not in TARGETS:
+                raise CommandError("Unknown target {}".format(name))
+
+        self.checkpoint_path = options['checkpoint']
+        self.checkpoint = {}
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                self.checkpoint = json.load(f)
+
+        pool = None
+        if options['workers'] > 1:
+            # Forked workers must not share the database connections
+            connections.close_all()
+            pool = Pool(options['workers'])
+        try:
+            for name in targets:
+                self.rerender(name, pool, options['chunk_size'],
+                              max(options['workers'], 1) * 2)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+    def rerender(self, name, pool, chunk_size, max_pending):
+        model, source, target, thread_field = TARGETS[name]
+        rows = model.objects.exclude(**{source: ''}) \
+            .exclude(**{source + '__isnull': True})
+        if model is Comment:
+            rows = rows.filter(deleted=False)
+        fields = ('pk', source, target)
+        if thread_field:
+            fields += (thread_field,)
+
+        last_pk = self.checkpoint.get(name, 0)
+        if last_pk:
+            self.stdout.write("Resuming {} after pk {}".format(name, last_pk))
+
+        # Chunks being rendered, written back in order so the
+        # checkpoint never skips over an unwritten chunk
+        pending = deque()
+        rendered = updated = skipped = 0
+        start = last_report = default_timer()
+        while True:
+            chunk = list(rows.filter(pk__gt=last_pk)
+                         .order_by('pk')
+                         .values_list(*fields)[:chunk_size])
+            if chunk:
+                last_pk = chunk[-1][0]
+                payload = [row[:3] for row in chunk]
+                if pool:
+                    result = pool.apply_async(render_chunk, (payload,)).get
+                else:
+                    result = partial(render_chunk, payload)
+                pending.append((chunk, result))
+
+            while pending and (not chunk or len(pending) >= max_pending):
+                done, result = pending.popleft()
+                changes = result()
+                # Rows edited since they were read already got the html
+                # of their new text, only rows whose markdown is still
+                # the rendered one are written
+                unchanged = model.objects.filter(reduce(or_, (
+                    Q(pk=row[0], **{source: row[1]}) for row in done
+                    if row[0] in changes), Q(pk__in=[])))
+                with transaction.atomic():
+                    written = bulk_update_column(model, target, changes,
+                                                 queryset=unchanged)
+                    model.objects.filter(pk__in=[row[0] for row in done]) \
+                        .filter(render_version__lt=markdown.RENDER_VERSION) \
+                        .update(render_version=markdown.RENDER_VERSION)
+                    if thread_field:
+                        for thread_id in {row[3] for row in done
+                                          if row[0] in changes}:
+                            thread_cache.bump(thread_id)
+                self.save_checkpoint(name, done[-1][0])
+                rendered += len(done)
+                updated += written
+                skipped += len(changes) - written
+
+                now = default_timer()
+                if now - last_report >= PROGRESS_INTERVAL:
+                    last_report = now
+                    self.stdout.write("{}: {} rendered, {:.0f}/s, at pk {}"
+                                      .format(name, rendered,
+                                              rendered / (now - start),
+                                              done[-1][0]))
+            if not chunk:
+                break
+
+        elapsed = default_timer() - start
+        self.stdout.write("Updated {} of {} {} in {:.1f}s ({:.0f}/s)".format(
+            updated, rendered, name, elapsed,
+            rendered / elapsed if elapsed else 0))
+        if skipped:
+            self.stdout.write("Skipped {} {} edited during the run".format(
+                skipped, name))
+
+    def save_checkpoint(self, name, pk):
+        self.checkpoint[name] = pk
+        if not self.checkpoint_path:
+            return
+        # Replaced in one step, a crash never leaves half a file behind
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.checkpoint, f)
+        os.rename(tmp_path, self.checkpoint_path)
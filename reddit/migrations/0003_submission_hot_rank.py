@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-18 07:07
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from django_reddit.utils.model_utils import bulk_update_column
+from reddit.utils.ranking import hot
+
+CHUNK_SIZE = 500
+
+
+def set_hot_rank(apps, schema_editor):
+    Submission = apps.get_model('reddit', 'Submission')
+    last_pk = 0
+    while True:
+        rows = list(Submission.objects.filter(pk__gt=last_pk).order_by('pk')
+                    .values_list('id', 'score', 'timestamp')[:CHUNK_SIZE])
+        if not rows:
+            break
+        bulk_update_column(Submission, 'hot_rank', {
+            pk: hot(score, timestamp) for pk, score, timestamp in rows})
+        last_pk = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reddit', '0002_submission_score_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='hot_rank',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(set_hot_rank, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='submission',
+            index_together=set([('score', 'id'), ('hot_rank', 'id')]),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-18 07:08
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from django_reddit.utils.model_utils import bulk_update_column
+from reddit.utils.ranking import controversy, rising
+
+CHUNK_SIZE = 500
+
+
+def set_sort_keys(apps, schema_editor):
+    Submission = apps.get_model('reddit', 'Submission')
+    last_pk = 0
+    while True:
+        rows = list(Submission.objects.filter(pk__gt=last_pk).order_by('pk')
+                    .values_list('id', 'score', 'ups', 'downs', 'timestamp')
+                    [:CHUNK_SIZE])
+        if not rows:
+            break
+        bulk_update_column(Submission, 'controversy', {
+            pk: controversy(ups, downs) for pk, _, ups, downs, _ in rows})
+        bulk_update_column(Submission, 'rising_rank', {
+            pk: rising(score, timestamp)
+            for pk, score, _, _, timestamp in rows})
+        last_pk = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reddit', '0003_submission_hot_rank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='controversy',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='rising_rank',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(set_sort_keys, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='submission',
+            index_together=set([('hot_rank', 'id'), ('controversy', 'id'), ('rising_rank', 'id'), ('score', 'id'), ('timestamp', 'id')]),
+        ),
+    ]
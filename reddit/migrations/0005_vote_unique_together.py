@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-18 07:20
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def remove_duplicate_votes(apps, schema_editor):
+    # Keep the first vote of every user on every object,
+    # later duplicates could only have been created by racing requests.
+    Vote = apps.get_model('reddit', 'Vote')
+    duplicates = Vote.objects.values('user', 'vote_object_type', 'vote_object_id') \
+        .annotate(first_id=Min('id'), count=Count('id')) \
+        .filter(count__gt=1)
+    for duplicate in duplicates:
+        Vote.objects.filter(user=duplicate['user'],
+                            vote_object_type=duplicate['vote_object_type'],
+                            vote_object_id=duplicate['vote_object_id'],
+                            id__gt=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reddit', '0004_submission_sort_keys'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_votes, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='vote',
+            unique_together=set([('user', 'vote_object_type', 'vote_object_id')]),
+        ),
+    ]
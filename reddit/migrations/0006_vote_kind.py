@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-18 09:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import F
+
+SUBMISSION = 1
+COMMENT = 2
+
+
+def copy_vote_objects(apps, schema_editor):
+    Vote = apps.get_model('reddit', 'Vote')
+    for kind, model in ((SUBMISSION, 'submission'), (COMMENT, 'comment')):
+        Vote.objects.filter(vote_object_type__app_label='reddit',
+                            vote_object_type__model=model) \
+            .update(kind=kind, object_id=F('vote_object_id'))
+    # Votes on objects of any other type can't be represented
+    Vote.objects.filter(kind=None).delete()
+
+
+def copy_vote_objects_back(apps, schema_editor):
+    Vote = apps.get_model('reddit', 'Vote')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    for kind, model in ((SUBMISSION, 'submission'), (COMMENT, 'comment')):
+        content_type, _ = ContentType.objects.get_or_create(
+            app_label='reddit', model=model)
+        Vote.objects.filter(kind=kind) \
+            .update(vote_object_type=content_type,
+                    vote_object_id=F('object_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('reddit', '0005_vote_unique_together'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='kind',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'submission'), (2, 'comment')], null=True),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='object_id',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='vote_object_type',
+            field=models.ForeignKey(null=True, on_delete=models.deletion.CASCADE, to='contenttypes.ContentType'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='vote_object_id',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.RunPython(copy_vote_objects, copy_vote_objects_back),
+        migrations.AlterUniqueTogether(
+            name='vote',
+            unique_together=set([('user', 'kind', 'object_id')]),
+        ),
+        migrations.RemoveField(
+            model_name='vote',
+            name='vote_object_id',
+        ),
+        migrations.RemoveField(
+            model_name='vote',
+            name='vote_object_type',
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='kind',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'submission'), (2, 'comment')]),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='object_id',
+            field=models.PositiveIntegerField(),
+        ),
+        migrations.AlterIndexTogether(
+            name='vote',
+            index_together=set([('user', 'submission', 'kind', 'object_id')]),
+        ),
+    ]
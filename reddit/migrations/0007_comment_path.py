@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-18 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.utils.http import int_to_base36
+
+from django_reddit.utils.model_utils import bulk_update_column
+
+PATH_SEGMENT_WIDTH = 6
+CHUNK_SIZE = 500
+NESTED_SET_FIELDS = ('lft', 'rght', 'tree_id', 'level')
+
+
+def thread_ids(Comment):
+    return Comment.objects.order_by('submission') \
+        .values_list('submission', flat=True).distinct()
+
+
+def write_columns(Comment, columns):
+    for field, values in columns.items():
+        values = list(values.items())
+        for start in range(0, len(values), CHUNK_SIZE):
+            bulk_update_column(Comment, field,
+                               dict(values[start:start + CHUNK_SIZE]))
+
+
+def nested_set_to_path(apps, schema_editor):
+    Comment = apps.get_model('reddit', 'Comment')
+    for submission_id in thread_ids(Comment):
+        paths, depths = {}, {}
+        # Parents always have a lower level than their replies
+        rows = Comment.objects.filter(submission=submission_id) \
+            .order_by('level', 'id').values_list('id', 'parent', 'level')
+        for pk, parent_id, level in rows:
+            segment = int_to_base36(pk).rjust(PATH_SEGMENT_WIDTH, '0')
+            paths[pk] = paths.get(parent_id, '') + segment
+            depths[pk] = level
+        write_columns(Comment, {'path': paths, 'depth': depths})
+
+
+def path_to_nested_set(apps, schema_editor):
+    Comment = apps.get_model('reddit', 'Comment')
+    tree_id = 0
+    for submission_id in thread_ids(Comment):
+        columns = {field: {} for field in NESTED_SET_FIELDS}
+        rows = Comment.objects.filter(submission=submission_id) \
+            .order_by('path').values_list('id', 'depth')
+        open_nodes = []
+        counter = 0
+        for pk, depth in rows:
+            while open_nodes and open_nodes[-1][1] >= depth:
+                columns['rght'][open_nodes.pop()[0]] = counter
+                counter += 1
+            if depth == 0:
+                tree_id += 1
+                counter = 1
+            columns['lft'][pk] = counter
+            columns['tree_id'][pk] = tree_id
+            columns['level'][pk] = depth
+            counter += 1
+            open_nodes.append((pk, depth))
+        while open_nodes:
+            columns['rght'][open_nodes.pop()[0]] = counter
+            counter += 1
+        write_columns(Comment, columns)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reddit', '0006_vote_kind'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='comment',
+            managers=[
+            ],
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=1020),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=models.deletion.CASCADE, related_name='children', to='reddit.Comment'),
+        ),
+    ] + [
+        # Defaults only matter when this migration is reversed
+        migrations.AlterField(
+            model_name='comment',
+            name=field,
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ) for field in NESTED_SET_FIELDS
+    ] + [
+        migrations.RunPython(nested_set_to_path, path_to_nested_set),
+    ] + [
+        migrations.RemoveField(
+            model_name='comment',
+            name=field,
+        ) for field in NESTED_SET_FIELDS
+    ]
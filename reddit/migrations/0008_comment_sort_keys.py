@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-18 13:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from django_reddit.utils.model_utils import bulk_update_column
+from reddit.utils.ranking import confidence, controversy
+
+CHUNK_SIZE = 500
+
+
+def set_sort_keys(apps, schema_editor):
+    Comment = apps.get_model('reddit', 'Comment')
+    # Comments nobody voted on keep the default keys of 0
+    voted = Comment.objects.exclude(ups=0, downs=0)
+    last_pk = 0
+    while True:
+        rows = list(voted.filter(pk__gt=last_pk).order_by('pk')
+                    .values_list('id', 'ups', 'downs')[:CHUNK_SIZE])
+        if not rows:
+            break
+        bulk_update_column(Comment, 'confidence', {
+            pk: confidence(ups, downs) for pk, ups, downs in rows})
+        bulk_update_column(Comment, 'controversy', {
+            pk: controversy(ups, downs) for pk, ups, downs in rows})
+        last_pk = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reddit', '0007_comment_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='confidence',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='controversy',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(set_sort_keys, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='comment',
+            index_together=set([('submission', 'parent', 'confidence', 'id'), ('submission', 'parent', 'score', 'id'), ('submission', 'parent', 'timestamp', 'id'), ('submission', 'parent', 'controversy', 'id')]),
+        ),
+    ]
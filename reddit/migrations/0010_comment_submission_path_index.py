@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-18 15:02
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reddit', '0009_comment_submission_id_index'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='comment',
+            index_together=set([('submission', 'id'), ('submission', 'path'), ('submission', 'parent', 'confidence', 'id'), ('submission', 'parent', 'score', 'id'), ('submission', 'parent', 'timestamp', 'id'), ('submission', 'parent', 'controversy', 'id')]),
+        ),
+    ]
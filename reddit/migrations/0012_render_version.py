@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-18 16:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reddit', '0011_comment_deleted'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='render_version',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='render_version',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-18 18:12
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reddit', '0012_render_version'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='submission',
+            index_together=set([('hot_rank', 'id'), ('controversy', 'id'), ('rising_rank', 'id'), ('score', 'id'), ('timestamp', 'id'), ('timestamp', 'score', 'id'), ('timestamp', 'rising_rank', 'id')]),
+        ),
+    ]
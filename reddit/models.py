@@ -1,11 +1,12 @@
-import mistune
 from django.contrib.auth.models import User
-from django.contrib.contenttypes.fields import GenericForeignKey
-from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.utils import timezone
-from mptt.models import MPTTModel, TreeForeignKey
-from django_reddit.utils.model_utils import ContentTypeAware, MttpContentTypeAware
+from django.utils.http import int_to_base36
+from django_reddit.utils.model_utils import ContentTypeAware
+from reddit.utils import karma, listing_index, markdown, thread_cache, \
+    vote_buffer
+from reddit.utils.ranking import hot, confidence, controversy, rising
 
 
 
@@ -16,16 +17,68 @@ class Submission(ContentTypeAware):
     url = models.URLField(null=True, blank=True)
     text = models.TextField(max_length=5000, blank=True)
     text_html = models.TextField(blank=True)
+    # markdown.RENDER_VERSION of text_html, 0 if unknown
+    render_version = models.PositiveSmallIntegerField(default=0)
     ups = models.IntegerField(default=0)
     downs = models.IntegerField(default=0)
     score = models.IntegerField(default=0)
     timestamp = models.DateTimeField(default=timezone.now)
     comment_count = models.IntegerField(default=0)
+    hot_rank = models.FloatField(default=0)
+    controversy = models.FloatField(default=0)
+    rising_rank = models.FloatField(default=0)
+
+    class Meta:
+        index_together = [('score', 'id'),
+                          ('hot_rank', 'id'),
+                          ('timestamp', 'id'),
+                          ('timestamp', 'score', 'id'),
+                          ('controversy', 'id'),
+                          ('rising_rank', 'id'),
+                          ('timestamp', 'rising_rank', 'id')]
+
+    SORT_KEYS = ('hot_rank', 'controversy', 'rising_rank')
+
+    def save(self, *args, **kwargs):
+        self.set_sort_keys()
+        super(Submission, self).save(*args, **kwargs)
+        listing_index.submission_changed(self)
+
+    def set_sort_keys(self):
+        """
+        Compute the stored listing sort keys from the current
+        score, ups, downs and timestamp.
+
+        :return: The new sort key values keyed by field name
+        :rtype: dict
+        """
+        self.hot_rank = hot(self.score, self.timestamp)
+        self.controversy = controversy(self.ups, self.downs)
+        self.rising_rank = rising(self.score, self.timestamp)
+        return {key: getattr(self, key) for key in self.SORT_KEYS}
+
+    def sort_keys_changed(self):
+        """Called by the vote buffer after it wrote new sort keys."""
+        listing_index.submission_changed(self)
+
+    def change_comment_count(self, diff):
+        """
+        Atomically add diff to the comment count, without rewriting
+        the rest of the row. Pass a negative diff when comments
+        are removed.
+
+        :param diff: Number of comments added to the submission
+        :type diff: int
+        """
+        Submission.objects.filter(pk=self.pk) \
+            .update(comment_count=F('comment_count') + diff)
+        self.comment_count += diff
 
     def generate_html(self):
         if self.text:
-            html = mistune.markdown(self.text)
+            html = markdown.render(self.text)
             self.text_html = html
+            self.render_version = markdown.RENDER_VERSION
 
     @property
     def linked_url(self):
@@ -42,27 +95,142 @@ class Submission(ContentTypeAware):
         return "<Submission:{}>".format(self.id)
 
 
-class Comment(MttpContentTypeAware):
+class Comment(ContentTypeAware):
+    # Width of the base36 id of each ancestor in the path,
+    # enough for ids up to 36 ** 6 (about two billion).
+    PATH_SEGMENT_WIDTH = 6
+    # Deepest reply level the path column can hold
+    MAX_DEPTH = 170
+
     author_name = models.CharField(null=False, max_length=12)
     author = models.ForeignKey('users.RedditUser')
     submission = models.ForeignKey(Submission)
-    parent = TreeForeignKey('self', related_name='children',
-                            null=True, blank=True, db_index=True)
+    parent = models.ForeignKey('self', related_name='children',
+                               null=True, blank=True, db_index=True)
+    path = models.CharField(max_length=PATH_SEGMENT_WIDTH * MAX_DEPTH,
+                            db_index=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     timestamp = models.DateTimeField(default=timezone.now)
     ups = models.IntegerField(default=0)
     downs = models.IntegerField(default=0)
     score = models.IntegerField(default=0)
     raw_comment = models.TextField(blank=True)
     html_comment = models.TextField(blank=True)
+    # markdown.RENDER_VERSION of html_comment, 0 if unknown
+    render_version = models.PositiveSmallIntegerField(default=0)
+    confidence = models.FloatField(default=0)
+    controversy = models.FloatField(default=0)
+    deleted = models.BooleanField(default=False)
+
+    # What a deleted comment shows instead of its author and text
+    DELETED_AUTHOR = '[deleted]'
+    DELETED_HTML = '<p>[deleted]</p>\n'
 
-    class MPTTMeta:
-        order_insertion_by = ['-score']
+    class Meta:
+        # Siblings are read in the order of every comment sort
+        # straight from these indexes, new comments of a thread
+        # from the first one and whole threads from the second
+        index_together = [('submission', 'id'),
+                          ('submission', 'path'),
+                          ('submission', 'parent', 'confidence', 'id'),
+                          ('submission', 'parent', 'score', 'id'),
+                          ('submission', 'parent', 'timestamp', 'id'),
+                          ('submission', 'parent', 'controversy', 'id')]
+
+    SORT_KEYS = ('confidence', 'controversy')
+
+    def save(self, *args, **kwargs):
+        """
+        Comments are stored as a materialized path: the fixed width
+        base36 ids of all ancestors and the comment itself, so ordering a
+        thread by path lists every comment right after its parent and a
+        new comment never touches any other row. The path needs the id,
+        so it's written right after the comment is inserted.
+        """
+        if self.parent_id and not self.path:
+            self.depth = self.parent.depth + 1
+        self.set_sort_keys()
+        super(Comment, self).save(*args, **kwargs)
+        if not self.path:
+            parent_path = self.parent.path if self.parent_id else ''
+            self.path = parent_path + self.path_segment(self.pk)
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+            thread_cache.bump(self.submission_id)
+
+    def set_sort_keys(self):
+        """
+        Compute the stored comment sort keys from the current
+        ups and downs.
+
+        :return: The new sort key values keyed by field name
+        :rtype: dict
+        """
+        self.confidence = confidence(self.ups, self.downs)
+        self.controversy = controversy(self.ups, self.downs)
+        return {key: getattr(self, key) for key in self.SORT_KEYS}
+
+    def edit(self, raw_comment):
+        """
+        Replace the text of the comment and its rendered html. Only
+        this row is written and the comment keeps its place in the tree.
+
+        :param raw_comment: New raw comment text
+        :type raw_comment: str
+        """
+        self.raw_comment = raw_comment
+        self.html_comment = markdown.render(raw_comment)
+        self.render_version = markdown.RENDER_VERSION
+        Comment.objects.filter(pk=self.pk).update(
+            raw_comment=self.raw_comment, html_comment=self.html_comment,
+            render_version=self.render_version)
+        thread_cache.bump(self.submission_id)
+
+    def tombstone(self):
+        """
+        Delete the comment by blanking its author and text. The row
+        stays as a tombstone, so its replies keep their place in the
+        tree and no other row is written.
+        """
+        self.deleted = True
+        self.author_name = self.DELETED_AUTHOR
+        self.raw_comment = ''
+        self.html_comment = self.DELETED_HTML
+        Comment.objects.filter(pk=self.pk).update(
+            deleted=True, author_name=self.author_name,
+            raw_comment=self.raw_comment, html_comment=self.html_comment)
+        thread_cache.bump(self.submission_id)
+
+    @classmethod
+    def counters_changed(cls, pks):
+        """
+        Called by the vote buffer after it wrote new scores
+        of the comments with the given ids.
+        """
+        if not thread_cache.enabled():
+            return
+        submission_ids = cls.objects.filter(pk__in=list(pks)) \
+            .values_list('submission_id', flat=True).distinct()
+        for submission_id in submission_ids:
+            thread_cache.bump(submission_id)
+
+    @classmethod
+    def path_segment(cls, pk):
+        return int_to_base36(pk).rjust(cls.PATH_SEGMENT_WIDTH, '0')
+
+    def ancestor_ids(self):
+        """
+        :return: IDs of the ancestors read off the path, root first
+        :rtype: list[int]
+        """
+        width = self.PATH_SEGMENT_WIDTH
+        return [int(self.path[start:start + width], 36)
+                for start in range(0, len(self.path) - width, width)]
 
     @classmethod
     def create(cls, author, raw_comment, parent):
         """
-        Create a new comment instance. If the parent is submisison
-        update comment_count field and save it.
+        Create a new comment instance and increment the comment_count
+        of its submission.
         If parent is comment post it as child comment
         :param author: RedditUser instance
         :type author: RedditUser
@@ -74,12 +242,13 @@ class Comment(MttpContentTypeAware):
         :rtype: Comment
         """
 
-        html_comment = mistune.markdown(raw_comment)
+        html_comment = markdown.render(raw_comment)
         # todo: any exceptions possible?
         comment = cls(author=author,
                       author_name=author.user.username,
                       raw_comment=raw_comment,
-                      html_comment=html_comment)
+                      html_comment=html_comment,
+                      render_version=markdown.RENDER_VERSION)
 
         if isinstance(parent, Submission):
             submission = parent
@@ -90,8 +259,7 @@ class Comment(MttpContentTypeAware):
             comment.parent = parent
         else:
             return
-        submission.comment_count += 1
-        submission.save()
+        submission.change_comment_count(1)
 
         return comment
 
@@ -100,19 +268,57 @@ class Comment(MttpContentTypeAware):
 
 
 class Vote(models.Model):
+    SUBMISSION = 1
+    COMMENT = 2
+    KIND_CHOICES = ((SUBMISSION, 'submission'),
+                    (COMMENT, 'comment'))
+
     user = models.ForeignKey('users.RedditUser')
     submission = models.ForeignKey(Submission)
-    vote_object_type = models.ForeignKey(ContentType)
-    vote_object_id = models.PositiveIntegerField()
-    vote_object = GenericForeignKey('vote_object_type', 'vote_object_id')
+    kind = models.PositiveSmallIntegerField(choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
     value = models.IntegerField(default=0)
 
+    class Meta:
+        unique_together = [('user', 'kind', 'object_id')]
+        index_together = [('user', 'submission', 'kind', 'object_id')]
+
+    @classmethod
+    def kind_of(cls, vote_object):
+        """
+        :param vote_object: Object a vote can be cast on
+        :type vote_object: Comment | Submission
+        :return: Vote kind of the object
+        :rtype: int
+        """
+        return cls.SUBMISSION if isinstance(vote_object, Submission) \
+            else cls.COMMENT
+
+    @property
+    def vote_object(self):
+        """
+        The Submission or Comment the vote was cast on. Fetched on first
+        access unless it was assigned, assign it whenever the object is
+        already at hand to save the query.
+        """
+        cached = getattr(self, '_vote_object', None)
+        if cached is None or cached.pk != self.object_id:
+            model = Submission if self.kind == self.SUBMISSION else Comment
+            cached = self._vote_object = model.objects.get(pk=self.object_id)
+        return cached
+
+    @vote_object.setter
+    def vote_object(self, vote_object):
+        self.kind = self.kind_of(vote_object)
+        self.object_id = vote_object.pk
+        self._vote_object = vote_object
+
     @classmethod
     def create(cls, user, vote_object, vote_value):
         """
         Create a new vote object and return it.
-        It will also update the ups/downs/score fields in the
-        vote_object instance and save it.
+        It will also update the ups/downs/score fields of the
+        vote_object and the karma of its author in the database.
 
         :param user: RedditUser instance
         :type user: RedditUser
@@ -125,83 +331,151 @@ class Vote(models.Model):
         """
 
         if isinstance(vote_object, Submission):
-            submission = vote_object
-            vote_object.author.link_karma += vote_value
+            submission_id = vote_object.id
         else:
-            submission = vote_object.submission
-            vote_object.author.comment_karma += vote_value
+            submission_id = vote_object.submission_id
 
         vote = cls(user=user,
-                   vote_object=vote_object,
+                   submission_id=submission_id,
                    value=vote_value)
-
-        vote.submission = submission
+        vote.vote_object = vote_object
         # the value for new vote will never be 0
         # that can happen only when removing up/down vote.
-        vote_object.score += vote_value
         if vote_value == 1:
-            vote_object.ups += 1
+            cls.update_counters(vote_object, vote_value, ups=1)
         elif vote_value == -1:
-            vote_object.downs += 1
-
-        vote_object.save()
-        vote_object.author.save()
+            cls.update_counters(vote_object, vote_value, downs=1)
 
         return vote
 
+    @staticmethod
+    def update_counters(vote_object, score, ups=0, downs=0):
+        """
+        Add the vote diff to the counters of vote_object and to the
+        karma of its author. The counters are read with the row locked,
+        then one UPDATE adds the non-zero diffs with SET col = col + diff
+        and writes the sort keys derived from the new counters, so
+        concurrent votes can't overwrite each other's changes.
+        The in-memory vote_object is updated to match.
+
+        Inside vote_buffer.collect(), or with VOTE_BUFFER_INTERVAL set,
+        the diffs are handed to the vote buffer instead and written
+        in batches. Karma goes through karma.record, which aggregates
+        it in the background when KARMA_FLUSH_INTERVAL is set.
+
+        :param vote_object: Object the vote was cast on
+        :type vote_object: Comment | Submission
+        :param score: Change of the score
+        :param ups: Change of the upvote count
+        :param downs: Change of the downvote count
+        """
+        is_submission = isinstance(vote_object, Submission)
+        karma.record(vote_object.author_id,
+                     'link_karma' if is_submission else 'comment_karma',
+                     score)
+
+        if vote_buffer.buffering():
+            vote_object.score += score
+            vote_object.ups += ups
+            vote_object.downs += downs
+            vote_buffer.add(type(vote_object), vote_object.pk,
+                            score=score, ups=ups, downs=downs)
+            return
+
+        diffs = {'score': score, 'ups': ups, 'downs': downs}
+        rows = type(vote_object).objects.filter(pk=vote_object.pk)
+        with transaction.atomic(savepoint=False):
+            # Locked until the transaction ends, so the sort keys are
+            # derived from the counters this update adds to, and keys of
+            # a concurrent vote committed later include this vote.
+            counters = rows.select_for_update() \
+                .values_list('score', 'ups', 'downs').get()
+            vote_object.score, vote_object.ups, vote_object.downs = \
+                [value + diffs[column] for column, value
+                 in zip(('score', 'ups', 'downs'), counters)]
+            columns = {column: F(column) + diff
+                       for column, diff in diffs.items() if diff}
+            columns.update(vote_object.set_sort_keys())
+            rows.update(**columns)
+
+        if is_submission:
+            listing_index.submission_changed(vote_object)
+        else:
+            thread_cache.bump(vote_object.submission_id)
+
+    @classmethod
+    def get_submission_votes(cls, user, submission_ids):
+        """
+        Return the votes user cast on the given submissions using a
+        single query, so listings don't pay one lookup per submission.
+
+        :param user: RedditUser instance
+        :type user: RedditUser
+        :param submission_ids: IDs of the submissions being displayed
+        :type submission_ids: list[int]
+        :return: Vote values keyed by submission id
+        :rtype: dict[int, int]
+        """
+        votes = cls.objects.filter(user=user,
+                                   kind=cls.SUBMISSION,
+                                   object_id__in=list(submission_ids))
+
+        return dict(votes.values_list('object_id', 'value'))
+
+    @classmethod
+    def get_comment_votes(cls, user, submission, comment_ids=None):
+        """
+        Return all votes user cast on comments in the submission thread
+        using a single query.
+
+        :param user: RedditUser instance
+        :type user: RedditUser
+        :param submission: Submission the comments belong to
+        :type submission: Submission | int
+        :param comment_ids: Only return the votes on these comments
+        :type comment_ids: list[int]
+        :return: Vote values keyed by comment id
+        :rtype: dict[int, int]
+        """
+        votes = cls.objects.filter(user=user,
+                                   submission=submission,
+                                   kind=cls.COMMENT)
+        if comment_ids is not None:
+            votes = votes.filter(object_id__in=list(comment_ids))
+
+        return dict(votes.values_list('object_id', 'value'))
+
     def change_vote(self, new_vote_value):
         if self.value == -1 and new_vote_value == 1:  # down to up
             vote_diff = 2
-            self.vote_object.score += 2
-            self.vote_object.ups += 1
-            self.vote_object.downs -= 1
+            self.update_counters(self.vote_object, 2, ups=1, downs=-1)
         elif self.value == 1 and new_vote_value == -1:  # up to down
             vote_diff = -2
-            self.vote_object.score -= 2
-            self.vote_object.ups -= 1
-            self.vote_object.downs += 1
+            self.update_counters(self.vote_object, -2, ups=-1, downs=1)
         elif self.value == 0 and new_vote_value == 1:  # canceled vote to up
             vote_diff = 1
-            self.vote_object.ups += 1
-            self.vote_object.score += 1
+            self.update_counters(self.vote_object, 1, ups=1)
         elif self.value == 0 and new_vote_value == -1:  # canceled vote to down
             vote_diff = -1
-            self.vote_object.downs += 1
-            self.vote_object.score -= 1
+            self.update_counters(self.vote_object, -1, downs=1)
         else:
             return None
 
-        if isinstance(self.vote_object, Submission):
-            self.vote_object.author.link_karma += vote_diff
-        else:
-            self.vote_object.author.comment_karma += vote_diff
-
         self.value = new_vote_value
-        self.vote_object.save()
-        self.vote_object.author.save()
-        self.save()
+        self.save(update_fields=['value'])
 
         return vote_diff
 
     def cancel_vote(self):
         if self.value == 1:
             vote_diff = -1
-            self.vote_object.ups -= 1
-            self.vote_object.score -= 1
+            self.update_counters(self.vote_object, -1, ups=-1)
         elif self.value == -1:
             vote_diff = 1
-            self.vote_object.downs -= 1
-            self.vote_object.score += 1
+            self.update_counters(self.vote_object, 1, downs=-1)
         else:
             return None
 
-        if isinstance(self.vote_object, Submission):
-            self.vote_object.author.link_karma += vote_diff
-        else:
-            self.vote_object.author.comment_karma += vote_diff
-
         self.value = 0
-        self.save()
-        self.vote_object.save()
-        self.vote_object.author.save()
+        self.save(update_fields=['value'])
         return vote_diff
@@ -1,11 +1,20 @@
 import json
+import re
+from io import StringIO
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from reddit.models import Submission, Comment, Vote
+from reddit.utils.comment_tree import CHILD_LIMIT, COLLAPSE_SCORE, SORTS, \
+    iter_thread_chunks, load_context, load_thread, render_comment_chunks, \
+    render_comment_tree
 from users.models import RedditUser
 from django.contrib.auth.models import User
 from django.utils.crypto import get_random_string
-from django.http import HttpResponseNotAllowed, HttpResponseBadRequest
+from django.http import HttpResponseNotAllowed, HttpResponseBadRequest, \
+    HttpResponseForbidden
 
 
 class TestViewingThreadComments(TestCase):
@@ -70,7 +79,7 @@ class TestViewingThreadComments(TestCase):
         submission = Submission.objects.get(id=1)
         self.assertEqual(r.status_code, 200)
         self.assertEqual(r.context['submission'], submission)
-        self.assertEqual(len(r.context['comments']), 5)
+        self.assertContains(r, 'data-what-type="comment"', count=5)
         self.assertContains(r, 'root comment', count=3)
         self.assertContains(r, 'reply comment', count=2)
         self.assertEqual(r.context['comment_votes'], {})
@@ -90,6 +99,510 @@ class TestViewingThreadComments(TestCase):
         self.assertEqual(r.status_code, 404)
 
 
+class TestCommentTree(TestCase):
+    def setUp(self):
+        self.author = author = RedditUser.objects.create(
+            user=User.objects.create_user(username="<b>author")
+        )
+        self.submission = Submission.objects.create(
+            title=get_random_string(length=12),
+            author=author
+        )
+        self.roots = roots = []
+        for i in range(3):
+            root = Comment.create(author, "root {}".format(i), self.submission)
+            root.save()
+            roots.append(root)
+        self.reply = reply = Comment.create(author, "reply", roots[0])
+        reply.save()
+        self.nested = Comment.create(author, "nested reply", reply)
+        self.nested.save()
+        self.second = Comment.create(author, "second reply", roots[0])
+        self.second.save()
+        self.last = Comment.create(author, "last reply", roots[2])
+        self.last.save()
+        self.votes = {roots[0].id: 1, reply.id: -1}
+
+    def test_paths(self):
+        nested = Comment.objects.get(id=self.nested.id)
+        self.assertEqual(nested.depth, 2)
+        self.assertEqual(nested.path, ''.join(
+            Comment.path_segment(pk)
+            for pk in (self.roots[0].id, self.reply.id, nested.id)))
+
+    def test_insert_touches_one_row(self):
+        reply = Comment.create(self.author, "another reply", self.reply)
+        # insert and path update of the new row only
+        with self.assertNumQueries(2):
+            reply.save()
+        self.assertEqual(Comment.objects.get(id=reply.id).depth, 2)
+
+    def test_siblings_sorted_by_score(self):
+        Comment.objects.filter(id=self.roots[2].id).update(score=5)
+        Comment.objects.filter(id=self.second.id).update(score=1)
+        thread, _ = load_thread(
+            Comment.objects.filter(submission=self.submission), sort='top')
+        self.assertEqual([comment.id for comment in thread],
+                         [self.roots[2].id, self.last.id,
+                          self.roots[1].id, self.roots[0].id,
+                          self.second.id, self.reply.id,
+                          self.nested.id])
+
+    def test_markup(self):
+        thread, _ = load_thread(
+            Comment.objects.filter(submission=self.submission), sort='old')
+        rendered = render_comment_tree(thread, self.votes)
+        self.assertEqual(re.findall(r'data-what-id="(\d+)"', rendered),
+                         [str(comment.id) for comment in thread])
+        self.assertEqual(rendered.count('<div'), rendered.count('</div>'))
+        self.assertIn('fa-chevron-up upvoted', rendered)
+        self.assertIn('fa-chevron-down downvoted', rendered)
+        self.assertIn('&lt;b&gt;author', rendered)
+        self.assertNotIn('<b>author', rendered)
+        # The nested reply is rendered inside its parent
+        reply_body = rendered.index('data-parent-id="{}"'.format(self.reply.id))
+        nested = rendered.index('data-what-id="{}"'.format(self.nested.id))
+        second = rendered.index('data-what-id="{}"'.format(self.second.id))
+        self.assertLess(reply_body, nested)
+        self.assertLess(nested, second)
+
+    def test_deep_thread(self):
+        depth = 5000
+        comments = [Comment(id=i, depth=i, author_name="author",
+                            html_comment="deep")
+                    for i in range(depth)]
+        rendered = render_comment_tree(comments, {})
+        self.assertEqual(rendered.count('<div class="media">'), depth)
+        self.assertTrue(rendered.endswith('</div></div>' * depth))
+
+
+class TestBoundedThread(TestCase):
+    def setUp(self):
+        self.c = Client()
+        self.credentials = {'username': 'username',
+                            'password': 'password'}
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(**self.credentials)
+        )
+        self.submission = Submission.objects.create(
+            title=get_random_string(length=12),
+            author=self.author
+        )
+        self.roots = []
+        for score in range(3):
+            root = Comment.create(self.author, "root", self.submission)
+            root.score = root.ups = score
+            root.save()
+            self.roots.append(root)
+        # A chain of replies under the worst root and a wide
+        # level under the best one
+        parent = self.roots[0]
+        for _ in range(4):
+            parent = Comment.create(self.author, "chain", parent)
+            parent.save()
+        self.chain_end = parent
+        for _ in range(CHILD_LIMIT + 5):
+            Comment.create(self.author, "wide", self.roots[2]).save()
+
+    def comments(self):
+        return Comment.objects.filter(submission=self.submission)
+
+    def test_limits(self):
+        thread, hidden = load_thread(self.comments(), root_limit=2,
+                                     depth_limit=3, child_limit=4)
+        self.assertEqual(hidden, 1)
+        self.assertEqual([c.id for c in thread if not c.depth],
+                         [self.roots[2].id, self.roots[1].id])
+        self.assertEqual(thread[0].replies_shown, 4)
+        self.assertEqual(thread[0].more_replies, CHILD_LIMIT + 1)
+        self.assertEqual(len(thread), 2 + 4)
+
+        thread, hidden = load_thread(self.comments(), offset=2,
+                                     depth_limit=3)
+        self.assertEqual(hidden, 0)
+        self.assertEqual([c.depth for c in thread], [0, 1, 2])
+        # Replies past the depth limit are only counted
+        self.assertEqual((thread[-1].replies_shown, thread[-1].more_replies),
+                         (0, 1))
+
+    def test_wide_level_read_up_to_limit(self):
+        with CaptureQueriesContext(connection) as queries:
+            thread, _ = load_thread(self.comments(), child_limit=4)
+        self.assertEqual((thread[0].replies_shown, thread[0].more_replies),
+                         (4, CHILD_LIMIT + 1))
+        # The wide level is sliced in the database, the narrow chain
+        # under the worst root is read without a limit
+        reply_queries = [query['sql'] for query in queries
+                         if '"reddit_comment"."parent_id" = ' in query['sql']]
+        self.assertEqual(len(reply_queries), 1)
+        self.assertIn('LIMIT 4', reply_queries[0])
+
+    def test_comment_limit(self):
+        thread, _ = load_thread(self.comments(), comment_limit=10)
+        self.assertEqual(len(thread), 10)
+        self.assertEqual(sum(c.more_replies for c in thread if c.depth == 0),
+                         CHILD_LIMIT + 5 - 7 + 1)
+
+    def test_thread_has_placeholders(self):
+        r = self.c.get(reverse('thread', args=(self.submission.id,)))
+        self.assertContains(r, 'name="loadMore"', count=1)
+        self.assertContains(r, reverse('more_replies', args=(self.roots[2].id,)) +
+                            '?offset={}'.format(CHILD_LIMIT))
+        self.assertContains(r, 'load more replies (5)')
+
+    def test_more_replies(self):
+        self.c.login(**self.credentials)
+        wide = Comment.objects.filter(parent=self.roots[2]).order_by('id')
+        # Oldest and downvoted, so it stays among the last replies
+        Vote.create(self.author, wide[0], -1).save()
+
+        with CaptureQueriesContext(connection) as queries:
+            r = self.c.get(reverse('more_replies', args=(self.roots[2].id,)),
+                           {'offset': CHILD_LIMIT})
+        html = json.loads(r.content.decode("utf-8"))['html']
+        self.assertEqual(html.count('<div class="media">'), 5)
+        # Only the votes on the returned replies are looked up
+        comment_votes = [query['sql'] for query in queries
+                         if 'FROM "reddit_vote"' in query['sql'] and
+                         '"reddit_vote"."kind" = {}'.format(Vote.COMMENT)
+                         in query['sql']]
+        self.assertEqual(len(comment_votes), 1)
+        self.assertIn('"reddit_vote"."object_id" IN', comment_votes[0])
+        self.assertIn('data-what-id="{}"'.format(wide[0].id), html)
+        self.assertIn('downvoted', html)
+        self.assertNotIn('loadMore', html)
+
+    def test_more_comments(self):
+        r = self.c.get(reverse('more_comments', args=(self.submission.id,)),
+                       {'offset': 2})
+        html = json.loads(r.content.decode("utf-8"))['html']
+        self.assertIn('data-what-id="{}"'.format(self.chain_end.id), html)
+        self.assertNotIn('data-what-id="{}"'.format(self.roots[2].id), html)
+
+    def test_invalid_requests(self):
+        r = self.c.get(reverse('more_replies', args=(self.roots[0].id,)),
+                       {'offset': 'x'})
+        self.assertIsInstance(r, HttpResponseBadRequest)
+        r = self.c.get(reverse('more_replies', args=(9999,)))
+        self.assertEqual(r.status_code, 404)
+        r = self.c.post(reverse('more_comments', args=(self.submission.id,)))
+        self.assertIsInstance(r, HttpResponseNotAllowed)
+
+
+class TestCommentSorts(TestCase):
+    def setUp(self):
+        self.c = Client()
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(username="sorter"))
+        self.submission = Submission.objects.create(
+            title=get_random_string(length=12), author=self.author)
+        # Old and popular but divisive, and new with a few clean votes
+        self.divisive = self.create(self.submission, 40, 30)
+        self.clean = self.create(self.submission, 5, 0)
+        self.reply = self.create(self.divisive, 1, 0)
+        self.other_reply = self.create(self.divisive, 3, 3)
+
+    def create(self, parent, ups, downs):
+        comment = Comment.create(self.author, "comment", parent)
+        comment.ups, comment.downs, comment.score = ups, downs, ups - downs
+        comment.save()
+        return comment
+
+    def order(self, sort):
+        thread, _ = load_thread(
+            Comment.objects.filter(submission=self.submission), sort=sort)
+        return [comment.id for comment in thread]
+
+    def test_sorts(self):
+        divisive, clean = self.divisive.id, self.clean.id
+        reply, other_reply = self.reply.id, self.other_reply.id
+        self.assertEqual(self.order('best'),
+                         [clean, divisive, reply, other_reply])
+        self.assertEqual(self.order('top'),
+                         [divisive, reply, other_reply, clean])
+        self.assertEqual(self.order('new'),
+                         [clean, divisive, other_reply, reply])
+        self.assertEqual(self.order('old'),
+                         [divisive, reply, other_reply, clean])
+        self.assertEqual(self.order('controversial'),
+                         [divisive, other_reply, reply, clean])
+
+    def test_sorted_by_the_database(self):
+        # top level ids, the reply counts and the replies of every
+        # loaded level (two here, the second finds no replies) and
+        # the rows
+        for sort in SORTS:
+            with self.assertNumQueries(5):
+                self.order(sort)
+
+    def test_thread_view(self):
+        def position(html, comment):
+            return html.index('data-parent-id="{}" data-parent-type="comment"'
+                              .format(comment.id))
+
+        r = self.c.get(reverse('thread', args=(self.submission.id,)),
+                       {'sort': 'top'})
+        self.assertEqual(r.context['sort'], 'top')
+        html = r.content.decode("utf-8")
+        self.assertLess(position(html, self.divisive), position(html, self.clean))
+
+        r = self.c.get(reverse('thread', args=(self.submission.id,)))
+        self.assertEqual(r.context['sort'], 'best')
+        html = r.content.decode("utf-8")
+        self.assertLess(position(html, self.clean), position(html, self.divisive))
+
+    def test_invalid_sort(self):
+        r = self.c.get(reverse('thread', args=(self.submission.id,)),
+                       {'sort': 'random'})
+        self.assertEqual(r.status_code, 404)
+        r = self.c.get(reverse('more_comments', args=(self.submission.id,)),
+                       {'sort': 'random'})
+        self.assertIsInstance(r, HttpResponseBadRequest)
+
+
+class TestCommentPermalink(TestCase):
+    def setUp(self):
+        self.c = Client()
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(username="linker"))
+        self.submission = Submission.objects.create(
+            title=get_random_string(length=12), author=self.author)
+        self.chain = []
+        parent = self.submission
+        for _ in range(6):
+            parent = Comment.create(self.author, "chain", parent)
+            parent.save()
+            self.chain.append(parent)
+        # Siblings of the linked comment and its ancestors aren't shown
+        for parent in [self.submission] + self.chain[:3]:
+            Comment.create(self.author, "unrelated", parent).save()
+        self.linked = self.chain[3]
+
+    def get(self, comment, **params):
+        return self.c.get(reverse('comment_permalink',
+                                  args=(comment.submission_id, comment.id)),
+                          params)
+
+    def shown_ids(self, response):
+        return [int(pk) for pk in re.findall(
+            r'data-parent-id="(\d+)" data-parent-type="comment"',
+            response.content.decode("utf-8"))]
+
+    def test_ancestor_ids(self):
+        linked = Comment.objects.get(id=self.linked.id)
+        self.assertEqual(linked.ancestor_ids(),
+                         [comment.id for comment in self.chain[:3]])
+        self.assertEqual(self.chain[0].ancestor_ids(), [])
+
+    def test_permalink(self):
+        r = self.get(self.linked)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.shown_ids(r),
+                         [comment.id for comment in self.chain[3:]])
+        self.assertContains(r, "view the rest of the comments")
+        self.assertNotContains(r, "unrelated")
+
+    def test_context(self):
+        r = self.get(self.linked, context=2)
+        self.assertEqual(self.shown_ids(r),
+                         [comment.id for comment in self.chain[1:]])
+        # More context than there are ancestors
+        r = self.get(self.linked, context=100)
+        self.assertEqual(self.shown_ids(r),
+                         [comment.id for comment in self.chain])
+        self.assertNotContains(r, "unrelated")
+
+    def test_slice_only(self):
+        comments = Comment.objects.filter(submission=self.submission)
+        linked = Comment.objects.get(id=self.linked.id)
+        # the ancestors, then the replies as load_thread reads them:
+        # their ids, counts and ids of each level below and the rows
+        with self.assertNumQueries(1 + 5):
+            thread = load_context(comments, linked, context=1)
+        self.assertEqual([comment.id for comment in thread],
+                         [comment.id for comment in self.chain[2:]])
+
+    def test_invalid_requests(self):
+        r = self.get(self.linked, context='x')
+        self.assertIsInstance(r, HttpResponseBadRequest)
+        other = Submission.objects.create(title="other", author=self.author)
+        r = self.c.get(reverse('comment_permalink',
+                               args=(other.id, self.linked.id)))
+        self.assertEqual(r.status_code, 404)
+
+
+class TestNewComments(TestCase):
+    def setUp(self):
+        self.c = Client()
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(username="poller"))
+        self.submission = Submission.objects.create(
+            title=get_random_string(length=12), author=self.author)
+        self.root = Comment.create(self.author, "old root", self.submission)
+        self.root.save()
+
+    def get(self, after):
+        r = self.c.get(reverse('new_comments', args=(self.submission.id,)),
+                       {'after': after})
+        self.assertEqual(r.status_code, 200)
+        return json.loads(r.content.decode("utf-8"))
+
+    def test_marker_on_thread_page(self):
+        r = self.c.get(reverse('thread', args=(self.submission.id,)))
+        self.assertContains(r, 'data-last-id="{}"'.format(self.root.id))
+        self.assertContains(r, 'name="newComments"')
+
+    def test_newer_comments(self):
+        reply = Comment.create(self.author, "new reply", self.root)
+        reply.save()
+        root = Comment.create(self.author, "new root", self.submission)
+        root.save()
+        other = Submission.objects.create(title="other", author=self.author)
+        Comment.create(self.author, "elsewhere", other).save()
+
+        response = self.get(self.root.id)
+        self.assertEqual([(item['id'], item['parent_id'])
+                          for item in response['comments']],
+                         [(reply.id, self.root.id), (root.id, None)])
+        self.assertIn('<p>new reply</p>', response['comments'][0]['html'])
+        self.assertEqual(response['last_id'], root.id)
+        self.assertFalse(response['more'])
+
+        response = self.get(root.id)
+        self.assertEqual(response['comments'], [])
+        self.assertEqual(response['last_id'], root.id)
+
+    def test_invalid_requests(self):
+        r = self.c.get(reverse('new_comments', args=(self.submission.id,)),
+                       {'after': 'x'})
+        self.assertIsInstance(r, HttpResponseBadRequest)
+        r = self.c.get(reverse('new_comments', args=(9999,)))
+        self.assertEqual(r.status_code, 404)
+
+
+class TestStreamingThread(TestCase):
+    def setUp(self):
+        self.c = Client()
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(username="streamer"))
+        self.submission = Submission.objects.create(
+            title="streamed thread", author=self.author)
+        self.expected = []
+        for i in range(3):
+            root = Comment.create(self.author, "root", self.submission)
+            root.save()
+            self.expected.append(root.id)
+            reply = Comment.create(self.author, "reply", root)
+            reply.save()
+            self.expected.append(reply.id)
+            # Replies past every bound of the regular thread page
+            for _ in range(i * CHILD_LIMIT):
+                nested = Comment.create(self.author, "nested", reply)
+                nested.save()
+                self.expected.append(nested.id)
+
+    def comments(self):
+        return Comment.objects.filter(submission=self.submission)
+
+    def test_chunks(self):
+        chunks = list(iter_thread_chunks(self.comments(), chunk_size=7))
+        self.assertTrue(all(len(chunk) <= 7 for chunk in chunks))
+        self.assertEqual([comment.id for chunk in chunks for comment in chunk],
+                         self.expected)
+
+        whole = render_comment_tree(self.comments().order_by('path'), {})
+        chunked = ''.join(render_comment_chunks(
+            iter_thread_chunks(self.comments(), chunk_size=7), {}))
+        self.assertEqual(chunked, whole)
+
+    def test_stream(self):
+        r = self.c.get(reverse('thread_stream', args=(self.submission.id,)))
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.streaming)
+        content = iter(r.streaming_content)
+        # The page up to the comments is rendered before the response
+        with self.assertNumQueries(0):
+            head = next(content).decode("utf-8")
+        self.assertIn("streamed thread", head)
+        self.assertNotIn('data-what-type="comment"', head)
+
+        parts = [part.decode("utf-8") for part in content]
+        tree, tail = ''.join(parts[:-1]), parts[-1]
+        self.assertEqual([int(pk) for pk in re.findall(
+            r'data-parent-id="(\d+)" data-parent-type="comment"', tree)],
+            self.expected)
+        self.assertNotIn('name="loadMore"', tree)
+        self.assertEqual(tree.count('<div'), tree.count('</div>'))
+        self.assertIn('applyCommentVotes', tail)
+
+    def test_invalid_thread(self):
+        r = self.c.get(reverse('thread_stream', args=(9999,)))
+        self.assertEqual(r.status_code, 404)
+
+
+class TestCollapsedComments(TestCase):
+    def setUp(self):
+        self.c = Client()
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(username="collapser"))
+        self.submission = Submission.objects.create(
+            title=get_random_string(length=12), author=self.author)
+        self.good = Comment.create(self.author, "good root", self.submission)
+        self.good.score = self.good.ups = 1
+        self.good.save()
+        self.buried = Comment.create(self.author, "buried root",
+                                     self.submission)
+        self.buried.score = self.buried.downs = COLLAPSE_SCORE - 1
+        self.buried.save()
+        self.reply = Comment.create(self.author, "buried reply", self.buried)
+        self.reply.save()
+        # Collapsed below a comment that is shown
+        self.bad_reply = Comment.create(self.author, "bad reply", self.good)
+        self.bad_reply.score = COLLAPSE_SCORE - 1
+        self.bad_reply.save()
+
+    def comments(self):
+        return Comment.objects.filter(submission=self.submission)
+
+    def test_load(self):
+        thread, _ = load_thread(self.comments())
+        self.assertEqual([(c.id, c.collapsed) for c in thread],
+                         [(self.good.id, False), (self.bad_reply.id, True),
+                          (self.buried.id, True)])
+        self.assertIn('html_comment', thread[1].get_deferred_fields())
+        self.assertNotIn('html_comment', thread[0].get_deferred_fields())
+
+        thread, _ = load_thread(self.comments(), collapse_score=None)
+        self.assertEqual(len(thread), 4)
+        self.assertFalse(any(c.collapsed for c in thread))
+
+    def test_stub(self):
+        r = self.c.get(reverse('thread', args=(self.submission.id,)))
+        self.assertContains(r, 'good root')
+        self.assertNotContains(r, 'buried')
+        self.assertNotContains(r, 'bad reply')
+        self.assertContains(r, 'name="expandComment"', count=2)
+        self.assertContains(r, reverse('expand_comment', args=(self.buried.id,)))
+
+        thread, _ = load_thread(self.comments())
+        html = render_comment_tree(thread, {})
+        self.assertEqual(html.count('<div'), html.count('</div>'))
+
+    def test_expand(self):
+        r = self.c.get(reverse('expand_comment', args=(self.buried.id,)),
+                       {'sort': 'new'})
+        html = json.loads(r.content.decode("utf-8"))['html']
+        self.assertIn('buried root', html)
+        self.assertIn('buried reply', html)
+        self.assertNotIn('expandComment', html)
+
+        r = self.c.get(reverse('expand_comment', args=(9999,)))
+        self.assertEqual(r.status_code, 404)
+        r = self.c.get(reverse('expand_comment', args=(self.buried.id,)),
+                       {'sort': 'random'})
+        self.assertIsInstance(r, HttpResponseBadRequest)
+
+
 class TestPostingComment(TestCase):
     def setUp(self):
         self.c = Client()
@@ -213,3 +726,139 @@ class TestPostingComment(TestCase):
         comment = Comment.objects.filter(submission=thread,
                                          id=2).first()
         self.assertEqual(comment.html_comment, '<p>thread reply comment</p>\n')
+
+    def test_reply_too_deep(self):
+        self.c.login(**self.credentials)
+        thread = Submission.objects.get(id=99)
+        author = RedditUser.objects.get(user__username=self.credentials['username'])
+        comment = Comment.create(author, 'deep comment', thread)
+        comment.save()
+        Comment.objects.filter(id=comment.id).update(depth=Comment.MAX_DEPTH - 1)
+
+        r = self.c.post(reverse('post_comment'),
+                        data={'parentType': 'comment',
+                              'parentId': comment.id,
+                              'commentContent': 'too deep'})
+        json_r = json.loads(r.content.decode("utf-8"))
+        self.assertEqual(json_r['msg'], 'This thread is nested too deep to reply.')
+        self.assertEqual(Comment.objects.filter(submission=thread).count(), 1)
+
+
+class TestCommentCount(TestCase):
+    def setUp(self):
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(username="counter"))
+        self.submission = Submission.objects.create(
+            author=self.author, author_name="counter", title="counted",
+            text="long text " * 100)
+
+    def test_count_updated_atomically(self):
+        stale = Submission.objects.get(id=self.submission.id)
+        with self.assertNumQueries(1):
+            comment = Comment.create(self.author, "first", self.submission)
+        comment.save()
+        self.assertEqual(self.submission.comment_count, 1)
+
+        # A stale copy adds to the stored count instead of overwriting it
+        Comment.create(self.author, "second", stale).save()
+        self.assertEqual(
+            Submission.objects.get(id=self.submission.id).comment_count, 2)
+
+        stale.change_comment_count(-1)
+        self.assertEqual(
+            Submission.objects.get(id=self.submission.id).comment_count, 1)
+
+    def test_recount_comments(self):
+        other = Submission.objects.create(
+            author=self.author, author_name="counter", title="other")
+        for parent in (self.submission, self.submission, other):
+            Comment.create(self.author, "comment", parent).save()
+        Submission.objects.filter(id=self.submission.id).update(comment_count=7)
+
+        out = StringIO()
+        call_command('recount_comments', chunk_size=1, stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Updated 1 submissions")
+        self.assertEqual(
+            Submission.objects.get(id=self.submission.id).comment_count, 2)
+        self.assertEqual(Submission.objects.get(id=other.id).comment_count, 1)
+
+
+class TestEditingComment(TestCase):
+    def setUp(self):
+        self.c = Client()
+        self.credentials = {'username': 'editor',
+                            'password': 'password'}
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(**self.credentials))
+        self.other = RedditUser.objects.create(
+            user=User.objects.create_user(username="other",
+                                          password="password"))
+        self.submission = Submission.objects.create(
+            title=get_random_string(length=12), author=self.author)
+        self.comment = Comment.create(self.author, "original", self.submission)
+        self.comment.save()
+        self.reply = Comment.create(self.other, "reply", self.comment)
+        self.reply.save()
+
+    def post(self, name, **data):
+        r = self.c.post(reverse(name), data=data)
+        self.assertEqual(r.status_code, 200)
+        return json.loads(r.content.decode("utf-8"))
+
+    def test_edit(self):
+        with self.assertNumQueries(1):
+            self.comment.edit("*edited*")
+        comment = Comment.objects.get(id=self.comment.id)
+        self.assertEqual(comment.raw_comment, "*edited*")
+        self.assertEqual(comment.html_comment, "<p><em>edited</em></p>\n")
+
+        self.c.login(**self.credentials)
+        response = self.post('edit_comment', commentId=self.comment.id,
+                             commentContent="again")
+        self.assertEqual(response['msg'], "Your comment has been edited.")
+        self.assertEqual(response['html'], "<p>again</p>\n")
+        r = self.c.get(reverse('thread', args=(self.submission.id,)))
+        self.assertContains(r, "<p>again</p>")
+
+    def test_delete(self):
+        path = Comment.objects.get(id=self.reply.id).path
+        with self.assertNumQueries(1):
+            self.comment.tombstone()
+
+        comment = Comment.objects.get(id=self.comment.id)
+        self.assertTrue(comment.deleted)
+        self.assertEqual((comment.author_name, comment.raw_comment),
+                         (Comment.DELETED_AUTHOR, ''))
+        reply = Comment.objects.get(id=self.reply.id)
+        self.assertEqual((reply.parent_id, reply.path),
+                         (self.comment.id, path))
+
+        r = self.c.get(reverse('thread', args=(self.submission.id,)))
+        self.assertContains(r, "[deleted]")
+        self.assertNotContains(r, "original")
+        self.assertContains(r, "<p>reply</p>")
+
+    def test_delete_view(self):
+        self.c.login(**self.credentials)
+        response = self.post('delete_comment', commentId=self.comment.id)
+        self.assertEqual(response['msg'], "Your comment has been deleted.")
+        self.assertTrue(Comment.objects.get(id=self.comment.id).deleted)
+
+        response = self.post('edit_comment', commentId=self.comment.id,
+                             commentContent="back")
+        self.assertEqual(response['msg'], "This comment has been deleted.")
+
+    def test_invalid_requests(self):
+        response = self.post('edit_comment', commentId=self.comment.id,
+                             commentContent="logged out")
+        self.assertEqual(response['msg'], "You need to log in to edit comments.")
+
+        self.c.login(**self.credentials)
+        r = self.c.post(reverse('delete_comment'), data={'commentId': self.reply.id})
+        self.assertIsInstance(r, HttpResponseForbidden)
+        r = self.c.post(reverse('edit_comment'), data={'commentId': 'x'})
+        self.assertIsInstance(r, HttpResponseBadRequest)
+        r = self.c.get(reverse('edit_comment'))
+        self.assertIsInstance(r, HttpResponseNotAllowed)
+        response = self.post('edit_comment', commentId=self.comment.id)
+        self.assertEqual(response['msg'], "You have to write something.")
@@ -1,7 +1,12 @@
+from datetime import timedelta
+
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from reddit.models import Submission, Vote
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.utils.crypto import get_random_string
 from users.models import RedditUser
 
@@ -52,6 +57,68 @@ class TestFrontPageGET(TestCase):
         self.assertTrue(r.context['submissions'].has_previous())
         self.assertEqual(r.context['submissions'].previous_page_number(), 1)
 
+    def test_cursor_pages_match_page_numbers(self):
+        r = self.c.get(reverse('frontpage'))
+        first_page = r.context['submissions']
+        self.assertIsNone(first_page.previous_cursor)
+
+        r = self.c.get(reverse('frontpage'),
+                       data={'after': first_page.next_cursor})
+        second_page = r.context['submissions']
+        self.assertTrue(second_page.has_previous())
+        self.assertFalse(second_page.has_next())
+        self.assertIsNone(second_page.next_cursor)
+
+        r = self.c.get(reverse('frontpage'), data={'page': 2})
+        self.assertEqual([s.id for s in second_page],
+                         [s.id for s in r.context['submissions']])
+
+        r = self.c.get(reverse('frontpage'),
+                       data={'before': second_page.previous_cursor})
+        self.assertEqual([s.id for s in r.context['submissions']],
+                         [s.id for s in first_page])
+        self.assertEqual(r.context['submissions'].number, 1)
+        self.assertFalse(r.context['submissions'].has_previous())
+
+    def test_equal_scores_are_not_skipped(self):
+        Submission.objects.update(score=1)
+        seen = []
+        cursor = None
+        for _ in range(2):
+            r = self.c.get(reverse('frontpage'),
+                           data={'after': cursor} if cursor else {})
+            seen.extend(s.id for s in r.context['submissions'])
+            cursor = r.context['submissions'].next_cursor
+        self.assertEqual(sorted(seen), list(range(1, 51)))
+        self.assertIsNone(cursor)
+
+    def test_empty_cursor_page_links_back(self):
+        r = self.c.get(reverse('frontpage'))
+        first_ids = [s.id for s in r.context['submissions']]
+        cursor = r.context['submissions'].next_cursor
+        # The cursor row and everything after it were deleted
+        Submission.objects.exclude(id__in=first_ids[:-1]).delete()
+
+        r = self.c.get(reverse('frontpage'), data={'after': cursor})
+        page = r.context['submissions']
+        self.assertEqual(len(page), 0)
+        self.assertEqual(page.previous_cursor, cursor)
+        self.assertNotContains(r, 'page=')
+
+        r = self.c.get(reverse('frontpage'), data={'before': cursor})
+        self.assertEqual([s.id for s in r.context['submissions']],
+                         first_ids[:-1])
+
+    def test_invalid_cursor(self):
+        r = self.c.get(reverse('frontpage'), data={'after': 'not a cursor'})
+        self.assertEqual(r.status_code, 404)
+
+    def test_cursor_page_skips_count(self):
+        r = self.c.get(reverse('frontpage'))
+        cursor = r.context['submissions'].next_cursor
+        with self.assertNumQueries(3):
+            self.c.get(reverse('frontpage'), data={'after': cursor})
+
 
 class TestFrontpageVotes(TestCase):
     def setUp(self):
@@ -116,3 +183,101 @@ class TestFrontpageVotes(TestCase):
         self.assertEqual(upvote_keys, [41, 31])
         self.assertEqual(downvote_keys, [32, 47],
                          msg="Got wrong values for submission downvotes")
+
+    def test_vote_lookup_query_count(self):
+        self.c.login(username='username', password='password')
+        # request savepoint pair, session, user, submission page,
+        # reddit user and one query for all the page votes.
+        with self.assertNumQueries(7):
+            r = self.c.get(reverse('frontpage'))
+        self.assertEqual(len(r.context['submission_votes']), 5)
+
+
+class TestListingSorts(TestCase):
+    def setUp(self):
+        self.c = Client()
+        author = RedditUser.objects.create(
+            user=User.objects.create_user(username="username",
+                                          password="password"))
+        now = timezone.now()
+        # (ups, downs, age in hours)
+        for ups, downs, age in [(10, 0, 1), (50, 45, 30), (100, 10, 200),
+                                (3, 3, 2), (1, 0, 0)]:
+            Submission.objects.create(title=get_random_string(length=20),
+                                      author=author,
+                                      ups=ups, downs=downs, score=ups - downs,
+                                      timestamp=now - timedelta(hours=age))
+
+    def listing_ids(self, url_name, **params):
+        r = self.c.get(reverse(url_name), data=params)
+        self.assertEqual(r.status_code, 200)
+        return [submission.id for submission in r.context['submissions']]
+
+    def test_new(self):
+        self.assertEqual(self.listing_ids('new'), [5, 1, 4, 2, 3])
+
+    def test_top(self):
+        self.assertEqual(self.listing_ids('top'), [3, 1, 2, 5, 4])
+        self.assertEqual(self.listing_ids('top', t='all'), [3, 1, 2, 5, 4])
+        self.assertEqual(self.listing_ids('top', t='week'), [1, 2, 5, 4])
+        self.assertEqual(self.listing_ids('top', t='day'), [1, 5, 4])
+
+    def test_top_invalid_period(self):
+        r = self.c.get(reverse('top'), data={'t': 'decade'})
+        self.assertEqual(r.status_code, 404)
+
+    def test_controversial(self):
+        self.assertEqual(self.listing_ids('controversial')[:3], [2, 4, 3])
+
+    def test_rising(self):
+        self.assertEqual(self.listing_ids('rising'), [1, 5, 4])
+
+    def test_sort_keys_follow_votes(self):
+        author = RedditUser.objects.get(user__username="username")
+        submission = Submission.objects.get(id=4)
+        Vote.create(user=author, vote_object=submission, vote_value=1).save()
+        submission = Submission.objects.get(id=5)
+        Vote.create(user=author, vote_object=submission, vote_value=-1).save()
+        self.assertEqual(self.listing_ids('controversial')[:2], [2, 4])
+        self.assertEqual(self.listing_ids('top', t='day'), [1, 4, 5])
+
+    def test_cursor_keeps_sort(self):
+        for url_name in ['frontpage', 'new', 'top', 'controversial']:
+            all_ids = self.listing_ids(url_name)
+            paginator_ids = []
+            r = self.c.get(reverse(url_name))
+            paginator = r.context['submissions'].paginator
+            paginator.per_page = 2
+            page = paginator.page()
+            while True:
+                paginator_ids.extend(s.id for s in page)
+                if not page.next_cursor:
+                    break
+                page = paginator.page(after=page.next_cursor)
+            self.assertEqual(paginator_ids, all_ids)
+
+    def test_period_cursors(self):
+        for url_name, params in [('top', {'t': 'week'}), ('top', {'t': 'day'}),
+                                 ('rising', {})]:
+            all_ids = self.listing_ids(url_name, **params)
+            r = self.c.get(reverse(url_name), data=params)
+            paginator = r.context['submissions'].paginator
+            self.assertFalse(paginator.key_index)
+            paginator.per_page = 1
+            pages = [paginator.page()]
+            while pages[-1].next_cursor:
+                pages.append(paginator.page(after=pages[-1].next_cursor))
+            self.assertEqual([s.id for page in pages for s in page], all_ids)
+            page = paginator.page(before=pages[-1].previous_cursor)
+            self.assertEqual([s.id for s in page], all_ids[-2:-1])
+
+    def test_period_sorts_period_ids(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.listing_ids('top', t='week')
+        listing = [query['sql'] for query in queries
+                   if 'ORDER BY' in query['sql']
+                   and 'FROM "reddit_submission"' in query['sql']]
+        # Only the ids are sorted, the rows of the page are read by id
+        self.assertEqual(len(listing), 1)
+        self.assertTrue(listing[0].startswith(
+            'SELECT "reddit_submission"."id" FROM'))
@@ -0,0 +1,178 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import Client, SimpleTestCase, TransactionTestCase, \
+    override_settings
+from django.utils.crypto import get_random_string
+
+from reddit.models import Submission, Vote
+from reddit.utils import listing_index
+from reddit.utils.listing_index import ListingIndex
+from users.models import RedditUser
+
+
+class TestListingIndex(SimpleTestCase):
+    def setUp(self):
+        self.index = ListingIndex('score', 4)
+        self.index.entries = [(1, 5), (2, 4), (3, 3), (4, 2)]
+        self.index.keys = {pk: key for key, pk in self.index.entries}
+        self.index.version = 1
+
+    def test_seek(self):
+        self.assertEqual(self.index.seek(2), [2, 3, 4])
+        self.assertEqual(self.index.seek(1, after=(3, 3)), [4, 5])
+        self.assertEqual(self.index.seek(2, before=(2, 4)), [3, 2])
+        # Page reaches past the last indexed submission
+        self.assertIsNone(self.index.seek(2, after=(3, 3)))
+        self.assertIsNone(self.index.seek(2, before=(0, 9)))
+
+    def test_complete_index_serves_partial_pages(self):
+        self.index.complete = True
+        self.assertEqual(self.index.seek(2, after=(3, 3)), [4, 5])
+
+    def test_update_moves_entry(self):
+        self.index.update(5, 10)
+        self.assertEqual(self.index.seek(3), [5, 2, 3, 4])
+
+    def test_update_drops_entries_below_index(self):
+        self.index.update(2, 0)
+        self.assertEqual(self.index.entries, [(1, 5), (2, 4), (3, 3)])
+        self.index.update(3, 0)
+        self.assertFalse(self.index.stale)
+        self.index.update(4, 0)
+        self.assertTrue(self.index.stale)
+
+    def test_update_inserts_and_evicts(self):
+        self.index.update(9, 5)
+        self.assertEqual(self.index.entries, [(2, 4), (3, 3), (4, 2), (5, 9)])
+        self.index.update(8, 0)
+        self.assertNotIn(8, self.index.keys)
+
+
+@override_settings(LISTING_INDEX_SIZE=30)
+class TestIndexedFrontpage(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        listing_index.clear()
+        self.c = Client()
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(username="username",
+                                          password="password"))
+        # ids in listing order, sequences aren't reset between tests
+        self.ids = [Submission.objects.create(
+            score=50 - i, title=get_random_string(length=20),
+            author=self.author).id for i in range(50)]
+
+    def tearDown(self):
+        listing_index.clear()
+
+    def page_ids(self, **params):
+        r = self.c.get(reverse('top'), data=params)
+        return r, [submission.id for submission in r.context['submissions']]
+
+    def test_pages_match_database(self):
+        r, first_ids = self.page_ids()
+        self.assertEqual(first_ids, self.ids[:25])
+        index = listing_index.get_index('score', Submission.objects.all())
+        self.assertEqual(len(index.entries), 30)
+
+        # Second page reaches past the index and is read from the database
+        cursor = r.context['submissions'].next_cursor
+        r, second_ids = self.page_ids(after=cursor)
+        self.assertEqual(second_ids, self.ids[25:])
+
+        r, ids = self.page_ids(before=r.context['submissions'].previous_cursor)
+        self.assertEqual(ids, first_ids)
+
+    def test_served_from_index(self):
+        self.page_ids()
+        # Request transaction and the id__in fetch of the page
+        with self.assertNumQueries(2):
+            self.page_ids()
+
+    def test_votes_update_index(self):
+        self.page_ids()
+        voter = RedditUser.objects.create(
+            user=User.objects.create_user(username="voter",
+                                          password="password"))
+        submission_id = self.ids[39]
+        vote = Vote.create(user=voter,
+                           vote_object=Submission.objects.get(id=submission_id),
+                           vote_value=1)
+        vote.save()
+        Submission.objects.filter(id=submission_id).update(score=100)
+        Vote.objects.get(id=vote.id).change_vote(-1)
+
+        index = listing_index.get_index('score', Submission.objects.all())
+        self.assertEqual(index.entries[-1], (98, submission_id))
+        _, ids = self.page_ids()
+        self.assertEqual(ids[0], submission_id)
+
+    def test_other_worker_change_triggers_rebuild(self):
+        self.page_ids()
+        index = listing_index.get_index('score', Submission.objects.all())
+        Submission.objects.filter(id=self.ids[44]).update(score=1000)
+        cache.incr(listing_index.VERSION_CACHE_KEY)
+
+        _, ids = self.page_ids()
+        self.assertEqual(ids[0], self.ids[44])
+        self.assertEqual(index.version,
+                         cache.get(listing_index.VERSION_CACHE_KEY))
+
+    def test_changes_are_caught_up(self):
+        self.page_ids()
+        index = listing_index.get_index('score', Submission.objects.all())
+        # Logged by another worker
+        for score in (1000, 1001):
+            Submission.objects.filter(id=self.ids[44]).update(score=score)
+            listing_index._log(self.ids[44])
+
+        # Only the changed submission is read, once
+        with self.assertNumQueries(1):
+            listing_index.get_index('score', Submission.objects.all())
+        self.assertEqual(index.entries[-1], (1001, self.ids[44]))
+        self.assertEqual(len(index.entries), 30)
+        self.assertEqual(index.version, listing_index.version())
+
+    def test_evicted_version_rebuilds(self):
+        self.page_ids()
+        old_version = listing_index.version()
+        cache.delete(listing_index.VERSION_CACHE_KEY)
+        Submission.objects.filter(id=self.ids[44]).update(score=1000)
+        listing_index._log(self.ids[44])
+
+        self.assertGreater(listing_index.version(), old_version)
+        _, ids = self.page_ids()
+        self.assertEqual(ids[0], self.ids[44])
+
+    def test_recomputed_sort_keys_rebuild(self):
+        r = self.c.get(reverse('frontpage'))
+        hot_ids = [submission.id for submission in r.context['submissions']]
+        self.assertEqual(hot_ids, self.ids[:25])
+        # Written around the change log, as a ranking formula change would
+        for i, pk in enumerate(self.ids):
+            Submission.objects.filter(id=pk).update(score=i)
+
+        call_command('recompute_hot_ranks', stdout=StringIO())
+        r = self.c.get(reverse('frontpage'))
+        hot_ids = [submission.id for submission in r.context['submissions']]
+        self.assertEqual(hot_ids, self.ids[::-1][:25])
+
+    def test_evicted_in_the_same_microsecond(self):
+        clock = listing_index.time
+        now = clock()
+        listing_index.time = lambda: now
+        try:
+            cache.delete(listing_index.VERSION_CACHE_KEY)
+            self.page_ids()
+            cache.delete(listing_index.VERSION_CACHE_KEY)
+            Submission.objects.filter(id=self.ids[44]).update(score=1000)
+            # Seeds the same version the index is at
+            listing_index._log(self.ids[44])
+            _, ids = self.page_ids()
+        finally:
+            listing_index.time = clock
+        self.assertEqual(ids[0], self.ids[44])
@@ -0,0 +1,267 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+import mistune
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from reddit.management.commands import rerender_html
+from reddit.models import Comment, Submission
+from reddit.utils import markdown, metrics
+from users.models import RedditUser
+
+SAMPLES = (
+    "plain text",
+    "**bold** and [a link](http://example.com)",
+    "<script>alert('x')</script>",
+    "[ref][1] and a footnote[^note]\n\n[1]: http://example.com\n[^note]: text",
+    "* list\n* items\n\n    code",
+)
+
+
+class TestMarkdown(SimpleTestCase):
+    def setUp(self):
+        markdown.clear()
+        cache.clear()
+
+    def test_same_output_as_mistune(self):
+        for text in SAMPLES * 2:
+            self.assertEqual(markdown.render(text), mistune.markdown(text))
+
+    @override_settings(MARKDOWN_LRU_SIZE=2)
+    def test_lru(self):
+        before = metrics.snapshot()
+        for text in ("one", "two", "one", "three", "two"):
+            markdown.render(text)
+        after = metrics.snapshot()
+
+        def diff(name):
+            return after.get(name, 0) - before.get(name, 0)
+
+        # "two" was evicted by "three"
+        self.assertEqual(diff('markdown.lru_hits'), 1)
+        self.assertEqual(diff('markdown.misses'), 4)
+        self.assertEqual(len(markdown._lru), 2)
+        self.assertIn('markdown.hit_ratio', after)
+
+    @override_settings(MARKDOWN_CACHE_TIMEOUT=60)
+    def test_shared_cache(self):
+        html = markdown.render("shared")
+        markdown.clear()
+        before = metrics.snapshot().get('markdown.cache_hits', 0)
+        self.assertEqual(markdown.render("shared"), html)
+        self.assertEqual(metrics.snapshot()['markdown.cache_hits'], before + 1)
+
+
+class TestRerenderHtml(TestCase):
+    def setUp(self):
+        self.user = RedditUser.objects.create(
+            user=User.objects.create_user(username="rerender"),
+            about_text="*about*")
+        self.submission = Submission.objects.create(
+            author=self.user, author_name="rerender", title="title",
+            text="**text**")
+        self.comments = []
+        for i in range(3):
+            comment = Comment.create(self.user, "comment {}".format(i),
+                                     self.submission)
+            comment.save()
+            self.comments.append(comment)
+        self.comments[2].tombstone()
+
+        # Html left behind by an older renderer
+        RedditUser.objects.update(about_html="stale")
+        Submission.objects.update(text_html="stale")
+        Comment.objects.update(html_comment="stale", render_version=0)
+
+    def rerender(self, *args, **options):
+        out = StringIO()
+        call_command('rerender_html', *args, stdout=out, chunk_size=1,
+                     **options)
+        return out.getvalue()
+
+    def assertRendered(self):
+        self.assertEqual(RedditUser.objects.get().about_html,
+                         "<p><em>about</em></p>\n")
+        self.assertEqual(Submission.objects.get().text_html,
+                         "<p><strong>text</strong></p>\n")
+        self.assertEqual(
+            list(Comment.objects.order_by('id')
+                 .values_list('html_comment', flat=True)),
+            ["<p>comment 0</p>\n", "<p>comment 1</p>\n", "stale"])
+
+    def test_rerender(self):
+        out = self.rerender(workers=1)
+        self.assertRendered()
+        self.assertIn("Updated 2 of 2 comments", out)
+        self.assertIn("Updated 1 of 1 users", out)
+        self.assertEqual(
+            list(Comment.objects.order_by('id')
+                 .values_list('render_version', flat=True)),
+            [markdown.RENDER_VERSION, markdown.RENDER_VERSION, 0])
+
+        out = self.rerender('comments', workers=1)
+        self.assertIn("Updated 0 of 2 comments", out)
+        self.assertNotIn("users", out)
+
+    def test_edited_rows_kept(self):
+        render_chunk = rerender_html.render_chunk
+
+        def edit_then_render(rows):
+            # Edited after the chunk was read, before it's written
+            self.comments[0].edit("edited")
+            return render_chunk(rows)
+
+        rerender_html.render_chunk = edit_then_render
+        try:
+            out = self.rerender('comments', workers=1)
+        finally:
+            rerender_html.render_chunk = render_chunk
+        self.assertIn("Updated 1 of 2 comments", out)
+        self.assertIn("Skipped 1 comments", out)
+        self.assertEqual(
+            list(Comment.objects.order_by('id')
+                 .values_list('html_comment', flat=True)),
+            ["<p>edited</p>\n", "<p>comment 1</p>\n", "stale"])
+
+    def test_process_pool(self):
+        self.rerender(workers=2)
+        self.assertRendered()
+
+    def test_checkpoint(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'checkpoint.json')
+
+        self.rerender('comments', workers=1, checkpoint=path)
+        with open(path) as f:
+            self.assertEqual(json.load(f), {'comments': self.comments[1].id})
+
+        Comment.objects.update(html_comment="stale")
+        new = Comment.create(self.user, "new", self.submission)
+        new.save()
+        out = self.rerender('comments', workers=1, checkpoint=path)
+        self.assertIn("Resuming comments after pk {}".format(
+            self.comments[1].id), out)
+        self.assertEqual(
+            list(Comment.objects.order_by('id')
+                 .values_list('html_comment', flat=True)),
+            ["stale", "stale", "stale", "<p>new</p>\n"])
+
+
+@override_settings(MARKDOWN_LAZY_RENDER=True)
+class TestLazyRender(TestCase):
+    def setUp(self):
+        self.c = Client()
+        self.user = RedditUser.objects.create(
+            user=User.objects.create_user(username="lazy"),
+            about_text="*about*")
+        self.submission = Submission.objects.create(
+            author=self.user, author_name="lazy", title="title",
+            text="**text**")
+        for i in range(3):
+            Comment.create(self.user, "comment {}".format(i),
+                           self.submission).save()
+        Comment.objects.order_by('-id').first().tombstone()
+
+        # Rendered by an older version
+        RedditUser.objects.update(about_html="stale", render_version=0)
+        Submission.objects.update(text_html="stale", render_version=0)
+        Comment.objects.update(html_comment="stale", render_version=0)
+
+    def assertRefreshed(self):
+        self.assertEqual(
+            list(Comment.objects.order_by('id')
+                 .values_list('html_comment', 'render_version')),
+            [("<p>comment 0</p>\n", markdown.RENDER_VERSION),
+             ("<p>comment 1</p>\n", markdown.RENDER_VERSION),
+             ("stale", 0)])
+
+    def test_thread_page(self):
+        url = reverse('thread', args=(self.submission.id,))
+        with CaptureQueriesContext(connection) as queries:
+            r = self.c.get(url)
+        self.assertContains(r, "<strong>text</strong>")
+        self.assertContains(r, "<p>comment 1</p>")
+        self.assertRefreshed()
+        self.assertEqual(Submission.objects.get().render_version,
+                         markdown.RENDER_VERSION)
+        # Both comments in one batch
+        updates = [query for query in queries
+                   if query['sql'].startswith('UPDATE "reddit_comment"')]
+        self.assertEqual(len(updates), 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.c.get(url)
+        self.assertFalse([query for query in queries
+                          if query['sql'].startswith('UPDATE')])
+
+    def test_stream(self):
+        r = self.c.get(reverse('thread_stream', args=(self.submission.id,)))
+        self.assertIn("<p>comment 0</p>",
+                      b''.join(r.streaming_content).decode('utf-8'))
+        self.assertRefreshed()
+
+    def test_api(self):
+        r = self.c.get(reverse('thread_api', args=(self.submission.id,)),
+                       {'fields': 'id,html'})
+        data = json.loads(r.content.decode('utf-8'))
+        self.assertEqual(data['submission']['html'],
+                         "<p><strong>text</strong></p>\n")
+        self.assertEqual([html for _, html in data['comments']],
+                         ["<p>comment 0</p>\n", "<p>comment 1</p>\n",
+                          "stale"])
+        self.assertRefreshed()
+
+    def test_new_comments(self):
+        url = reverse('new_comments', args=(self.submission.id,))
+        with CaptureQueriesContext(connection) as queries:
+            r = self.c.get(url)
+        data = json.loads(r.content.decode('utf-8'))
+        self.assertIn("<p>comment 1</p>", data['comments'][1]['html'])
+        self.assertRefreshed()
+        # Both comments in one batch
+        updates = [query for query in queries
+                   if query['sql'].startswith('UPDATE "reddit_comment"')]
+        self.assertEqual(len(updates), 2)
+
+    def test_profile(self):
+        r = self.c.get(reverse('user_profile', args=("lazy",)))
+        self.assertContains(r, "<em>about</em>")
+        self.assertEqual(RedditUser.objects.get().render_version,
+                         markdown.RENDER_VERSION)
+
+    def test_newer_versions_kept(self):
+        first, second, _ = Comment.objects.order_by('id')
+        newer = markdown.RENDER_VERSION + 1
+        # Rendered by a worker already running a newer renderer
+        Comment.objects.filter(id=first.id).update(html_comment="newer",
+                                                   render_version=newer)
+        r = self.c.get(reverse('thread', args=(self.submission.id,)))
+        self.assertContains(r, "newer")
+        self.assertEqual(Comment.objects.get(id=first.id).render_version,
+                         newer)
+
+        # Upgraded between reading the stale row and writing it back
+        Comment.objects.filter(id=second.id).update(html_comment="newer",
+                                                    render_version=newer)
+        markdown.render_stale(Comment, [second.id], 'raw_comment',
+                              'html_comment')
+        self.assertEqual(
+            Comment.objects.filter(id=second.id)
+            .values_list('html_comment', 'render_version').get(),
+            ("newer", newer))
+
+    @override_settings(MARKDOWN_LAZY_RENDER=False)
+    def test_disabled(self):
+        r = self.c.get(reverse('thread', args=(self.submission.id,)))
+        self.assertNotContains(r, "<p>comment 0</p>")
+        self.assertFalse(Comment.objects.exclude(render_version=0).exists())
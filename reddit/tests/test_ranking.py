@@ -0,0 +1,104 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from reddit.models import Comment, Submission, Vote
+from reddit.utils.ranking import confidence, hot
+from users.models import RedditUser
+
+
+class TestHotRank(TestCase):
+    def setUp(self):
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(username="username",
+                                          password="password"))
+
+    def test_newer_submission_ranks_higher(self):
+        now = timezone.now()
+        self.assertGreater(hot(10, now), hot(10, now - timedelta(hours=1)))
+        self.assertGreater(hot(100, now), hot(10, now))
+        # A tenfold score is worth 45000 seconds of age
+        self.assertAlmostEqual(hot(100, now - timedelta(seconds=45000)),
+                               hot(10, now), places=5)
+
+    def test_rank_set_on_save(self):
+        submission = Submission.objects.create(title="ranked",
+                                               author=self.author,
+                                               score=10)
+        self.assertEqual(submission.hot_rank,
+                         hot(10, submission.timestamp))
+
+    def test_rank_updated_on_vote(self):
+        submission = Submission.objects.create(title="ranked",
+                                               author=self.author,
+                                               score=10)
+        old_rank = Submission.objects.get(id=submission.id).hot_rank
+
+        vote = Vote.create(user=self.author, vote_object=submission,
+                           vote_value=1)
+        vote.save()
+        upvoted_rank = Submission.objects.get(id=submission.id).hot_rank
+        self.assertGreater(upvoted_rank, old_rank)
+
+        vote.change_vote(-1)
+        self.assertLess(Submission.objects.get(id=submission.id).hot_rank,
+                        old_rank)
+
+        vote.cancel_vote()
+        self.assertEqual(Submission.objects.get(id=submission.id).hot_rank,
+                         old_rank)
+
+    def test_recompute_command(self):
+        old = Submission.objects.create(
+            title="old", author=self.author, score=5,
+            timestamp=timezone.now() - timedelta(days=30))
+        for _ in range(3):
+            Submission.objects.create(title="new", author=self.author, score=5)
+        Submission.objects.update(hot_rank=0)
+
+        out = StringIO()
+        call_command('recompute_hot_ranks', days=7, chunk_size=2, stdout=out)
+        self.assertIn("Updated 3 submissions", out.getvalue())
+        self.assertEqual(Submission.objects.get(id=old.id).hot_rank, 0)
+        for submission in Submission.objects.exclude(id=old.id):
+            self.assertEqual(submission.hot_rank,
+                             hot(submission.score, submission.timestamp))
+
+        call_command('recompute_hot_ranks', days=0, stdout=out)
+        self.assertEqual(Submission.objects.get(id=old.id).hot_rank,
+                         hot(old.score, old.timestamp))
+
+
+class TestConfidence(TestCase):
+    def setUp(self):
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(username="username",
+                                          password="password"))
+        self.submission = Submission.objects.create(title="thread",
+                                                    author=self.author)
+
+    def test_few_clean_votes_beat_many_mixed_ones(self):
+        self.assertGreater(confidence(5, 0), confidence(40, 30))
+        self.assertGreater(confidence(40, 1), confidence(5, 0))
+        self.assertEqual(confidence(0, 0), 0)
+        self.assertLess(confidence(1, 3), confidence(1, 1))
+
+    def test_confidence_updated_on_vote(self):
+        comment = Comment.create(self.author, "comment", self.submission)
+        comment.save()
+        self.assertEqual(comment.confidence, 0)
+
+        vote = Vote.create(user=self.author, vote_object=comment,
+                           vote_value=1)
+        vote.save()
+        self.assertEqual(Comment.objects.get(id=comment.id).confidence,
+                         confidence(1, 0))
+
+        vote.change_vote(-1)
+        comment = Comment.objects.get(id=comment.id)
+        self.assertEqual(comment.confidence, confidence(0, 1))
+        self.assertEqual(comment.controversy, 0)
@@ -0,0 +1,114 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.http import HttpResponseBadRequest, HttpResponseNotAllowed
+from django.test import Client, TestCase, TransactionTestCase, \
+    override_settings
+from django.test.utils import CaptureQueriesContext
+
+from reddit import views
+from reddit.models import Comment, Submission
+from users.models import RedditUser
+
+
+class ThreadMixin(object):
+    def create_thread(self):
+        self.c = Client()
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(username="api"))
+        self.submission = Submission.objects.create(
+            title="api thread", author=self.author, author_name="api")
+        self.root = Comment.create(self.author, "root", self.submission)
+        self.root.save()
+        self.reply = Comment.create(self.author, "reply", self.root)
+        self.reply.save()
+        self.other_root = Comment.create(self.author, "other root",
+                                         self.submission)
+        self.other_root.save()
+
+    def get(self, **params):
+        return self.c.get(reverse('thread_api', args=(self.submission.id,)),
+                          params)
+
+    def json(self, response):
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode("utf-8"))
+
+
+class TestThreadApi(ThreadMixin, TestCase):
+    def setUp(self):
+        self.create_thread()
+
+    def test_thread(self):
+        data = self.json(self.get())
+        self.assertEqual(data['submission']['title'], "api thread")
+        self.assertEqual(data['submission']['comment_count'], 3)
+        self.assertEqual(data['fields'], list(views.API_COMMENT_FIELDS))
+        comments = [dict(zip(data['fields'], row)) for row in data['comments']]
+        self.assertEqual([(c['id'], c['parent'], c['depth']) for c in comments],
+                         [(self.root.id, None, 0),
+                          (self.reply.id, self.root.id, 1),
+                          (self.other_root.id, None, 0)])
+        self.assertEqual(comments[1]['html'], "<p>reply</p>\n")
+        self.assertIsNone(data['next'])
+
+    def test_fields_and_depth(self):
+        data = self.json(self.get(fields='id,score', depth=0))
+        self.assertEqual(data['fields'], ['id', 'score'])
+        self.assertEqual(data['comments'],
+                         [[self.root.id, 0], [self.other_root.id, 0]])
+
+    def test_values_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.get(fields='id')
+        comment_queries = [query['sql'] for query in queries
+                           if 'FROM "reddit_comment"' in query['sql']]
+        self.assertEqual(len(comment_queries), 1)
+        self.assertNotIn('html_comment', comment_queries[0])
+
+    def test_pages(self):
+        limit = views.API_COMMENT_LIMIT
+        views.API_COMMENT_LIMIT = 2
+        try:
+            data = self.json(self.get(fields='id'))
+            self.assertEqual(data['comments'], [[self.root.id], [self.reply.id]])
+            data = self.json(self.get(fields='id', after=data['next']))
+        finally:
+            views.API_COMMENT_LIMIT = limit
+        self.assertEqual(data['comments'], [[self.other_root.id]])
+        self.assertIsNone(data['next'])
+
+    def test_invalid_requests(self):
+        self.assertIsInstance(self.get(fields='id,password'),
+                              HttpResponseBadRequest)
+        self.assertIsInstance(self.get(depth='-1'), HttpResponseBadRequest)
+        r = self.c.get(reverse('thread_api', args=(9999,)))
+        self.assertEqual(r.status_code, 404)
+        r = self.c.post(reverse('thread_api', args=(self.submission.id,)))
+        self.assertIsInstance(r, HttpResponseNotAllowed)
+        self.assertNotIn('ETag', self.get())
+
+
+@override_settings(THREAD_CACHE_TIMEOUT=60)
+class TestThreadApiETag(ThreadMixin, TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.create_thread()
+
+    def test_not_modified(self):
+        etag = self.get()['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            r = self.c.get(reverse('thread_api', args=(self.submission.id,)),
+                           HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 304)
+        self.assertFalse([query for query in queries
+                          if 'reddit_comment' in query['sql']])
+
+        Comment.create(self.author, "new", self.submission).save()
+        r = self.c.get(reverse('thread_api', args=(self.submission.id,)),
+                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(len(self.json(r)['comments']), 4)
+        self.assertNotEqual(r['ETag'], etag)
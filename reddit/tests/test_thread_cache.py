@@ -0,0 +1,89 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import Client, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from reddit.models import Comment, Submission
+from reddit.utils import metrics, thread_cache
+from users.models import RedditUser
+
+
+@override_settings(THREAD_CACHE_TIMEOUT=60)
+class TestThreadCache(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.c = Client()
+        self.credentials = {'username': 'username',
+                            'password': 'password'}
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(**self.credentials))
+        self.submission = Submission.objects.create(
+            author=self.author, author_name="username", title="cached")
+        self.comment = Comment.create(self.author, 'first comment',
+                                      self.submission)
+        self.comment.save()
+
+    def view(self):
+        with CaptureQueriesContext(connection) as queries:
+            r = self.c.get(reverse('thread', args=(self.submission.id,)))
+        self.assertEqual(r.status_code, 200)
+        comment_queries = [query for query in queries.captured_queries
+                           if 'reddit_comment' in query['sql']]
+        return r, comment_queries
+
+    def test_second_view_is_cached(self):
+        _, queries = self.view()
+        self.assertTrue(queries)
+        r, queries = self.view()
+        self.assertEqual(queries, [])
+        self.assertContains(r, 'first comment')
+
+    def test_new_comment_invalidates(self):
+        self.view()
+        version = thread_cache.version(self.submission.id)
+        self.c.login(**self.credentials)
+        self.c.post(reverse('post_comment'),
+                    data={'parentType': 'submission',
+                          'parentId': self.submission.id,
+                          'commentContent': 'second comment'})
+        self.assertGreater(thread_cache.version(self.submission.id), version)
+
+        r, queries = self.view()
+        self.assertTrue(queries)
+        self.assertContains(r, 'second comment')
+
+    def test_vote_invalidates(self):
+        self.view()
+        self.c.login(**self.credentials)
+        self.c.post(reverse('vote'), data={'what': 'comment',
+                                           'what_id': self.comment.id,
+                                           'vote_value': 1})
+        r, _ = self.view()
+        self.assertContains(r, "<a class='score'> 1</a>")
+
+        # The cached tree has no votes, the page highlights them
+        self.assertNotContains(r, 'upvoted')
+        self.assertEqual(json.loads(r.context['comment_votes_json']),
+                         {str(self.comment.id): 1})
+
+    def test_edit_and_delete_invalidate(self):
+        self.view()
+        self.comment.edit("edited comment")
+        r, _ = self.view()
+        self.assertContains(r, 'edited comment')
+
+        self.comment.tombstone()
+        r, _ = self.view()
+        self.assertNotContains(r, 'edited comment')
+        self.assertContains(r, '[deleted]')
+
+    def test_metrics(self):
+        self.view()
+        self.view()
+        snapshot = metrics.snapshot()
+        self.assertIn('thread_cache.render.count', snapshot)
+        self.assertGreater(snapshot['thread_cache.hit_ratio'], 0)
@@ -0,0 +1,141 @@
+import json
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import Client, TransactionTestCase, override_settings
+
+from reddit.models import Comment, Submission, Vote
+from reddit.utils import karma, vote_buffer
+from reddit.utils.ranking import confidence, hot
+from users.models import RedditUser
+
+
+@override_settings(VOTE_BUFFER_INTERVAL=3600)
+class TestVoteBuffer(TransactionTestCase):
+    def setUp(self):
+        vote_buffer.default_buffer.flush()
+        self.c = Client()
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(username="author"))
+        self.submission = Submission.objects.create(
+            author=self.author, author_name="author", title="buffered")
+        self.comment = Comment.create(author=self.author,
+                                      raw_comment="buffered",
+                                      parent=self.submission)
+        self.comment.save()
+
+    def vote(self, username, what, what_id, value):
+        User.objects.create_user(username=username, password="password")
+        RedditUser.objects.create(user=User.objects.get(username=username))
+        self.c.login(username=username, password="password")
+        r = self.c.post(reverse('vote'), data={'what': what,
+                                               'what_id': what_id,
+                                               'vote_value': value})
+        return json.loads(r.content.decode("utf-8"))['voteDiff']
+
+    def test_counters_written_on_flush(self):
+        self.assertEqual(self.vote('voter1', 'submission', self.submission.id, 1), 1)
+        self.assertEqual(self.vote('voter2', 'submission', self.submission.id, 1), 1)
+        self.assertEqual(self.vote('voter3', 'comment', self.comment.id, -1), -1)
+
+        submission = Submission.objects.get(id=self.submission.id)
+        self.assertEqual(submission.score, 0)
+        self.assertGreater(vote_buffer.default_buffer.lag(), 0)
+
+        # transaction, submission, comment and author counters, then
+        # one read and an update per sort key of each model
+        with self.assertNumQueries(1 + 3 + 4 + 3):
+            self.assertEqual(vote_buffer.default_buffer.flush(), 3)
+        self.assertEqual(vote_buffer.default_buffer.lag(), 0)
+
+        submission = Submission.objects.get(id=self.submission.id)
+        self.assertEqual((submission.score, submission.ups, submission.downs),
+                         (2, 2, 0))
+        self.assertEqual(submission.hot_rank, hot(2, submission.timestamp))
+        comment = Comment.objects.get(id=self.comment.id)
+        self.assertEqual((comment.score, comment.downs), (-1, 1))
+        self.assertEqual(comment.controversy, 0)
+        self.assertEqual(comment.confidence, confidence(0, 1))
+        author = RedditUser.objects.get(id=self.author.id)
+        self.assertEqual((author.link_karma, author.comment_karma), (2, -1))
+
+    def test_failed_flush_keeps_diffs(self):
+        buffer = vote_buffer.VoteBuffer()
+        buffer.add(Submission, self.submission.id, score=1, ups=1)
+        buffer.add(Submission, self.submission.id, score=1, nonexistent=1)
+        with self.assertRaises(Exception):
+            buffer.flush()
+        self.assertEqual(dict(buffer.pending[Submission, self.submission.id]),
+                         {'score': 2, 'ups': 1, 'nonexistent': 1})
+
+    def test_metrics_view(self):
+        r = self.c.get(reverse('metrics'))
+        self.assertEqual(r.status_code, 302)
+
+        User.objects.create_user(username="staff", password="password",
+                                 is_staff=True)
+        self.c.login(username="staff", password="password")
+        r = self.c.get(reverse('metrics'))
+        self.assertIn('vote_buffer.lag_seconds',
+                      json.loads(r.content.decode("utf-8")))
+
+
+@override_settings(KARMA_FLUSH_INTERVAL=3600)
+class TestKarmaAggregation(TransactionTestCase):
+    def setUp(self):
+        karma.flush()
+        self.c = Client()
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(username="author"))
+        self.submission = Submission.objects.create(
+            author=self.author, author_name="author", title="aggregated")
+        self.comment = Comment.create(author=self.author,
+                                      raw_comment="aggregated",
+                                      parent=self.submission)
+        self.comment.save()
+
+    def vote(self, username, what, what_id, value):
+        User.objects.create_user(username=username, password="password")
+        RedditUser.objects.create(user=User.objects.get(username=username))
+        self.c.login(username=username, password="password")
+        self.c.post(reverse('vote'), data={'what': what,
+                                           'what_id': what_id,
+                                           'vote_value': value})
+
+    def test_karma_written_on_flush(self):
+        self.vote('voter1', 'submission', self.submission.id, 1)
+        self.vote('voter2', 'submission', self.submission.id, 1)
+        self.vote('voter3', 'comment', self.comment.id, -1)
+
+        # Counters are written in the request, karma is not
+        self.assertEqual(Submission.objects.get(id=self.submission.id).score, 2)
+        author = RedditUser.objects.get(id=self.author.id)
+        self.assertEqual((author.link_karma, author.comment_karma), (0, 0))
+        self.assertGreater(karma.karma_buffer.lag(), 0)
+
+        # transaction and a single update of the author
+        with self.assertNumQueries(1 + 1):
+            self.assertEqual(karma.flush(), 1)
+        author = RedditUser.objects.get(id=self.author.id)
+        self.assertEqual((author.link_karma, author.comment_karma), (2, -1))
+
+    def test_reconcile_karma(self):
+        self.vote('voter1', 'submission', self.submission.id, 1)
+        self.vote('voter2', 'comment', self.comment.id, 1)
+        self.vote('voter3', 'comment', self.comment.id, 1)
+        Vote.objects.filter(user__user__username='voter3').update(value=0)
+        # The workers were stopped, their last diffs written
+        karma.flush()
+        RedditUser.objects.filter(id=self.author.id).update(link_karma=42)
+
+        out = StringIO()
+        call_command('reconcile_karma', chunk_size=2, stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), [
+            "KARMA_FLUSH_INTERVAL is set, karma diffs buffered by running "
+            "workers are counted twice",
+            "Updated 1 users"])
+
+        author = RedditUser.objects.get(id=self.author.id)
+        self.assertEqual((author.link_karma, author.comment_karma), (1, 1))
@@ -1,9 +1,17 @@
 import json
+from threading import Barrier, Thread
+from time import sleep
+
 from django.core.urlresolvers import reverse
+from django.db import IntegrityError, OperationalError, connection, \
+    transaction
 from django.http import HttpResponseNotAllowed, HttpResponseForbidden, \
     HttpResponseBadRequest
-from django.test import Client, TestCase
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.db.models import F
 from reddit.models import Comment, Submission, Vote
+from reddit.utils.ranking import hot
 from django.contrib.auth.models import User
 from users.models import RedditUser
 
@@ -126,8 +134,8 @@ class TestVotingOnItems(TestCase):
         self.assertIsNone(json_r['error'])
         self.assertEqual(json_r['voteDiff'], -1)
 
-        vote = Vote.objects.get(vote_object_type=submission.get_content_type(),
-                                vote_object_id=submission.id,
+        vote = Vote.objects.get(kind=Vote.SUBMISSION,
+                                object_id=submission.id,
                                 user=user)
         vote.value = 1
         vote.save()
@@ -185,8 +193,8 @@ class TestVotingOnItems(TestCase):
         self.assertIsNone(json_r['error'])
         self.assertEqual(json_r['voteDiff'], -1)
 
-        vote = Vote.objects.get(vote_object_type=comment.get_content_type(),
-                                vote_object_id=comment.id,
+        vote = Vote.objects.get(kind=Vote.COMMENT,
+                                object_id=comment.id,
                                 user=user)
         vote.value = 1
         vote.save()
@@ -202,3 +210,261 @@ class TestVotingOnItems(TestCase):
         json_r = json.loads(r.content.decode("utf-8"))
         self.assertIsNone(json_r['error'])
         self.assertEqual(json_r['voteDiff'], -2)
+
+
+class TestVoteWrites(TestCase):
+    def setUp(self):
+        self.c = Client()
+        self.credentials = {'username': 'voteusername',
+                            'password': 'password'}
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(**self.credentials))
+        self.submission = Submission.objects.create(
+            author=self.author,
+            author_name=self.author.user.username,
+            title="vote testing")
+
+    def test_counters_and_karma(self):
+        vote = Vote.create(user=self.author, vote_object=self.submission,
+                           vote_value=1)
+        vote.save()
+        vote.change_vote(-1)
+        vote.cancel_vote()
+        vote.change_vote(1)
+
+        submission = Submission.objects.get(id=self.submission.id)
+        self.assertEqual((submission.score, submission.ups, submission.downs),
+                         (1, 1, 0))
+        self.assertEqual(RedditUser.objects.get(id=self.author.id).link_karma, 1)
+        self.assertEqual(Vote.objects.get(id=vote.id).value, 1)
+
+    def test_stale_instances_dont_lose_votes(self):
+        for i in range(3):
+            voter = RedditUser.objects.create(
+                user=User.objects.create_user(username="voter{}".format(i)))
+            # Every vote works on its own copy fetched before any of them
+            Vote.create(user=voter, vote_object=self.submission,
+                        vote_value=1).save()
+
+        submission = Submission.objects.get(id=self.submission.id)
+        self.assertEqual((submission.score, submission.ups), (3, 3))
+        self.assertEqual(RedditUser.objects.get(id=self.author.id).link_karma, 3)
+
+    def test_duplicate_vote_rejected(self):
+        Vote.create(user=self.author, vote_object=self.submission,
+                    vote_value=1).save()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Vote.create(user=self.author, vote_object=self.submission,
+                        vote_value=1).save()
+
+    def test_vote_object(self):
+        Vote.create(user=self.author, vote_object=self.submission,
+                    vote_value=1).save()
+        vote = Vote.objects.get(user=self.author)
+        self.assertEqual((vote.kind, vote.object_id),
+                         (Vote.SUBMISSION, self.submission.id))
+        with self.assertNumQueries(1):
+            self.assertEqual(vote.vote_object, self.submission)
+            self.assertEqual(vote.vote_object, self.submission)
+
+    def test_thread_votes_single_query(self):
+        comment = Comment.create(author=self.author, raw_comment="comment",
+                                 parent=self.submission)
+        comment.save()
+        Vote.create(user=self.author, vote_object=comment,
+                    vote_value=-1).save()
+        Vote.create(user=self.author, vote_object=self.submission,
+                    vote_value=1).save()
+        with self.assertNumQueries(1):
+            votes = Vote.get_comment_votes(self.author, self.submission)
+        self.assertEqual(votes, {comment.id: -1})
+
+    def test_sort_keys_follow_stored_counters(self):
+        stale = Submission.objects.get(id=self.submission.id)
+        # Votes another worker committed after the copy was read
+        Submission.objects.filter(id=self.submission.id).update(
+            score=F('score') + 5, ups=F('ups') + 5)
+        Vote.create(user=self.author, vote_object=stale, vote_value=1).save()
+
+        submission = Submission.objects.get(id=self.submission.id)
+        self.assertEqual(submission.score, 6)
+        self.assertEqual(stale.score, 6)
+        self.assertEqual(submission.hot_rank,
+                         hot(submission.score, submission.timestamp))
+
+    def test_vote_query_count(self):
+        self.c.login(**self.credentials)
+        data = {'what': 'submission',
+                'what_id': self.submission.id,
+                'vote_value': '1'}
+        # request savepoints, session, user, reddit user, submission,
+        # vote lookup, vote savepoints, vote insert, submission counters
+        # read locked, one update of the counters and sort keys, and
+        # the author karma update. The locked read is one query more
+        # than writing keys of the stale counters fetched by the view,
+        # without it the keys of racing votes would overwrite each other.
+        with self.assertNumQueries(13):
+            self.c.post(reverse('vote'), data=data)
+        # the same but changing the vote instead of inserting it
+        with self.assertNumQueries(11):
+            self.c.post(reverse('vote'), data=data)
+
+
+class TestConcurrentVotes(TransactionTestCase):
+    voters = 8
+
+    def setUp(self):
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(username="author"))
+        self.submission = Submission.objects.create(
+            author=self.author, author_name="author", title="concurrent votes")
+        self.comment = Comment.create(author=self.author,
+                                      raw_comment="concurrent votes",
+                                      parent=self.submission)
+        self.comment.save()
+        self.users = [RedditUser.objects.create(
+            user=User.objects.create_user(username="voter{}".format(i)))
+            for i in range(self.voters)]
+
+    def vote_in_parallel(self, cast_vote):
+        start = Barrier(self.voters)
+        errors = []
+
+        def run(user):
+            try:
+                start.wait()
+                cast_vote(user)
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [Thread(target=run, args=(user,)) for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def cast_vote(self, model, object_id, value):
+        def cast(user):
+            while True:
+                try:
+                    # Every thread works on its own, soon stale, copy
+                    vote_object = model.objects.get(id=object_id)
+                    with transaction.atomic():
+                        Vote.create(user=user, vote_object=vote_object,
+                                    vote_value=value).save()
+                    return
+                except OperationalError as e:
+                    # The in-memory sqlite test database locks whole
+                    # tables, retry like a client would on a lock timeout.
+                    if 'locked' not in str(e):
+                        raise
+                    sleep(0.001)
+        return cast
+
+    def test_parallel_votes_add_up(self):
+        self.vote_in_parallel(self.cast_vote(Submission, self.submission.id, 1))
+        self.vote_in_parallel(self.cast_vote(Comment, self.comment.id, -1))
+
+        submission = Submission.objects.get(id=self.submission.id)
+        self.assertEqual((submission.score, submission.ups, submission.downs),
+                         (self.voters, self.voters, 0))
+        comment = Comment.objects.get(id=self.comment.id)
+        self.assertEqual((comment.score, comment.ups, comment.downs),
+                         (-self.voters, 0, self.voters))
+        author = RedditUser.objects.get(id=self.author.id)
+        self.assertEqual(author.link_karma, self.voters)
+        self.assertEqual(author.comment_karma, -self.voters)
+        self.assertEqual(Vote.objects.count(), 2 * self.voters)
+
+        # The stored sort keys belong to the final counters
+        for vote_object in (submission, comment):
+            stored = {key: getattr(vote_object, key)
+                      for key in vote_object.SORT_KEYS}
+            self.assertEqual(stored, vote_object.set_sort_keys())
+
+
+class TestBatchVoting(TestCase):
+    def setUp(self):
+        self.c = Client()
+        self.credentials = {'username': 'voteusername',
+                            'password': 'password'}
+        self.author = RedditUser.objects.create(
+            user=User.objects.create_user(**self.credentials))
+        self.submission = Submission.objects.create(
+            author=self.author,
+            author_name=self.author.user.username,
+            title="batch voting")
+        self.comments = []
+        for _ in range(3):
+            comment = Comment.create(author=self.author,
+                                     raw_comment="batch comment",
+                                     parent=self.submission)
+            comment.save()
+            self.comments.append(comment)
+
+    def post_batch(self, votes):
+        return self.c.post(reverse('vote_batch'),
+                           data={'votes': json.dumps(votes)})
+
+    def test_logged_out(self):
+        r = self.post_batch([{'what': 'submission',
+                              'what_id': self.submission.id,
+                              'vote_value': 1}])
+        self.assertIsInstance(r, HttpResponseForbidden)
+
+    def test_malformed_batch(self):
+        self.c.login(**self.credentials)
+        for votes in [[], {'what': 'comment'}, [{'what': 'comment'}],
+                      [{'what': 'comment', 'what_id': 'x', 'vote_value': 1}],
+                      [{'what': ['a'], 'what_id': 1, 'vote_value': 1}],
+                      [{'what': 'user', 'what_id': 1, 'vote_value': 1}],
+                      [['comment', 1, 1]], ['comment'],
+                      [{'what': 'comment', 'what_id': 1, 'vote_value': 1}] * 101]:
+            self.assertIsInstance(self.post_batch(votes), HttpResponseBadRequest)
+        r = self.c.post(reverse('vote_batch'), data={'votes': 'not json'})
+        self.assertIsInstance(r, HttpResponseBadRequest)
+
+    def test_results_match_single_votes(self):
+        Vote.create(user=self.author, vote_object=self.comments[1],
+                    vote_value=1).save()
+        self.c.login(**self.credentials)
+        r = self.post_batch([
+            {'what': 'comment', 'what_id': self.comments[0].id, 'vote_value': 1},
+            {'what': 'comment', 'what_id': self.comments[1].id, 'vote_value': 1},
+            {'what': 'comment', 'what_id': self.comments[2].id, 'vote_value': -1},
+            {'what': 'comment', 'what_id': 9999, 'vote_value': 1},
+            {'what': 'submission', 'what_id': self.submission.id, 'vote_value': 1},
+            {'what': 'submission', 'what_id': self.submission.id, 'vote_value': -1},
+            {'what': 'comment', 'what_id': self.comments[0].id, 'vote_value': 2},
+        ])
+        self.assertEqual(r.status_code, 200)
+        results = json.loads(r.content.decode("utf-8"))['results']
+        self.assertEqual([result['voteDiff'] for result in results],
+                         [1, -1, -1, 0, 1, -2, 0])
+        self.assertEqual([result['error'] is None for result in results],
+                         [True, True, True, False, True, True, False])
+
+        scores = [Comment.objects.get(id=comment.id).score
+                  for comment in self.comments]
+        self.assertEqual(scores, [1, 0, -1])
+        submission = Submission.objects.get(id=self.submission.id)
+        self.assertEqual((submission.score, submission.ups, submission.downs),
+                         (-1, 0, 1))
+        author = RedditUser.objects.get(id=self.author.id)
+        self.assertEqual((author.link_karma, author.comment_karma), (-1, 0))
+
+    def test_counter_updates_coalesced(self):
+        self.c.login(**self.credentials)
+        votes = [{'what': 'comment', 'what_id': comment.id, 'vote_value': 1}
+                 for comment in self.comments]
+        with CaptureQueriesContext(connection) as queries:
+            self.post_batch(votes)
+        updates = [query['sql'] for query in queries
+                   if query['sql'].startswith('UPDATE')]
+        # One per comment, a single one for the author karma
+        # and one per comment sort key
+        self.assertEqual(len(updates), 3 + 1 + len(Comment.SORT_KEYS))
+        self.assertEqual(RedditUser.objects.get(id=self.author.id).comment_karma, 3)
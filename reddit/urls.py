@@ -19,9 +19,25 @@ from . import views
 
 urlpatterns = [
     url(r'^$', views.frontpage, name="frontpage"),
+    url(r'^new/$', views.frontpage, {'sort': 'new'}, name="new"),
+    url(r'^top/$', views.frontpage, {'sort': 'top'}, name="top"),
+    url(r'^controversial/$', views.frontpage, {'sort': 'controversial'}, name="controversial"),
+    url(r'^rising/$', views.frontpage, {'sort': 'rising'}, name="rising"),
     url(r'^comments/(?P<thread_id>[0-9]+)$', views.comments, name="thread"),
+    url(r'^comments/(?P<thread_id>[0-9]+)/more/$', views.more_comments, name="more_comments"),
+    url(r'^comments/(?P<thread_id>[0-9]+)/new/$', views.new_comments, name="new_comments"),
+    url(r'^comments/(?P<thread_id>[0-9]+)/all/$', views.comments_stream, name="thread_stream"),
+    url(r'^comments/(?P<thread_id>[0-9]+)/(?P<comment_id>[0-9]+)/$', views.comment_permalink,
+        name="comment_permalink"),
+    url(r'^comments/more/(?P<comment_id>[0-9]+)/$', views.more_comments, name="more_replies"),
+    url(r'^comments/expand/(?P<comment_id>[0-9]+)/$', views.expand_comment, name="expand_comment"),
     url(r'^submit/$', views.submit, name="submit"),
     url(r'^post/comment/$', views.post_comment, name="post_comment"),
+    url(r'^post/comment/edit/$', views.edit_comment, name="edit_comment"),
+    url(r'^post/comment/delete/$', views.delete_comment, name="delete_comment"),
     url(r'^vote/$', views.vote, name="vote"),
+    url(r'^vote/batch/$', views.vote_batch, name="vote_batch"),
+    url(r'^metrics/$', views.process_metrics, name="metrics"),
+    url(r'^api/comments/(?P<thread_id>[0-9]+)/$', views.thread_api, name="thread_api"),
 
 ]
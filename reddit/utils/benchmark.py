@@ -0,0 +1,34 @@
+"""
+Small timing helpers shared by the benchmark management commands.
+"""
+from timeit import default_timer
+
+
+def time_calls(func, runs):
+    """
+    Call func runs times and return the duration of each call.
+
+    :return: Call durations in seconds
+    :rtype: list[float]
+    """
+    samples = []
+    for _ in range(runs):
+        start = default_timer()
+        func()
+        samples.append(default_timer() - start)
+    return samples
+
+
+def percentile(samples, pct):
+    """:return: The pct-th percentile of samples, nearest-rank method"""
+    ordered = sorted(samples)
+    rank = max(int(round(pct / 100.0 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summary(samples):
+    """:return: p50, p99 and max of samples formatted in milliseconds"""
+    return "p50 {:8.2f}ms  p99 {:8.2f}ms  max {:8.2f}ms".format(
+        percentile(samples, 50) * 1000,
+        percentile(samples, 99) * 1000,
+        max(samples) * 1000)
@@ -0,0 +1,384 @@
+"""
+Loading, ordering and rendering of comment threads.
+
+Threads are loaded in bounded pieces: the best roots, a few levels of
+their best replies and nothing past a total budget. Every comment with
+replies left out gets a "load more" placeholder that fetches the rest
+of its subtree later, so the cost of a thread page doesn't grow with
+the size of the thread.
+
+The renderer walks the loaded comments once in depth-first order and
+fills precompiled HTML fragments, closing the markup of every comment
+once the walk leaves its subtree. Nesting is derived from the depth of
+each comment, so deep threads can't hit the recursion limit and the
+cost grows linearly with the number of comments. The walk can also
+be fed chunk by chunk, so a whole thread can be streamed to the client
+without holding all of its comments in memory.
+"""
+from collections import defaultdict
+
+from django.contrib.humanize.templatetags.humanize import naturaltime
+from django.core.urlresolvers import reverse
+from django.db.models import Count
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from reddit.utils import markdown
+
+# Most top level comments (or replies of the expanded comment) loaded
+ROOT_LIMIT = 200
+# Most levels of replies loaded below them
+DEPTH_LIMIT = 8
+# Most replies loaded per comment
+CHILD_LIMIT = 20
+# Most comments loaded in total
+COMMENT_LIMIT = 500
+# Comments scored below this are shown as collapsed stubs, without
+# their body and replies, until they're expanded
+COLLAPSE_SCORE = -4
+
+# Sibling order of every comment sort, read straight from the
+# (submission, parent, key, id) indexes of Comment.
+SORTS = {
+    'best'         : ('-confidence', '-id'),
+    'top'          : ('-score', '-id'),
+    'new'          : ('-timestamp', '-id'),
+    'old'          : ('timestamp', 'id'),
+    'controversial': ('-controversy', '-id'),
+}
+DEFAULT_SORT = 'best'
+
+# Comments read per query when a whole thread is streamed
+STREAM_CHUNK_SIZE = 500
+# Comment fields read for rendering, leaving out the raw comment text
+RENDERED_FIELDS = ('id', 'submission_id', 'parent_id', 'path', 'depth',
+                   'author_name', 'score', 'timestamp', 'deleted',
+                   'render_version', 'html_comment')
+# Fields read for collapsed comments, which are shown without a body
+COLLAPSED_FIELDS = RENDERED_FIELDS[:-1]
+
+VOTE_CLASSES = {1: (' upvoted', ''), -1: ('', ' downvoted')}
+
+COMMENT_OPEN = (
+    '<div class="media">'
+    '<div class="media-left">'
+    '<div class="vote comment-votes" data-what-type="comment" data-what-id="{id}">'
+    '<div><i class="fa fa-chevron-up{upvoted}" title="upvote" onclick="vote(this)"></i></div>'
+    '<div><i class="fa fa-chevron-down{downvoted}" title="downvote" onclick="vote(this)"></i></div>'
+    '</div>'
+    '</div>'
+    '<div class="media-body" data-parent-id="{id}" data-parent-type="comment" data-author="{author}">'
+    '<h5 class="media-heading"><a href="/user/{author}">{author}</a> '
+    '<a class=\'score\'> {score}</a> points posted {posted}</h5>'
+    '<div class="comment-body">{html}</div>'
+    '<div class="reply-container">'
+    '<ul class="buttons">'
+    '<li><a href="javascript:void(0)" name="replyButton">reply</a></li>'
+    '<li><a href="/comments/{submission_id}/{id}/">permalink</a></li>'
+    '<li class="author-only" style="display: none"><a href="javascript:void(0)" name="editButton">edit</a></li>'
+    '<li class="author-only" style="display: none"><a href="javascript:void(0)" name="deleteButton">delete</a></li>'
+    '</ul>'
+    '</div>'
+)
+COMMENT_CLOSE = '</div></div>'
+
+COMMENT_COLLAPSED = (
+    '<div class="media collapsed-comment">'
+    '<div class="media-body">'
+    '<h5 class="media-heading">'
+    '<a href="javascript:void(0)" name="expandComment" data-url="{url}">[+]</a> '
+    '<a href="/user/{author}">{author}</a> '
+    '<a class=\'score\'> {score}</a> points posted {posted} (collapsed)</h5>'
+    '</div>'
+    '</div>'
+)
+
+LOAD_MORE = (
+    '<div class="load-more">'
+    '<a href="javascript:void(0)" name="loadMore" data-url="{url}">'
+    'load more {what} ({count})</a>'
+    '</div>'
+)
+
+
+def load_thread(comments, parent=None, offset=0, sort=DEFAULT_SORT,
+                root_limit=ROOT_LIMIT, depth_limit=DEPTH_LIMIT,
+                child_limit=CHILD_LIMIT, comment_limit=COMMENT_LIMIT,
+                collapse_score=COLLAPSE_SCORE):
+    """
+    Load the part of a thread shown at once, breadth first so shallow
+    comments are never left out for deeper ones. Every level comes out
+    of the database already in sibling order, nothing is sorted here.
+    The replies of a level are counted first, then only the shown ones
+    are read, so a comment with huge numbers of replies costs no more
+    than one with a few.
+
+    Comments scored below collapse_score get `collapsed` set. Their
+    bodies and replies aren't read, they're fetched once the comment
+    is expanded.
+
+    Every returned comment has `more_replies` set to the number of its
+    replies that were left out, and `replies_shown` to the number that
+    were loaded, which is the offset to load the rest from.
+
+    :param comments: Queryset of all comments of the thread
+    :param parent: Comment whose replies are loaded, or None to load the
+                   top level comments
+    :type parent: Comment | None
+    :param offset: Number of the best top level comments to skip,
+                   because they are already shown
+    :param sort: Name of the sibling order, one of SORTS
+    :param collapse_score: Score comments are collapsed below,
+                           or None to never collapse them
+    :return: The loaded comments in display order, and the number of
+             top level comments that were left out
+    :rtype: (list[Comment], int)
+    """
+    ordering = SORTS[sort]
+    top_limit = child_limit if parent else root_limit
+    top = comments.filter(parent=parent)
+    top_rows = list(top.order_by(*ordering).values_list('id', 'score')
+                    [offset:offset + top_limit + 1])
+    hidden_top = 0
+    if len(top_rows) > top_limit:
+        top_rows = top_rows[:top_limit]
+        hidden_top = top.count() - offset - top_limit
+    top_rows = top_rows[:comment_limit]
+
+    def is_collapsed(score):
+        return collapse_score is not None and score < collapse_score
+
+    top_ids = [pk for pk, _ in top_rows]
+    collapsed = {pk for pk, score in top_rows if is_collapsed(score)}
+    replies = {}
+    more_replies = {}
+    budget = comment_limit - len(top_ids)
+    # Replies of collapsed comments are never read
+    frontier = [pk for pk in top_ids if pk not in collapsed]
+    for _ in range(1, depth_limit):
+        if not frontier:
+            break
+        counts = count_replies(comments, frontier)
+
+        # How many replies of each parent are shown follows from the
+        # counts alone, so no more rows than that are read
+        wanted = {}
+        for parent_id in frontier:
+            wanted[parent_id] = min(counts.get(parent_id, 0), child_limit,
+                                    budget)
+            budget -= wanted[parent_id]
+        narrow = [parent_id for parent_id, count in wanted.items()
+                  if count and count == counts[parent_id]]
+        wide = [parent_id for parent_id, count in wanted.items()
+                if count and count < counts[parent_id]]
+
+        siblings = defaultdict(list)
+        rows = []
+        # Parents with all their replies shown share one query,
+        # the others get one query each that stops at the last shown
+        if narrow:
+            rows.extend(comments.filter(parent__in=narrow)
+                        .order_by('parent', *ordering)
+                        .values_list('id', 'parent', 'score'))
+        for parent_id in wide:
+            rows.extend(comments.filter(parent=parent_id)
+                        .order_by(*ordering)
+                        .values_list('id', 'parent', 'score')
+                        [:wanted[parent_id]])
+        for pk, parent_id, score in rows:
+            siblings[parent_id].append(pk)
+            if is_collapsed(score):
+                collapsed.add(pk)
+
+        next_frontier = []
+        for parent_id in frontier:
+            shown = siblings.get(parent_id, [])
+            replies[parent_id] = shown
+            more_replies[parent_id] = counts.get(parent_id, 0) - len(shown)
+            next_frontier.extend(pk for pk in shown if pk not in collapsed)
+        frontier = next_frontier
+
+    # Replies below the deepest loaded level are only counted
+    if frontier:
+        more_replies.update(count_replies(comments, frontier))
+
+    ids = list(top_ids)
+    for shown in replies.values():
+        ids.extend(shown)
+    objects = comments.only(*RENDERED_FIELDS).in_bulk(
+        [pk for pk in ids if pk not in collapsed])
+    objects.update(comments.only(*COLLAPSED_FIELDS).in_bulk(
+        [pk for pk in ids if pk in collapsed]))
+
+    thread = []
+    stack = top_ids[::-1]
+    while stack:
+        comment = objects[stack.pop()]
+        comment.collapsed = comment.id in collapsed
+        comment.replies_shown = len(replies.get(comment.id, ()))
+        comment.more_replies = more_replies.get(comment.id, 0)
+        thread.append(comment)
+        stack.extend(reversed(replies.get(comment.id, ())))
+    return thread, hidden_top
+
+
+def count_replies(comments, parent_ids):
+    """
+    :param comments: Queryset of all comments of the thread
+    :return: Number of replies of each of the parents that has any
+    :rtype: dict[int, int]
+    """
+    return dict(comments.filter(parent__in=parent_ids)
+                .values_list('parent').annotate(Count('id')).order_by())
+
+
+def load_context(comments, comment, context=0, sort=DEFAULT_SORT, **limits):
+    """
+    Load the slice of a thread shown on a comment's permalink: up to
+    `context` of its closest ancestors, the comment and a bounded part
+    of its replies as load_thread loads them. Ancestors are looked up
+    by the ids in the comment's path, so only the slice is read no
+    matter how large the thread is.
+
+    :param comments: Queryset of all comments of the thread
+    :param comment: The linked comment
+    :type comment: Comment
+    :param context: Number of ancestors shown above the comment
+    :param sort: Name of the sibling order of the replies, one of SORTS
+    :return: The loaded comments in display order
+    :rtype: list[Comment]
+    """
+    ancestor_ids = comment.ancestor_ids()[-context:] if context else []
+    ancestors = comments.in_bulk(ancestor_ids)
+    thread = [ancestors[pk] for pk in ancestor_ids if pk in ancestors]
+
+    replies, hidden = load_thread(comments, parent=comment, sort=sort,
+                                  **limits)
+    comment.replies_shown = sum(1 for reply in replies
+                                if reply.depth == comment.depth + 1)
+    comment.more_replies = hidden
+    return thread + [comment] + replies
+
+
+def iter_thread_chunks(comments, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Read a whole thread in path order, which lists every comment right
+    after its parent and siblings oldest first, in chunks of keyset
+    queries on the (submission, path) index. Only one chunk of
+    comments is in memory at a time, however large the thread.
+
+    :param comments: Queryset of all comments of the thread
+    :param chunk_size: Number of comments per query
+    :rtype: collections.Iterator[list[Comment]]
+    """
+    comments = comments.only(*RENDERED_FIELDS).order_by('path')
+    last_path = ''
+    while True:
+        chunk = list(comments.filter(path__gt=last_path)[:chunk_size])
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_path = chunk[-1].path
+
+
+def render_load_more(url, count, what='comments'):
+    """
+    Render the placeholder of comments that weren't loaded.
+
+    :param url: URL returning the missing comments
+    :param count: Number of missing comments
+    :rtype: django.utils.safestring.SafeText
+    """
+    return mark_safe(LOAD_MORE.format(url=escape(url), what=what, count=count))
+
+
+def render_comment_tree(comments, comment_votes, sort=DEFAULT_SORT):
+    """
+    Render a comment thread, with the votes of the current user.
+
+    :param comments: Comments of the thread in depth-first order,
+                     as returned by load_thread / load_context
+    :type comments: collections.Iterable[Comment]
+    :param comment_votes: Vote values of the current user keyed by
+                          comment id
+    :type comment_votes: dict[int, int]
+    :param sort: Sort the placeholders load the remaining replies in
+    :rtype: django.utils.safestring.SafeText
+    """
+    return mark_safe(''.join(
+        render_comment_chunks([comments], comment_votes, sort)))
+
+
+def render_comment_chunks(chunks, comment_votes, sort=DEFAULT_SORT):
+    """
+    Render a comment thread delivered in consecutive chunks of its
+    depth-first order, yielding the html of each chunk once it's
+    rendered. The markup of comments whose subtree goes on in the next
+    chunk is left open, the last yielded part closes everything.
+
+    :param chunks: Chunks of comments in depth-first order
+    :type chunks: collections.Iterable[collections.Iterable[Comment]]
+    :param comment_votes: Vote values of the current user keyed by
+                          comment id
+    :type comment_votes: dict[int, int]
+    :param sort: Sort the placeholders load the remaining replies in
+    :rtype: collections.Iterator[str]
+    """
+    open_comments = []
+    # Threads have far fewer authors than comments
+    authors = {}
+    for comments in chunks:
+        comments = list(comments)
+        # Stale html of the chunk is rendered again in one batch
+        markdown.refresh([comment for comment in comments
+                          if not comment.deleted and
+                          not getattr(comment, 'collapsed', False)],
+                         'raw_comment', 'html_comment')
+        parts = []
+        for comment in comments:
+            depth = comment.depth
+            # Close the comments whose subtree ends before this one
+            while open_comments and open_comments[-1].depth >= depth:
+                parts.append(close_comment(open_comments.pop(), sort))
+
+            author = authors.get(comment.author_name)
+            if author is None:
+                author = authors[comment.author_name] = \
+                    escape(comment.author_name)
+            if getattr(comment, 'collapsed', False):
+                # Complete on its own, its replies aren't loaded
+                parts.append(COMMENT_COLLAPSED.format(
+                    url=escape('{}?sort={}'.format(
+                        reverse('expand_comment', args=(comment.id,)), sort)),
+                    author=author,
+                    score=comment.score,
+                    posted=escape(naturaltime(comment.timestamp))))
+                continue
+
+            upvoted, downvoted = VOTE_CLASSES.get(
+                comment_votes.get(comment.id), ('', ''))
+            parts.append(COMMENT_OPEN.format(
+                id=comment.id,
+                submission_id=comment.submission_id,
+                upvoted=upvoted,
+                downvoted=downvoted,
+                author=author,
+                score=comment.score,
+                posted=escape(naturaltime(comment.timestamp)),
+                html=comment.html_comment))
+            open_comments.append(comment)
+        yield ''.join(parts)
+
+    yield ''.join(close_comment(comment, sort)
+                  for comment in reversed(open_comments))
+
+
+def close_comment(comment, sort=DEFAULT_SORT):
+    more = getattr(comment, 'more_replies', 0)
+    if not more:
+        return COMMENT_CLOSE
+    url = '{}?offset={}&sort={}'.format(
+        reverse('more_replies', args=(comment.id,)), comment.replies_shown,
+        sort)
+    return render_load_more(url, more, what='replies') + COMMENT_CLOSE
@@ -0,0 +1,56 @@
+"""
+Background aggregation of author karma.
+
+Every vote changes the karma of the author of the voted object, so a
+popular author's RedditUser row is written by every vote on any of
+their submissions and comments. With KARMA_FLUSH_INTERVAL set, those
+diffs are added up in memory once the vote commits and a background
+thread in every worker writes them every KARMA_FLUSH_INTERVAL seconds,
+one UPDATE per author. Profile pages can show karma that many seconds
+stale; reconcile_karma recomputes it from the votes if a worker dies
+with unwritten diffs, run while no worker serves votes.
+"""
+from django.conf import settings
+from django.db.models import F
+
+from reddit.utils import vote_buffer
+from users.models import RedditUser
+
+karma_buffer = vote_buffer.VoteBuffer('karma', 'KARMA_FLUSH_INTERVAL')
+
+
+def enabled():
+    return bool(getattr(settings, 'KARMA_FLUSH_INTERVAL', 0))
+
+
+def record(author_id, field, diff):
+    """
+    Add diff to the link_karma or comment_karma field of the author.
+
+    Without the aggregator the diff is written like the vote counters:
+    through the vote buffer when it's buffering, otherwise with an
+    atomic UPDATE in the current transaction.
+
+    :param author_id: ID of the RedditUser
+    :param field: 'link_karma' or 'comment_karma'
+    :param diff: Change of the karma
+    """
+    if not diff:
+        return
+    if enabled():
+        karma_buffer.add_on_commit(RedditUser, author_id, **{field: diff})
+    elif vote_buffer.buffering():
+        vote_buffer.add(RedditUser, author_id, **{field: diff})
+    else:
+        RedditUser.objects.filter(pk=author_id).update(
+            **{field: F(field) + diff})
+
+
+def flush():
+    """
+    Write all karma diffs collected by this worker.
+
+    :return: Number of updated authors
+    :rtype: int
+    """
+    return karma_buffer.flush()
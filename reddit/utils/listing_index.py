@@ -0,0 +1,215 @@
+"""
+In-process index of the top submissions of every unfiltered listing.
+
+Each worker keeps the best LISTING_INDEX_SIZE (key, id) pairs of every
+sort in memory and serves listing pages from it, so the database only
+sees one `id__in` fetch per page. Once the transaction of a new or
+rescored submission commits, its id is appended to a change log in the
+configured cache under the next version number. On its next read every
+worker looks up the ids changed since the version its index is at, and
+moves just those submissions, reading their keys in one query. Only a
+worker that fell too far behind, or finds part of the log gone,
+rebuilds the whole index.
+
+Disabled unless LISTING_INDEX_SIZE is set to a positive number.
+"""
+from bisect import bisect_left, bisect_right, insort
+from threading import Lock
+from time import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_CACHE_KEY = 'listing_index_version'
+CHANGE_CACHE_KEY = 'listing_index_change:{}'
+# Seconds a change stays in the log, idle workers rebuild after that
+CHANGE_TIMEOUT = 3600
+# Changes a worker catches up on before it rather rebuilds its index
+MAX_CATCH_UP = 1000
+
+# Listings that can be served from the index, by their sort key.
+# Time filtered listings (top of the day, rising) are always
+# read from the database.
+INDEXED_KEYS = ('hot_rank', 'timestamp', 'score', 'controversy')
+
+_indexes = {}
+_lock = Lock()
+
+
+class ListingIndex(object):
+    """
+    Best `size` submissions of one listing, kept as an ascending
+    list of (key, id) pairs. The index always holds an exact prefix of
+    the listing: entries only ever leave it from the bottom, and once
+    it shrinks to half its size it is rebuilt.
+    """
+
+    def __init__(self, sort_key, size):
+        self.sort_key = sort_key
+        self.size = size
+        self.entries = []
+        self.keys = {}
+        self.version = None
+        # True when the whole table fits in the index
+        self.complete = False
+
+    def rebuild(self, queryset, version):
+        rows = queryset.order_by('-' + self.sort_key, '-id') \
+                       .values_list(self.sort_key, 'id')[:self.size]
+        self.entries = sorted(rows)
+        self.keys = {pk: key for key, pk in self.entries}
+        self.complete = len(self.entries) < self.size
+        self.version = version
+
+    @property
+    def stale(self):
+        return self.version is None or \
+            (not self.complete and len(self.entries) < self.size // 2)
+
+    def update(self, pk, key):
+        """
+        Move submission pk to its new key position. Submissions that
+        fall below the lowest indexed key are dropped from the index.
+        """
+        self.remove(pk)
+        if self.complete or not self.entries or (key, pk) > self.entries[0]:
+            insort(self.entries, (key, pk))
+            self.keys[pk] = key
+            if len(self.entries) > self.size:
+                _, dropped = self.entries.pop(0)
+                del self.keys[dropped]
+                self.complete = False
+
+    def remove(self, pk):
+        key = self.keys.pop(pk, None)
+        if key is not None:
+            del self.entries[bisect_left(self.entries, (key, pk))]
+
+    def seek(self, limit, after=None, before=None):
+        """
+        Return up to limit + 1 ids of the page after or before
+        the (key, id) cursor in descending order, or None when that
+        page reaches past the indexed part of the listing.
+
+        :rtype: list[int] | None
+        """
+        if before:
+            if not self.complete and (not self.entries or before < self.entries[0]):
+                return None
+            # Everything above an indexed entry is indexed too,
+            # returned in ascending order like the database query.
+            start = bisect_right(self.entries, before)
+            return [pk for _, pk in self.entries[start:start + limit + 1]]
+
+        end = bisect_left(self.entries, after) if after else len(self.entries)
+        if end < limit + 1 and not self.complete:
+            return None
+        return [pk for _, pk in reversed(self.entries[max(end - limit - 1, 0):end])]
+
+
+def version():
+    """
+    :return: Version of the listings, the number of the last logged change
+    :rtype: int
+    """
+    # Versions start from the current time in microseconds. Only more
+    # than a million changes a second would take a version past the
+    # clock, so one that was evicted comes back higher than any number
+    # already logged or indexed.
+    return cache.get_or_set(VERSION_CACHE_KEY, int(time() * 1000000), None)
+
+
+def get_index(sort_key, queryset):
+    """
+    Return the current index of the listing, applying the changes other
+    workers logged since it was built, or rebuilding it from queryset.
+
+    :return: ListingIndex, or None if the listing can't be indexed
+    :rtype: ListingIndex | None
+    """
+    size = getattr(settings, 'LISTING_INDEX_SIZE', 0)
+    if not size or sort_key not in INDEXED_KEYS:
+        return None
+
+    current = version()
+    with _lock:
+        index = _indexes.get(sort_key)
+        if index is None or index.size != size:
+            index = _indexes[sort_key] = ListingIndex(sort_key, size)
+        if index.stale or not _catch_up(index, queryset, current):
+            index.rebuild(queryset, current)
+        return index
+
+
+def _catch_up(index, queryset, current):
+    """
+    Apply the logged changes between the index version and current.
+
+    :return: False if the index has to be rebuilt instead
+    :rtype: bool
+    """
+    behind = current - index.version
+    if not 0 <= behind <= MAX_CATCH_UP:
+        return False
+    if not behind:
+        return True
+    changes = cache.get_many([CHANGE_CACHE_KEY.format(number) for number
+                              in range(index.version + 1, current + 1)])
+    if len(changes) < behind:
+        # Expired, or logged under a version that isn't written yet
+        return False
+
+    # A submission changed many times is only read once
+    pks = set(changes.values())
+    keys = dict(queryset.filter(pk__in=pks)
+                .values_list('id', index.sort_key))
+    for pk in pks:
+        if pk in keys:
+            index.update(pk, keys[pk])
+        else:
+            index.remove(pk)
+    index.version = current
+    return True
+
+
+def submission_changed(submission):
+    """
+    Log a new or rescored submission once the current
+    transaction commits.
+
+    :type submission: Submission
+    """
+    if not getattr(settings, 'LISTING_INDEX_SIZE', 0):
+        return
+    pk = submission.pk
+    transaction.on_commit(lambda: _log(pk))
+
+
+def _log(pk):
+    try:
+        number = cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        # The version was evicted. Logged after the new one, the change
+        # is seen even by an index built in the same microsecond, every
+        # other index misses the changes before it and rebuilds.
+        version()
+        number = cache.incr(VERSION_CACHE_KEY)
+    cache.set(CHANGE_CACHE_KEY.format(number), pk, CHANGE_TIMEOUT)
+
+
+def invalidate_all():
+    """
+    Make the indexes of every worker rebuild on their next read, after
+    sort keys were rewritten without logging each submission.
+    """
+    # The next version is seeded past every number already logged, none
+    # of the indexes finds the changes up to it and each one rebuilds.
+    cache.delete(VERSION_CACHE_KEY)
+    clear()
+
+
+def clear():
+    """Drop all local indexes, they'll be rebuilt on the next read."""
+    with _lock:
+        _indexes.clear()
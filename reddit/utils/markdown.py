@@ -0,0 +1,182 @@
+"""
+Markdown rendering shared by submissions, comments and user profiles.
+
+Each worker thread reuses its own mistune renderer instead of building one
+per call, and rendered html is kept in a bounded in-process LRU keyed
+by a hash of the markdown, since bots post the same bodies over and
+over. With MARKDOWN_CACHE_TIMEOUT set, misses of the LRU are also
+looked up in the configured cache, which every worker shares.
+
+Stored html is tagged with the RENDER_VERSION it was rendered by. With
+MARKDOWN_LAZY_RENDER set, html of an older version is rendered again
+when it's read and written back, a page of rows at a time, so a
+renderer change rolls out without rewriting every row at once.
+"""
+from collections import Counter, OrderedDict
+from hashlib import sha1
+from threading import Lock, local
+from timeit import default_timer
+
+import mistune
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from django_reddit.utils.model_utils import bulk_update_column
+from reddit.utils import metrics
+
+# Bump whenever the same markdown renders to different html, like
+# after upgrading mistune or changing the renderer options
+RENDER_VERSION = 1
+
+CACHE_KEY = 'markdown:{}:{}'
+
+_local = local()
+_lock = Lock()
+_lru = OrderedDict()
+_lookups = Counter()
+
+
+def render(text):
+    """
+    Render markdown the way mistune.markdown does, escaping any html.
+
+    :param text: Markdown formatted text
+    :type text: str
+    :return: The rendered html
+    :rtype: str
+    """
+    digest = sha1(text.encode('utf-8')).hexdigest()
+    with _lock:
+        html = _lru.pop(digest, None)
+        if html is not None:
+            # Reinserted, so it's the most recently used
+            _lru[digest] = html
+    if html is not None:
+        _count('lru_hits')
+        return html
+
+    timeout = getattr(settings, 'MARKDOWN_CACHE_TIMEOUT', 0)
+    if timeout:
+        html = cache.get(CACHE_KEY.format(RENDER_VERSION, digest))
+    if html is not None:
+        _count('cache_hits')
+    else:
+        _count('misses')
+        html = render_uncached(text)
+        if timeout:
+            cache.set(CACHE_KEY.format(RENDER_VERSION, digest), html, timeout)
+
+    size = getattr(settings, 'MARKDOWN_LRU_SIZE', 0)
+    if size:
+        with _lock:
+            _lru[digest] = html
+            while len(_lru) > size:
+                _lru.popitem(last=False)
+    return html
+
+
+def render_uncached(text):
+    """
+    Render markdown with the renderer of this thread, bypassing and
+    not filling either cache. Used when stored html is regenerated.
+
+    :param text: Markdown formatted text
+    :type text: str
+    :return: The rendered html
+    :rtype: str
+    """
+    renderer = getattr(_local, 'renderer', None)
+    if renderer is None:
+        renderer = _local.renderer = mistune.Markdown(escape=True)
+    start = default_timer()
+    try:
+        html = renderer(text)
+    except Exception:
+        # A failed parse can leave state behind, start over next time
+        _local.renderer = None
+        raise
+    metrics.timing('markdown.render', default_timer() - start)
+    return html
+
+
+def lazy_enabled():
+    return bool(getattr(settings, 'MARKDOWN_LAZY_RENDER', False))
+
+
+def render_stale(model, pks, text_field, html_field):
+    """
+    Render the markdown of rows whose stored html is of an older
+    RENDER_VERSION, and write the html and the version back to the rows
+    that are still of an older version.
+
+    :param model: Model class the rows belong to
+    :param pks: Primary keys of the stale rows
+    :param text_field: Name of the markdown column
+    :param html_field: Name of the html column
+    :return: The new html keyed by pk
+    :rtype: dict
+    """
+    if not pks:
+        return {}
+    # The markdown is only read for the rows that need it
+    texts = model.objects.filter(pk__in=pks).values_list('pk', text_field)
+    changes = {pk: render(text or '') for pk, text in texts}
+    # Rows rendered meanwhile by an edit or by a worker already running
+    # a newer renderer, during a rolling deploy, keep their html
+    stale = model.objects.filter(render_version__lt=RENDER_VERSION)
+    with transaction.atomic():
+        bulk_update_column(model, html_field, changes, queryset=stale)
+        stale.filter(pk__in=list(changes)) \
+            .update(render_version=RENDER_VERSION)
+    metrics.incr('markdown.lazy_renders', len(changes))
+    return changes
+
+
+def refresh(objects, text_field, html_field):
+    """
+    Bring the html of model instances up to date with render_stale, in
+    one batch for all of them. Does nothing unless MARKDOWN_LAZY_RENDER
+    is set.
+
+    :param objects: Instances with their pk, render_version and html
+                    field loaded
+    :type objects: list
+    :param text_field: Name of the markdown field
+    :param html_field: Name of the html field
+    """
+    if not lazy_enabled():
+        return
+    stale = {obj.pk: obj for obj in objects
+             if obj.render_version < RENDER_VERSION}
+    if not stale:
+        return
+    # Instances read with only() are of a deferred subclass
+    model = next(iter(stale.values()))._meta.concrete_model
+    for pk, html in render_stale(model, list(stale), text_field,
+                                 html_field).items():
+        setattr(stale[pk], html_field, html)
+        stale[pk].render_version = RENDER_VERSION
+
+
+def _count(lookup):
+    with _lock:
+        _lookups[lookup] += 1
+    metrics.incr('markdown.' + lookup)
+
+
+def clear():
+    """Empty the LRU of this process."""
+    with _lock:
+        _lru.clear()
+
+
+def hit_ratio():
+    """:return: Share of the renders of this process served from a cache"""
+    with _lock:
+        hits = _lookups['lru_hits'] + _lookups['cache_hits']
+        lookups = hits + _lookups['misses']
+        return hits / float(lookups) if lookups else 0.0
+
+
+metrics.register_gauge('markdown.hit_ratio', hit_ratio)
@@ -0,0 +1,55 @@
+"""
+Process-local counters, gauges and timings.
+
+Each worker process keeps its own values, the snapshot served by the
+metrics view only describes the process that handled the request.
+"""
+from collections import defaultdict
+from threading import Lock
+
+_lock = Lock()
+_counters = defaultdict(int)
+_timings = {}
+_gauges = {}
+
+
+def incr(name, count=1):
+    with _lock:
+        _counters[name] += count
+
+
+def timing(name, seconds):
+    """Record one duration of the named operation."""
+    with _lock:
+        calls, total, slowest = _timings.get(name, (0, 0.0, 0.0))
+        _timings[name] = (calls + 1, total + seconds, max(slowest, seconds))
+
+
+def register_gauge(name, func):
+    """Register a callable that returns the current value of a gauge."""
+    with _lock:
+        _gauges[name] = func
+
+
+def snapshot():
+    """
+    :return: Current value of every metric keyed by name
+    :rtype: dict
+    """
+    with _lock:
+        values = dict(_counters)
+        for name, (calls, total, slowest) in _timings.items():
+            values[name + '.count'] = calls
+            values[name + '.avg_seconds'] = total / calls
+            values[name + '.max_seconds'] = slowest
+        gauges = list(_gauges.items())
+    for name, func in gauges:
+        values[name] = func()
+    return values
+
+
+def reset():
+    """Forget all counters and timings, gauges stay registered."""
+    with _lock:
+        _counters.clear()
+        _timings.clear()
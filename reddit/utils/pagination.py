@@ -0,0 +1,182 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage(object):
+    """
+    One page of a keyset paginated listing. Mimics the parts of
+    django.core.paginator.Page used by the listing templates, but
+    instead of page numbers it exposes opaque cursors that point at
+    the first and the last item on the page. An empty page, whose
+    cursor row was deleted or moved, points back at its own cursor.
+    """
+
+    def __init__(self, object_list, paginator, has_next, has_previous,
+                 number=None, after=None, before=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.number = number
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self._after = after
+        self._before = before
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        if self.object_list:
+            return self.paginator.encode_cursor(self.object_list[-1])
+        return self._before
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous:
+            return None
+        if self.object_list:
+            return self.paginator.encode_cursor(self.object_list[0])
+        return self._after
+
+
+def key_ordering(key, descending=True, key_index=True):
+    """
+    :param key: Name of the model field to order by, ties broken by pk
+    :param key_index: False orders by an expression over the key, so
+                      the database can't walk the (key, id) index and
+                      sorts the rows the filters select instead
+    :return: order_by() arguments
+    """
+    if key_index:
+        order = [key, 'pk']
+        return ['-' + field for field in order] if descending else order
+    expression = F(key) + 0
+    if descending:
+        return [expression.desc(), '-pk']
+    return [expression.asc(), 'pk']
+
+
+class KeysetPaginator(object):
+    """
+    Paginates a queryset in descending (key, id) order by seeking
+    from the last seen row instead of using OFFSET, so every page
+    costs the same single indexed query and no COUNT(*) is needed.
+
+    :param queryset: Unordered queryset to paginate
+    :param key: Name of the (indexed) model field to order by
+    :param per_page: Maximum number of items on a page
+    :param index: Optional in-memory ListingIndex of the same listing,
+                  pages it covers are fetched by id instead of seeking
+    :param key_index: False for querysets limited to a short range of
+                      a (range field, key, id) index, like the
+                      submissions of a period. Walking the key index
+                      could pass every row outside the range before
+                      finding a page, instead the ids in the range are
+                      read off the covering index and sorted, then the
+                      page is fetched by id.
+    """
+
+    def __init__(self, queryset, key, per_page, index=None, key_index=True):
+        self.queryset = queryset
+        self.key = key
+        self.per_page = per_page
+        self.index = index
+        self.key_index = key_index
+        self.key_field = queryset.model._meta.get_field(key)
+
+    def encode_cursor(self, obj):
+        value = self.key_field.value_to_string(obj)
+        raw = "{}|{}".format(value, obj.pk).encode('utf-8')
+        return urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            raw = urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+            value, pk = raw.rsplit('|', 1)
+            return self.key_field.to_python(value), int(pk)
+        except (BinasciiError, UnicodeError, ValueError,
+                ValidationError):
+            raise InvalidCursor(cursor)
+
+    def page(self, after=None, before=None):
+        """
+        Return the first page, the page following the `after` cursor
+        or the page preceding the `before` cursor.
+
+        :raises InvalidCursor: if the cursor can't be decoded
+        :rtype: KeysetPage
+        """
+        key, limit = self.key, self.per_page
+
+        if before:
+            value, pk = self.decode_cursor(before)
+            rows = self._from_index(before=(value, pk))
+            if rows is None:
+                rows = self._fetch(self.queryset.filter(
+                    Q(**{key + '__gt': value}) | Q(**{key: value, 'pk__gt': pk})
+                ), descending=False)
+            has_previous = len(rows) > limit
+            rows = rows[:limit][::-1]
+            return KeysetPage(rows, self, has_next=True,
+                              has_previous=has_previous,
+                              number=None if has_previous else 1,
+                              before=before)
+
+        queryset = self.queryset
+        cursor = None
+        if after:
+            cursor = value, pk = self.decode_cursor(after)
+            queryset = queryset.filter(
+                Q(**{key + '__lt': value}) | Q(**{key: value, 'pk__lt': pk}))
+
+        rows = self._from_index(after=cursor)
+        if rows is None:
+            rows = self._fetch(queryset)
+        return KeysetPage(rows[:limit], self, has_next=len(rows) > limit,
+                          has_previous=bool(after),
+                          number=None if after else 1, after=after)
+
+    def _fetch(self, queryset, descending=True):
+        """:return: The first per_page + 1 rows of queryset in key order"""
+        queryset = queryset.order_by(*key_ordering(
+            self.key, descending, self.key_index))[:self.per_page + 1]
+        if self.key_index:
+            return list(queryset)
+        ids = list(queryset.values_list('pk', flat=True))
+        objects = self.queryset.in_bulk(ids)
+        return [objects[pk] for pk in ids if pk in objects]
+
+    def _from_index(self, after=None, before=None):
+        """
+        :return: Rows of the page fetched by id from the index,
+                 or None if the index doesn't cover the page
+        """
+        if self.index is None:
+            return None
+        ids = self.index.seek(self.per_page, after=after, before=before)
+        if ids is None:
+            return None
+        objects = self.queryset.in_bulk(ids)
+        return [objects[pk] for pk in ids if pk in objects]
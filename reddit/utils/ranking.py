@@ -0,0 +1,100 @@
+"""
+Listing and comment sort keys. They are stored on the models and
+indexed, so listings and threads can read them straight from the index
+instead of computing them at query time.
+"""
+from datetime import datetime
+from math import log10, sqrt
+
+from django.utils import timezone
+
+# Posts are ranked relative to this date, the same one reddit uses.
+EPOCH = datetime(2005, 12, 8, 7, 46, 43, tzinfo=timezone.utc)
+
+# How many seconds of age are worth an order of magnitude of score.
+HOT_DECAY = 45000
+
+
+def epoch_seconds(date):
+    """:return: Seconds elapsed between EPOCH and date"""
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date, timezone.utc)
+    return (date - EPOCH).total_seconds()
+
+
+def hot(score, date):
+    """
+    Time decayed rank, every HOT_DECAY seconds of age are worth
+    as much as a tenfold score. Since newer posts get a higher base
+    instead of older ones losing rank, the value only has to be
+    recomputed when the score changes.
+
+    :param score: Submission score
+    :type score: int
+    :param date: Submission timestamp
+    :type date: datetime
+    :rtype: float
+    """
+    return round(_signed_order(score) + epoch_seconds(date) / HOT_DECAY, 7)
+
+
+def _signed_order(score):
+    """:return: log10 of the score magnitude, carrying the score's sign"""
+    order = log10(max(abs(score), 1))
+    if score > 0:
+        return order
+    elif score < 0:
+        return -order
+    return 0
+
+
+def controversy(ups, downs):
+    """
+    Rank that favours a lot of votes split evenly between
+    up and down votes.
+
+    :rtype: float
+    """
+    if ups <= 0 or downs <= 0:
+        return 0.0
+    magnitude = ups + downs
+    balance = float(downs) / ups if ups > downs else float(ups) / downs
+    return magnitude ** balance
+
+
+# Rising is hot with a ten times faster decay, so recent activity
+# dominates. It's only listed for submissions from the last day.
+RISING_DECAY = HOT_DECAY / 10
+
+
+def rising(score, date):
+    """
+    Same as hot() but with RISING_DECAY seconds of age
+    worth a tenfold score.
+
+    :rtype: float
+    """
+    return round(_signed_order(score) + epoch_seconds(date) / RISING_DECAY, 7)
+
+
+# Confidence level of the best comment ranking, the same 80% reddit uses.
+CONFIDENCE_Z = 1.281551565545
+
+
+def confidence(ups, downs):
+    """
+    Lower bound of the Wilson score interval of the share of upvotes,
+    the share the comment gets at least with CONFIDENCE_Z certainty.
+    A new comment with a few upvotes can outrank an old one with many
+    upvotes and many downvotes, which score based ordering can't do.
+
+    :rtype: float
+    """
+    n = ups + downs
+    if n <= 0:
+        return 0.0
+    z = CONFIDENCE_Z
+    phat = float(ups) / n
+    return round((phat + z * z / (2 * n) -
+                  z * sqrt((phat * (1 - phat) + z * z / (4 * n)) / n)) /
+                 (1 + z * z / n), 9)
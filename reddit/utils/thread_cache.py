@@ -0,0 +1,106 @@
+"""
+Cache of rendered comment trees.
+
+The comment tree of a thread page is rendered without the vote
+highlighting of the viewer, which the page applies from a small JSON
+map of their votes, so one rendered tree serves every viewer. Trees are
+cached per submission and sort order under a version number that is
+bumped once a comment is posted or the score of a comment changes, so a
+changed thread is re-rendered on its next view and the old versions
+simply expire. Keys also hold markdown.RENDER_VERSION, so trees of an
+older renderer aren't served once it changes.
+
+Disabled unless THREAD_CACHE_TIMEOUT is set to a positive number of
+seconds, which also bounds how stale the relative comment ages are.
+"""
+from collections import Counter
+from threading import Lock
+from time import time
+from timeit import default_timer
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from reddit.utils import markdown, metrics
+
+VERSION_KEY = 'thread_version:{}'
+HTML_KEY = 'thread_html:{}:{}:{}:{}'
+
+_lock = Lock()
+_lookups = Counter()
+
+
+def enabled():
+    return bool(getattr(settings, 'THREAD_CACHE_TIMEOUT', 0))
+
+
+def version(submission_id):
+    """
+    :return: Current version of the thread's comment tree
+    :rtype: int
+    """
+    # Versions start from the current time in milliseconds, so a thread
+    # whose version was evicted never gets an old version number back.
+    return cache.get_or_set(VERSION_KEY.format(submission_id),
+                            int(time() * 1000), None)
+
+
+def bump(submission_id):
+    """
+    Invalidate the cached trees of the thread once the current
+    transaction commits.
+    """
+    if not enabled():
+        return
+    transaction.on_commit(lambda: _incr(submission_id))
+
+
+def _incr(submission_id):
+    try:
+        cache.incr(VERSION_KEY.format(submission_id))
+    except ValueError:
+        # Not cached, the next read starts a new version
+        pass
+
+
+def get_html(submission_id, sort, render):
+    """
+    Return the cached comment tree html of the thread, calling render
+    to create it if the current version isn't cached.
+
+    :param sort: Name of the comment sort order the tree is rendered in
+    :param render: Callable returning the html
+    :rtype: django.utils.safestring.SafeText
+    """
+    if not enabled():
+        return _render(render)
+
+    key = HTML_KEY.format(submission_id, sort, version(submission_id),
+                         markdown.RENDER_VERSION)
+    html = cache.get(key)
+    hit = html is not None
+    with _lock:
+        _lookups['hits' if hit else 'misses'] += 1
+    metrics.incr('thread_cache.hits' if hit else 'thread_cache.misses')
+    if not hit:
+        html = _render(render)
+        cache.set(key, html, settings.THREAD_CACHE_TIMEOUT)
+    return html
+
+
+def _render(render):
+    start = default_timer()
+    html = render()
+    metrics.timing('thread_cache.render', default_timer() - start)
+    return html
+
+
+def hit_ratio():
+    """:return: Share of the lookups of this process served from the cache"""
+    with _lock:
+        lookups = _lookups['hits'] + _lookups['misses']
+        return _lookups['hits'] / float(lookups) if lookups else 0.0
+
+
+metrics.register_gauge('thread_cache.hit_ratio', hit_ratio)
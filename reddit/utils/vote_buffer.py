@@ -0,0 +1,195 @@
+"""
+Write-behind buffer for vote counter updates.
+
+When VOTE_BUFFER_INTERVAL is set, the vote rows are still written in
+the request, but the score, ups and downs diffs are added up in
+memory. A background thread in every worker applies them every
+VOTE_BUFFER_INTERVAL seconds with a single UPDATE per changed object,
+so a burst of votes on a hot submission doesn't queue up on its row lock.
+"""
+import atexit
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from threading import Lock, Thread, local
+from time import sleep
+from timeit import default_timer
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from django_reddit.utils.model_utils import bulk_update_column
+from reddit.utils import metrics
+
+
+class VoteBuffer(object):
+    """
+    Column diffs of every object waiting to be written, keyed by
+    model and primary key.
+
+    :param name: Prefix of the buffer's metric names
+    :param interval_setting: Name of the setting holding the seconds
+                             between background flushes, buffers without
+                             one are only flushed explicitly
+    """
+
+    def __init__(self, name='vote_buffer', interval_setting=None):
+        self.lock = Lock()
+        self.pending = defaultdict(Counter)
+        self.oldest = None
+        self.name = name
+        self.interval_setting = interval_setting
+        self._flusher = None
+        self._flusher_lock = Lock()
+        if interval_setting:
+            metrics.register_gauge(name + '.lag_seconds', self.lag)
+            atexit.register(self.flush)
+
+    @property
+    def interval(self):
+        if not self.interval_setting:
+            return 0
+        return getattr(settings, self.interval_setting, 0)
+
+    def add(self, model, pk, **diffs):
+        """Add diffs to the named columns of the pk row of model."""
+        with self.lock:
+            self.pending[model, pk].update(diffs)
+            if self.oldest is None:
+                self.oldest = default_timer()
+
+    def lag(self):
+        """:return: Age of the oldest unwritten diff in seconds"""
+        oldest = self.oldest
+        return default_timer() - oldest if oldest is not None else 0.0
+
+    def flush(self):
+        """
+        Write all pending diffs, one UPDATE per object, refresh the
+        sort keys of the objects that changed and notify models
+        with a counters_changed(pks) hook.
+
+        :return: Number of updated rows
+        :rtype: int
+        """
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(Counter)
+            self.oldest = None
+        if not pending:
+            return 0
+
+        start = default_timer()
+        changed = defaultdict(list)
+        try:
+            with transaction.atomic():
+                for (model, pk), diffs in pending.items():
+                    columns = {column: F(column) + diff
+                               for column, diff in diffs.items() if diff}
+                    if columns:
+                        model.objects.filter(pk=pk).update(**columns)
+                        changed[model].append(pk)
+
+                for model, pks in changed.items():
+                    if hasattr(model, 'SORT_KEYS'):
+                        update_sort_keys(model, pks)
+                    if hasattr(model, 'counters_changed'):
+                        model.counters_changed(pks)
+        except Exception:
+            # Nothing was written, keep the diffs for the next flush
+            for (model, pk), diffs in pending.items():
+                self.add(model, pk, **diffs)
+            raise
+
+        metrics.timing(self.name + '.flush', default_timer() - start)
+        metrics.incr(self.name + '.flushed_rows', len(pending))
+        return len(pending)
+
+    def add_on_commit(self, model, pk, **diffs):
+        """
+        Buffer the diffs once the current transaction commits, so diffs
+        of rolled back changes are never applied, and make sure the
+        background flusher of this process is running.
+        """
+        self.start_flusher()
+        transaction.on_commit(lambda: self.add(model, pk, **diffs))
+
+    def start_flusher(self):
+        # Started lazily so every forked worker gets its own thread
+        with self._flusher_lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = Thread(target=self._flush_forever,
+                                       name=self.name + '-flusher')
+                self._flusher.daemon = True
+                self._flusher.start()
+
+    def _flush_forever(self):
+        while self.interval:
+            sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:  # pragma: no cover
+                metrics.incr(self.name + '.flush_errors')
+            finally:
+                connection.close()
+
+
+def update_sort_keys(model, pks):
+    """Recompute the stored sort keys of the given rows from their counters."""
+    objects = list(model.objects.filter(pk__in=pks)
+                   .only('pk', 'score', 'ups', 'downs', 'timestamp'))
+    changes = {key: {} for key in model.SORT_KEYS}
+    for obj in objects:
+        for key, value in obj.set_sort_keys().items():
+            changes[key][obj.pk] = value
+    for key, values in changes.items():
+        bulk_update_column(model, key, values)
+    if hasattr(model, 'sort_keys_changed'):
+        for obj in objects:
+            obj.sort_keys_changed()
+
+
+default_buffer = VoteBuffer('vote_buffer', 'VOTE_BUFFER_INTERVAL')
+_local = local()
+
+
+def enabled():
+    return bool(getattr(settings, 'VOTE_BUFFER_INTERVAL', 0))
+
+
+def buffering():
+    """:return: True if diffs should be handed to add() instead of written"""
+    return enabled() or getattr(_local, 'buffer', None) is not None
+
+
+def add(model, pk, **diffs):
+    """
+    Add the diffs to the buffer of the enclosing collect() block.
+    Outside of one, buffer them in the write-behind buffer once the
+    current transaction commits, so diffs of rolled back votes are
+    never applied.
+    """
+    collecting = getattr(_local, 'buffer', None)
+    if collecting is not None:
+        collecting.add(model, pk, **diffs)
+    else:
+        default_buffer.add_on_commit(model, pk, **diffs)
+
+
+@contextmanager
+def collect():
+    """
+    Add up the diffs of all votes cast inside the block and write
+    them when it exits, with one UPDATE per changed object. If the
+    block raises, the diffs are dropped.
+    """
+    buffer = _local.buffer = VoteBuffer()
+    try:
+        yield buffer
+    finally:
+        _local.buffer = None
+
+    if enabled():
+        for (model, pk), diffs in buffer.pending.items():
+            add(model, pk, **diffs)
+    else:
+        buffer.flush()
@@ -1,15 +1,36 @@
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import timedelta
+
 from django.contrib import messages
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.models import User
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.urlresolvers import reverse
+from django.db import IntegrityError, transaction
+from django.db.models import Max
 from django.http import JsonResponse, HttpResponseBadRequest, Http404, \
-    HttpResponseForbidden
+    HttpResponseForbidden, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.template.defaulttags import register
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
 
 from reddit.forms import SubmissionForm
 from reddit.models import Submission, Comment, Vote
-from reddit.utils.helpers import post_only
+from reddit.utils import listing_index, markdown, metrics, thread_cache, \
+    vote_buffer
+from reddit.utils.comment_tree import DEFAULT_SORT, RENDERED_FIELDS, \
+    SORTS, iter_thread_chunks, load_context, load_thread, \
+    render_comment_chunks, render_comment_tree, render_load_more
+from reddit.utils.helpers import get_only, post_only
+from reddit.utils.pagination import KeysetPaginator, InvalidCursor, \
+    key_ordering
 from users.models import RedditUser
 
 
@@ -26,93 +47,523 @@ def get_item(dictionary, key):  # pragma: no cover
     return dictionary.get(key)
 
 
-def frontpage(request):
+# The stored and indexed Submission field each listing is sorted by.
+LISTING_SORTS = {
+    'hot'          : 'hot_rank',
+    'new'          : 'timestamp',
+    'top'          : 'score',
+    'controversial': 'controversy',
+    'rising'       : 'rising_rank',
+}
+
+TOP_PERIODS = {
+    'day' : timedelta(days=1),
+    'week': timedelta(weeks=1),
+    'all' : None,
+}
+
+RISING_PERIOD = timedelta(days=1)
+
+# Comment sorts in the order they're offered on the thread page.
+COMMENT_SORTS = ('best', 'top', 'new', 'old', 'controversial')
+
+# Most ancestors shown above a comment on its permalink.
+MAX_PERMALINK_CONTEXT = 8
+
+# Most comments returned by one new_comments request.
+NEW_COMMENTS_LIMIT = 100
+
+# Stands in for the comment tree of a streamed thread page, the page
+# is sent up to it before any comment is read.
+STREAM_MARKER = '<!-- comment tree -->'
+
+# Fields of the thread API and the columns they're read from.
+API_SUBMISSION_FIELDS = (
+    ('id'           , 'id'),
+    ('title'        , 'title'),
+    ('url'          , 'url'),
+    ('author'       , 'author_name'),
+    ('html'         , 'text_html'),
+    ('score'        , 'score'),
+    ('comment_count', 'comment_count'),
+    ('timestamp'    , 'timestamp'),
+)
+API_COMMENT_FIELDS = OrderedDict((
+    ('id'       , 'id'),
+    ('parent'   , 'parent_id'),
+    ('depth'    , 'depth'),
+    ('author'   , 'author_name'),
+    ('html'     , 'html_comment'),
+    ('score'    , 'score'),
+    ('ups'      , 'ups'),
+    ('downs'    , 'downs'),
+    ('timestamp', 'timestamp'),
+    ('deleted'  , 'deleted'),
+))
+# Most comments returned by one thread API request.
+API_COMMENT_LIMIT = 1000
+
+
+def frontpage(request, sort='hot'):
     """
     Serves frontpage and all additional submission listings
     with maximum of 25 submissions per page.
+
+    Each sort reads its own stored key off an (key, id) index,
+    `top` additionally takes a `t` period of day, week or all.
+    Rising and top of a period sort the period's submissions,
+    read off a (timestamp, key, id) index.
+
+    Listings are paginated with opaque `after`/`before` cursors so
+    deep pages cost the same as the first one. The old `?page=N`
+    links are still served, using offset pagination.
     """
-    # TODO: Serve user votes on submissions too.
 
-    all_submissions = Submission.objects.order_by('-score').all()
-    paginator = Paginator(all_submissions, 25)
+    sort_key = LISTING_SORTS[sort]
+    all_submissions = Submission.objects.all()
+    period = None
+    max_age = None
+
+    if sort == 'top':
+        period = request.GET.get('t', 'all')
+        if period not in TOP_PERIODS:
+            raise Http404
+        max_age = TOP_PERIODS[period]
+    elif sort == 'rising':
+        max_age = RISING_PERIOD
+
+    if max_age:
+        all_submissions = all_submissions.filter(
+            timestamp__gte=timezone.now() - max_age)
+
+    # Walking the key index of a period listing passes older submissions
+    # too, for top every one with a higher score and on the last pages
+    # of rising every one left.
+    key_index = not max_age
+
+    if 'page' in request.GET:
+        all_submissions = all_submissions.order_by(
+            *key_ordering(sort_key, key_index=key_index))
+        paginator = Paginator(all_submissions, 25)
 
-    page = request.GET.get('page', 1)
-    try:
-        submissions = paginator.page(page)
-    except PageNotAnInteger:
-        raise Http404
-    except EmptyPage:
-        submissions = paginator.page(paginator.num_pages)
+        try:
+            submissions = paginator.page(request.GET['page'])
+        except PageNotAnInteger:
+            raise Http404
+        except EmptyPage:
+            submissions = paginator.page(paginator.num_pages)
+    else:
+        index = None
+        if not max_age:
+            index = listing_index.get_index(sort_key, all_submissions)
+        paginator = KeysetPaginator(all_submissions, sort_key, 25, index=index,
+                                    key_index=key_index)
+
+        try:
+            submissions = paginator.page(after=request.GET.get('after'),
+                                         before=request.GET.get('before'))
+        except InvalidCursor:
+            raise Http404
 
     submission_votes = {}
 
     if request.user.is_authenticated():
-        for submission in submissions:
-            try:
-                vote = Vote.objects.get(
-                    vote_object_type=submission.get_content_type(),
-                    vote_object_id=submission.id,
-                    user=RedditUser.objects.get(user=request.user))
-                submission_votes[submission.id] = vote.value
-            except Vote.DoesNotExist:
-                pass
+        try:
+            reddit_user = RedditUser.objects.get(user=request.user)
+            submission_votes = Vote.get_submission_votes(
+                reddit_user, [submission.id for submission in submissions])
+        except RedditUser.DoesNotExist:
+            pass
 
     return render(request, 'public/frontpage.html', {'submissions'     : submissions,
-                                                     'submission_votes': submission_votes})
+                                                     'submission_votes': submission_votes,
+                                                     'sort'            : sort,
+                                                     'period'          : period})
 
 
 def comments(request, thread_id=None):
     """
     Handles comment view when user opens the thread.
-    On top of serving all comments in the thread it will
+    On top of serving the best comments of the thread it will
     also return all votes user made in that thread
-    so that we can easily update comments in template
-    and display via css whether user voted or not.
+    so that the page can highlight them. The comment tree itself
+    is the same for every user and served from the thread cache.
+    Comments that don't fit on the page are replaced by
+    placeholders that load them from more_comments.
+
+    Siblings are ordered by the `sort` parameter, one of best
+    (the default), top, new, old or controversial.
 
     :param thread_id: Thread ID as it's stored in database
     :type thread_id: int
     """
 
     this_submission = get_object_or_404(Submission, id=thread_id)
+    sort = request.GET.get('sort', DEFAULT_SORT)
+    if sort not in SORTS:
+        raise Http404
+    markdown.refresh([this_submission], 'text', 'text_html')
 
-    thread_comments = Comment.objects.filter(submission=this_submission)
+    sub_vote_value, comment_votes = get_thread_votes(request,
+                                                     this_submission.id)
+    comment_tree = thread_cache.get_html(
+        this_submission.id, sort,
+        lambda: render_thread_page(this_submission.id, sort))
 
-    if request.user.is_authenticated():
-        try:
-            reddit_user = RedditUser.objects.get(user=request.user)
-        except RedditUser.DoesNotExist:
-            reddit_user = None
+    return render(request, 'public/comments.html',
+                  {'submission'        : this_submission,
+                   'comment_tree'      : comment_tree,
+                   'comment_votes'     : comment_votes,
+                   'comment_votes_json': json.dumps(comment_votes),
+                   'sub_vote'          : sub_vote_value,
+                   'sort'              : sort,
+                   'sorts'             : COMMENT_SORTS})
+
+
+def comments_stream(request, thread_id=None):
+    """
+    Serves a whole thread without any load more placeholders, oldest
+    comments first. The page up to the comments is sent right away,
+    then the comments are read and rendered in chunks as the response
+    is sent, so neither the first byte nor the memory use wait on the
+    size of the thread.
+
+    :param thread_id: Thread ID as it's stored in database
+    :type thread_id: int
+    """
+    this_submission = get_object_or_404(Submission, id=thread_id)
+    markdown.refresh([this_submission], 'text', 'text_html')
+    sub_vote_value, comment_votes = get_thread_votes(request,
+                                                     this_submission.id)
+
+    page = render_to_string('public/comments.html',
+                            {'submission'        : this_submission,
+                             'streaming'         : True,
+                             'comment_tree'      : mark_safe(STREAM_MARKER),
+                             'comment_votes'     : comment_votes,
+                             'comment_votes_json': json.dumps(comment_votes),
+                             'sub_vote'          : sub_vote_value},
+                            request=request)
+    head, tail = page.split(STREAM_MARKER, 1)
+
+    def stream():
+        yield head
+        chunks = iter_thread_chunks(
+            Comment.objects.filter(submission_id=this_submission.id))
+        for html in render_comment_chunks(chunks, comment_votes):
+            yield html
+        yield tail
+
+    return StreamingHttpResponse(stream())
+
+
+def comment_permalink(request, thread_id=None, comment_id=None):
+    """
+    Serves the page of a single comment: the comment with a bounded
+    part of its replies and, with `?context=N`, up to N of its
+    closest ancestors. Only that slice of the thread is read.
+
+    :param thread_id: ID of the thread the comment belongs to
+    :param comment_id: ID of the linked comment
+    """
+    comment = get_object_or_404(Comment.objects.select_related('submission'),
+                                id=comment_id, submission_id=thread_id)
+    try:
+        context = min(int(request.GET.get('context', 0)),
+                      MAX_PERMALINK_CONTEXT)
+        if context < 0:
+            raise ValueError("Negative context")
+    except ValueError:
+        return HttpResponseBadRequest()
+    sort = request.GET.get('sort', DEFAULT_SORT)
+    if sort not in SORTS:
+        raise Http404
+
+    markdown.refresh([comment.submission], 'text', 'text_html')
+    thread_comments = load_context(
+        Comment.objects.filter(submission_id=comment.submission_id),
+        comment, context, sort)
+    sub_vote_value, comment_votes = get_thread_votes(
+        request, comment.submission_id,
+        [thread_comment.id for thread_comment in thread_comments])
+
+    return render(request, 'public/comments.html',
+                  {'submission'        : comment.submission,
+                   'permalink_comment' : comment,
+                   'comment_tree'      : render_comment_tree(
+                       thread_comments, comment_votes, sort),
+                   'comment_votes'     : comment_votes,
+                   'comment_votes_json': json.dumps(comment_votes),
+                   'sub_vote'          : sub_vote_value,
+                   'sort'              : sort,
+                   'sorts'             : COMMENT_SORTS})
+
+
+@get_only
+def expand_comment(request, comment_id=None):
+    """
+    Returns a collapsed comment rendered in full, together with a
+    bounded part of its replies, to replace its collapsed stub.
+
+    :param comment_id: ID of the collapsed comment
+    """
+    sort = request.GET.get('sort', DEFAULT_SORT)
+    if sort not in SORTS:
+        return HttpResponseBadRequest()
+    comment = get_object_or_404(Comment, id=comment_id)
+
+    thread_comments = load_context(
+        Comment.objects.filter(submission_id=comment.submission_id),
+        comment, sort=sort)
+    _, comment_votes = get_thread_votes(
+        request, comment.submission_id,
+        [thread_comment.id for thread_comment in thread_comments])
+    html = render_comment_tree(thread_comments, comment_votes, sort)
+    return JsonResponse({'html': html})
+
+
+@get_only
+def more_comments(request, thread_id=None, comment_id=None):
+    """
+    Returns the rendered comments a thread page left out: the top
+    level comments of the thread, or the replies of a comment, after
+    the first `offset` ones, together with their own replies.
+
+    :param thread_id: ID of the thread, when loading top level comments
+    :param comment_id: ID of the comment whose replies are loaded
+    """
+    try:
+        offset = int(request.GET.get('offset', 0))
+        if offset < 0:
+            raise ValueError("Negative offset")
+    except ValueError:
+        return HttpResponseBadRequest()
+    sort = request.GET.get('sort', DEFAULT_SORT)
+    if sort not in SORTS:
+        return HttpResponseBadRequest()
+
+    if comment_id is not None:
+        parent = get_object_or_404(Comment, id=comment_id)
+        submission_id = parent.submission_id
     else:
-        reddit_user = None
+        parent = None
+        submission_id = get_object_or_404(Submission, id=thread_id).id
+
+    html = render_thread(submission_id, parent, offset, request, sort)
+    return JsonResponse({'html': html})
+
+
+def render_thread(submission_id, parent=None, offset=0, request=None,
+                  sort=DEFAULT_SORT):
+    """
+    Load a bounded part of a thread with load_thread and render it,
+    followed by a placeholder for the top level comments that were
+    left out.
+
+    :param parent: Comment whose replies are rendered, or None for
+                   the top level comments of the thread
+    :param offset: Number of top level comments already shown
+    :param request: Request of the user whose votes on the loaded
+                    comments are highlighted, None to highlight none
+    :param sort: Name of the sibling order, one of SORTS
+    :rtype: django.utils.safestring.SafeText
+    """
+    thread_comments, hidden = load_thread(
+        Comment.objects.filter(submission_id=submission_id),
+        parent=parent, offset=offset, sort=sort)
 
-    sub_vote_value = None
     comment_votes = {}
+    if request is not None:
+        _, comment_votes = get_thread_votes(
+            request, submission_id,
+            [comment.id for comment in thread_comments])
+    html = render_comment_tree(thread_comments, comment_votes, sort)
+    if hidden:
+        top_depth = parent.depth + 1 if parent else 0
+        shown = sum(1 for comment in thread_comments
+                    if comment.depth == top_depth)
+        if parent:
+            url, what = reverse('more_replies', args=(parent.id,)), 'replies'
+        else:
+            url, what = reverse('more_comments', args=(submission_id,)), 'comments'
+        html += render_load_more('{}?offset={}&sort={}'.format(
+            url, offset + shown, sort), hidden, what=what)
+    return html
 
-    if reddit_user:
 
-        try:
-            vote = Vote.objects.get(
-                vote_object_type=this_submission.get_content_type(),
-                vote_object_id=this_submission.id,
-                user=reddit_user)
-            sub_vote_value = vote.value
-        except Vote.DoesNotExist:
-            pass
+def render_thread_page(submission_id, sort=DEFAULT_SORT):
+    """
+    Render the comment tree of a thread page, wrapped in an element
+    holding the id of the newest comment in the thread, which the page
+    polls new_comments with.
 
-        try:
-            user_thread_votes = Vote.objects.filter(user=reddit_user,
-                                                    submission=this_submission)
+    :rtype: django.utils.safestring.SafeText
+    """
+    last_id = Comment.objects.filter(submission_id=submission_id) \
+        .aggregate(Max('id'))['id__max']
+    return format_html(
+        '<div id="commentTree" data-thread-id="{}" data-last-id="{}">{}</div>',
+        submission_id, last_id or 0, render_thread(submission_id, sort=sort))
 
-            for vote in user_thread_votes:
-                comment_votes[vote.vote_object.id] = vote.value
-        except:
-            pass
 
-    return render(request, 'public/comments.html',
-                  {'submission'   : this_submission,
-                   'comments'     : thread_comments,
-                   'comment_votes': comment_votes,
-                   'sub_vote'     : sub_vote_value})
+@get_only
+def new_comments(request, thread_id=None):
+    """
+    Returns the comments of a thread posted after the comment with
+    the `after` id, oldest first, so an open thread page can add
+    them without reloading. Each one comes with its parent id and
+    rendered markup. At most NEW_COMMENTS_LIMIT are returned,
+    `more` tells whether newer ones are left.
+
+    :param thread_id: ID of the thread
+    """
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        return HttpResponseBadRequest()
+    submission_id = get_object_or_404(Submission, id=thread_id).id
+
+    # Served by the (submission, id) index
+    newer = list(Comment.objects.filter(submission_id=submission_id,
+                                        id__gt=after)
+                 .only(*RENDERED_FIELDS)
+                 .order_by('id')[:NEW_COMMENTS_LIMIT + 1])
+    more = len(newer) > NEW_COMMENTS_LIMIT
+    newer = newer[:NEW_COMMENTS_LIMIT]
+    # Stale html of all of them in one batch, not one per comment
+    markdown.refresh([comment for comment in newer if not comment.deleted],
+                     'raw_comment', 'html_comment')
+
+    items = [{'id'       : comment.id,
+              'parent_id': comment.parent_id,
+              'html'     : render_comment_tree([comment], {})}
+             for comment in newer]
+    return JsonResponse({'comments': items,
+                         'last_id' : newer[-1].id if newer else after,
+                         'more'    : more})
+
+
+@get_only
+def thread_api(request, thread_id=None):
+    """
+    Returns a submission and its comments as JSON. Comments come as
+    a flat list of rows in depth-first order (every comment follows its
+    parent, siblings oldest first) with a `fields` header naming the
+    columns, and refer to their parent by id.
+
+    Query parameters:
+
+    - `fields`: comma separated comment fields, by default all of
+      API_COMMENT_FIELDS
+    - `depth`: only comments at most this deep, 0 for top level only
+    - `after`: the `next` cursor of the previous response, set while
+      more than API_COMMENT_LIMIT comments are left
+
+    Rows are serialized straight from the database, without creating
+    Comment instances, stale html of the page is rendered in one batch
+    with MARKDOWN_LAZY_RENDER set. With the thread cache enabled the
+    response has an ETag derived from the thread version, and an
+    unchanged thread is answered with 304 Not Modified before any
+    comment is read.
+
+    :param thread_id: ID of the thread
+    """
+    fields = request.GET.get('fields')
+    fields = fields.split(',') if fields else list(API_COMMENT_FIELDS)
+    if not all(field in API_COMMENT_FIELDS for field in fields):
+        return HttpResponseBadRequest()
+    try:
+        max_depth = request.GET.get('depth')
+        max_depth = int(max_depth) if max_depth is not None else None
+        if max_depth is not None and max_depth < 0:
+            raise ValueError("Negative depth")
+    except ValueError:
+        return HttpResponseBadRequest()
+    after = request.GET.get('after', '')
+
+    submission = Submission.objects.filter(id=thread_id) \
+        .values('render_version',
+                *[column for _, column in API_SUBMISSION_FIELDS]).first()
+    if submission is None:
+        raise Http404
+    if markdown.lazy_enabled() and \
+            submission['render_version'] < markdown.RENDER_VERSION:
+        submission['text_html'] = markdown.render_stale(
+            Submission, [submission['id']], 'text', 'text_html'
+        )[submission['id']]
+    submission = {field: submission[column]
+                  for field, column in API_SUBMISSION_FIELDS}
+
+    etag = None
+    if thread_cache.enabled():
+        # Votes on the submission don't change the thread version
+        etag = hashlib.md5('{}:{}:{}'.format(
+            thread_cache.version(submission['id']), markdown.RENDER_VERSION,
+            json.dumps(submission, cls=DjangoJSONEncoder, sort_keys=True)
+        ).encode('utf-8')).hexdigest()
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+    comments = Comment.objects.filter(submission_id=submission['id'],
+                                      path__gt=after)
+    if max_depth is not None:
+        comments = comments.filter(depth__lte=max_depth)
+    # The path is only read to make the next cursor, the last columns
+    # to find the stale html of the page
+    columns = [API_COMMENT_FIELDS[field] for field in fields] + ['path']
+    lazy_html = 'html' in fields and markdown.lazy_enabled()
+    if lazy_html:
+        columns += ['id', 'render_version', 'deleted']
+    rows = list(comments.order_by('path').values_list(*columns)
+                [:API_COMMENT_LIMIT + 1])
+    next_cursor = rows[API_COMMENT_LIMIT - 1][len(fields)] \
+        if len(rows) > API_COMMENT_LIMIT else None
+    rows = rows[:API_COMMENT_LIMIT]
+
+    if lazy_html:
+        html_index = fields.index('html')
+        rendered = markdown.render_stale(
+            Comment, [row[-3] for row in rows
+                      if row[-2] < markdown.RENDER_VERSION and not row[-1]],
+            'raw_comment', 'html_comment')
+        rows = [row[:html_index] +
+                (rendered.get(row[-3], row[html_index]),) +
+                row[html_index + 1:] for row in rows]
+
+    response = JsonResponse({
+        'submission': submission,
+        'fields'    : fields,
+        'comments'  : [row[:len(fields)] for row in rows],
+        'next'      : next_cursor,
+    })
+    if etag:
+        response['ETag'] = quote_etag(etag)
+    return response
+
+
+def get_thread_votes(request, submission_id, comment_ids=None):
+    """
+    Look up the votes the current user cast on a thread.
+
+    :param submission_id: ID of the submission
+    :param comment_ids: Only look up the votes on these comments
+    :return: Vote value on the submission (or None) and
+             vote values on its comments keyed by comment id
+    :rtype: (int | None, dict[int, int])
+    """
+    if not request.user.is_authenticated():
+        return None, {}
+    try:
+        reddit_user = RedditUser.objects.get(user=request.user)
+    except RedditUser.DoesNotExist:
+        return None, {}
+
+    sub_vote_value = Vote.get_submission_votes(
+        reddit_user, [submission_id]).get(submission_id)
+    comment_votes = Vote.get_comment_votes(reddit_user, submission_id,
+                                           comment_ids)
+    return sub_vote_value, comment_votes
 
 
 @post_only
@@ -142,6 +593,10 @@ def post_comment(request):
     except (Comment.DoesNotExist, Submission.DoesNotExist):
         return HttpResponseBadRequest()
 
+    if parent_type == 'comment' and \
+            parent_object.depth + 1 >= Comment.MAX_DEPTH:
+        return JsonResponse({'msg': "This thread is nested too deep to reply."})
+
     comment = Comment.create(author=author,
                              raw_comment=raw_comment,
                              parent=parent_object)
@@ -150,6 +605,67 @@ def post_comment(request):
     return JsonResponse({'msg': "Your comment has been posted."})
 
 
+def get_own_comment(request):
+    """
+    Look up the comment with the POSTed commentId, which the current
+    user has to be the author of.
+
+    :return: The comment, or the response to return instead
+    :rtype: (Comment | None, HttpResponse | None)
+    """
+    comment_id = request.POST.get('commentId', '')
+    if not comment_id.isdigit():
+        return None, HttpResponseBadRequest()
+    try:
+        comment = Comment.objects.get(id=comment_id)
+    except Comment.DoesNotExist:
+        return None, HttpResponseBadRequest()
+    if comment.author.user_id != request.user.id:
+        return None, HttpResponseForbidden()
+    if comment.deleted:
+        return None, JsonResponse({'msg': "This comment has been deleted."})
+    return comment, None
+
+
+@post_only
+def edit_comment(request):
+    """
+    Replaces the text of one of the user's comments and returns
+    its new html.
+    """
+    if not request.user.is_authenticated():
+        return JsonResponse({'msg': "You need to log in to edit comments."})
+
+    comment, error = get_own_comment(request)
+    if error:
+        return error
+    raw_comment = request.POST.get('commentContent', None)
+    if not raw_comment:
+        return JsonResponse({'msg': "You have to write something."})
+
+    comment.edit(raw_comment)
+    return JsonResponse({'msg' : "Your comment has been edited.",
+                         'html': comment.html_comment})
+
+
+@post_only
+def delete_comment(request):
+    """
+    Deletes one of the user's comments, leaving a tombstone
+    in its place in the thread.
+    """
+    if not request.user.is_authenticated():
+        return JsonResponse({'msg': "You need to log in to delete comments."})
+
+    comment, error = get_own_comment(request)
+    if error:
+        return error
+
+    comment.tombstone()
+    return JsonResponse({'msg' : "Your comment has been deleted.",
+                         'html': comment.html_comment})
+
+
 @post_only
 def vote(request):
     # The type of object we're voting on, can be 'submission' or 'comment'
@@ -202,37 +718,133 @@ def vote(request):
 
     # Try and get the existing vote for this object, if it exists.
     try:
-        vote = Vote.objects.get(vote_object_type=vote_object.get_content_type(),
-                                vote_object_id=vote_object.id,
+        vote = Vote.objects.get(kind=Vote.kind_of(vote_object),
+                                object_id=vote_object.id,
                                 user=user)
+        # We already have the object, don't fetch it again.
+        vote.vote_object = vote_object
 
     except Vote.DoesNotExist:
         # Create a new vote and that's it.
-        vote = Vote.create(user=user,
-                           vote_object=vote_object,
-                           vote_value=new_vote_value)
-        vote.save()
+        try:
+            with transaction.atomic():
+                vote = Vote.create(user=user,
+                                   vote_object=vote_object,
+                                   vote_value=new_vote_value)
+                vote.save()
+        except IntegrityError:
+            # A concurrent request from the same user created the vote first.
+            return HttpResponseBadRequest('Vote already exists')
         vote_diff = new_vote_value
         return JsonResponse({'error'   : None,
                              'voteDiff': vote_diff})
 
-    # User already voted on this item, this means the vote is either
-    # being canceled (same value) or changed (different new_vote_value)
+    vote_diff, error = update_vote(vote, new_vote_value)
+    if error:
+        return HttpResponseBadRequest(error)
+
+    return JsonResponse({'error'   : None,
+                         'voteDiff': vote_diff})
+
+
+def update_vote(vote, new_vote_value):
+    """
+    User already voted on this item, this means the vote is either
+    being canceled (same value) or changed (different new_vote_value)
+
+    :return: Score difference and an error message if it failed
+    :rtype: (int, str)
+    """
     if vote.value == new_vote_value:
         # canceling vote
         vote_diff = vote.cancel_vote()
         if not vote_diff:
-            return HttpResponseBadRequest(
-                'Something went wrong while canceling the vote')
+            return 0, 'Something went wrong while canceling the vote'
     else:
         # changing vote
         vote_diff = vote.change_vote(new_vote_value)
         if not vote_diff:
-            return HttpResponseBadRequest(
-                'Wrong values for old/new vote combination')
+            return 0, 'Wrong values for old/new vote combination'
+    return vote_diff, None
+
+
+# Most votes a single batch request can cast
+MAX_VOTE_BATCH = 100
 
-    return JsonResponse({'error'   : None,
-                         'voteDiff': vote_diff})
+
+@post_only
+def vote_batch(request):
+    """
+    Casts several votes in one request and one transaction.
+
+    Expects a `votes` POST field holding a JSON list of
+    {what, what_id, vote_value} objects, each with the same meaning as
+    the fields of a single vote request. Objects are looked up with one
+    query per type, and the counter changes of all votes are added up and
+    written with one UPDATE per voted object.
+
+    Returns a `results` list with an {error, voteDiff} object per vote,
+    in request order, with the same voteDiff values as single votes.
+    """
+    if not request.user.is_authenticated():
+        return HttpResponseForbidden()
+
+    try:
+        operations = json.loads(request.POST.get('votes', ''))
+        if not isinstance(operations, list) or \
+                not 0 < len(operations) <= MAX_VOTE_BATCH:
+            raise ValueError("Wrong number of votes")
+        for op in operations:
+            if not isinstance(op, dict) or \
+                    op.get('what') not in ['comment', 'submission']:
+                raise ValueError("Invalid vote")
+        operations = [(op['what'], int(op['what_id']), int(op['vote_value']))
+                      for op in operations]
+    except (ValueError, TypeError, KeyError):
+        return HttpResponseBadRequest()
+
+    user = RedditUser.objects.get(user=request.user)
+    models = {'comment': Comment, 'submission': Submission}
+
+    # One lookup per type for the objects and for the existing votes
+    objects, votes = {}, {}
+    for what, model in models.items():
+        ids = {what_id for op_what, what_id, _ in operations if op_what == what}
+        if not ids:
+            continue
+        for pk, obj in model.objects.in_bulk(ids).items():
+            objects[what, pk] = obj
+        kind = Vote.SUBMISSION if model is Submission else Vote.COMMENT
+        for vote in Vote.objects.filter(user=user, kind=kind,
+                                        object_id__in=ids):
+            vote.vote_object = objects[what, vote.object_id]
+            votes[what, vote.object_id] = vote
+
+    results = []
+    try:
+        with transaction.atomic(), vote_buffer.collect():
+            for what, what_id, new_vote_value in operations:
+                vote_object = objects.get((what, what_id))
+                if vote_object is None or new_vote_value not in [-1, 1]:
+                    results.append({'error': 'Invalid vote', 'voteDiff': 0})
+                    continue
+
+                vote = votes.get((what, what_id))
+                if vote is None:
+                    vote = votes[what, what_id] = Vote.create(
+                        user=user, vote_object=vote_object,
+                        vote_value=new_vote_value)
+                    vote.save()
+                    vote_diff, error = new_vote_value, None
+                else:
+                    vote_diff, error = update_vote(vote, new_vote_value)
+                results.append({'error': error, 'voteDiff': vote_diff})
+    except IntegrityError:
+        # A concurrent request from the same user created one of the votes.
+        return HttpResponseBadRequest('Vote already exists')
+
+    return JsonResponse({'error'  : None,
+                         'results': results})
 
 
 @login_required
@@ -256,3 +868,12 @@ def submit(request):
             return redirect('/comments/{}'.format(submission.id))
 
     return render(request, 'public/submit.html', {'form': submission_form})
+
+
+@user_passes_test(lambda user: user.is_staff)
+def process_metrics(request):
+    """
+    Serves the counters, timings and gauges of the worker
+    process that handles the request.
+    """
+    return JsonResponse(metrics.snapshot())
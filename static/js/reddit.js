@@ -75,6 +75,20 @@ function vote(voteButton) {
     });
 }
 
+// The comment tree is rendered without the current user's votes,
+// so the same html can be served to everyone. Highlight them here.
+function applyCommentVotes(commentVotes) {
+    $.each(commentVotes, function (commentId, voteValue) {
+        var $arrows = $('div.comment-votes[data-what-id="' + commentId + '"]')
+            .children('div').children('i');
+        if (voteValue == 1) {
+            $arrows.filter('.fa-chevron-up').addClass('upvoted');
+        } else if (voteValue == -1) {
+            $arrows.filter('.fa-chevron-down').addClass('downvoted');
+        }
+    });
+}
+
 function getCookie(name) {
     var cookieValue = null;
     if (document.cookie && document.cookie != '') {
@@ -125,6 +139,7 @@ function submitEvent(event, form) {
             errorLabel.text(response.msg);
             errorLabel.removeAttr('style');
         }
+        loadNewComments();
     });
 }
 
@@ -152,7 +167,8 @@ var newCommentForm = '<form id="commentForm" class="form-horizontal"\
                     </form>';
 
 
-$('a[name="replyButton"]').click(function () {
+// Delegated, so comments loaded later get the reply form too
+$(document).on('click', 'a[name="replyButton"]', function () {
     var $mediaBody = $(this).parent().parent().parent();
     if ($mediaBody.find('#commentForm').length == 0) {
         $mediaBody.parent().find(".reply-container:first").append(newCommentForm);
@@ -172,5 +188,132 @@ $('a[name="replyButton"]').click(function () {
 
 });
 
+$(document).on('click', 'a[name="loadMore"]', function () {
+    var $placeholder = $(this).parent();
+    $.get($(this).data('url')).done(function (response) {
+        $placeholder.replaceWith(response.html);
+        showAuthorButtons();
+    });
+});
+
+$(document).on('click', 'a[name="expandComment"]', function () {
+    var $stub = $(this).closest('div.collapsed-comment');
+    $.get($(this).data('url')).done(function (response) {
+        $stub.replaceWith(response.html);
+        showAuthorButtons();
+    });
+});
+
+// Splice the comments posted since the page was rendered into the
+// tree. Replies whose parent isn't on the page are left to the load
+// more placeholders.
+function loadNewComments() {
+    var $tree = $('#commentTree');
+    var $button = $('a[name="newComments"]');
+    if ($tree.length == 0 || $button.length == 0) {
+        return;
+    }
+    $.get($button.data('url'), {after: $tree.data('lastId')}).done(function (response) {
+        $.each(response.comments, function (i, comment) {
+            if ($('div.comment-votes[data-what-id="' + comment.id + '"]').length) {
+                return;
+            }
+            if (comment.parent_id == null) {
+                $tree.prepend(comment.html);
+            } else {
+                $('div.media-body[data-parent-id="' + comment.parent_id + '"]')
+                    .first().append(comment.html);
+            }
+        });
+        $tree.data('lastId', response.last_id);
+        showAuthorButtons();
+        if (response.more) {
+            loadNewComments();
+        }
+    });
+}
+
+$(document).on('click', 'a[name="newComments"]', loadNewComments);
+
+// Comment trees are shared between users, so the edit and delete
+// buttons are hidden until the page shows them on the user's own comments.
+var currentUsername = null;
+
+function showAuthorButtons(username) {
+    if (username) {
+        currentUsername = username;
+    }
+    if (!currentUsername) {
+        return;
+    }
+    $('div.media-body[data-author="' + currentUsername + '"]')
+        .children('div.reply-container').find('li.author-only').show();
+}
+
+function postCommentChange(url, data) {
+    var csrftoken = getCookie('csrftoken');
+
+    $.ajaxSetup({
+        beforeSend: function (xhr, settings) {
+            if (!csrfSafeMethod(settings.type) && !this.crossDomain) {
+                xhr.setRequestHeader("X-CSRFToken", csrftoken);
+            }
+        }
+    });
+    return $.post(url, data);
+}
+
+var editCommentForm = '<form name="editForm" class="form-horizontal">\
+                            <div class="form-group comment-group">\
+                                <div class="col-lg-10 col-lg-offset-2">\
+                                    <textarea class="form-control" rows="3" name="editContent"></textarea>\
+                                    <span class="text-success" style="display: none"></span>\
+                                </div>\
+                            </div>\
+                            <div class="form-group">\
+                                <div class="col-lg-10 col-lg-offset-2">\
+                                    <button type="submit" class="btn btn-primary">Save</button>\
+                                </div>\
+                            </div>\
+                        </form>';
 
+$(document).on('click', 'a[name="editButton"]', function () {
+    var $mediaBody = $(this).closest('div.media-body');
+    var $container = $mediaBody.children('div.reply-container');
+    var $form = $container.children('form[name="editForm"]');
+    if ($form.length) {
+        $form.toggle();
+        return;
+    }
+    $container.append(editCommentForm);
+    $container.children('form[name="editForm"]').submit(function (event) {
+        event.preventDefault();
+        var $editForm = $(this);
+        postCommentChange('/post/comment/edit/', {
+            commentId: $mediaBody.data('parentId'),
+            commentContent: $editForm.find('textarea').val()
+        }).done(function (response) {
+            if (response.html) {
+                $mediaBody.children('div.comment-body').html(response.html);
+                $editForm.remove();
+            } else if (response.msg) {
+                $editForm.find('span').text(response.msg).removeAttr('style');
+            }
+        });
+    });
+});
 
+$(document).on('click', 'a[name="deleteButton"]', function () {
+    if (!confirm('Delete this comment?')) {
+        return;
+    }
+    var $mediaBody = $(this).closest('div.media-body');
+    postCommentChange('/post/comment/delete/', {
+        commentId: $mediaBody.data('parentId')
+    }).done(function (response) {
+        if (response.html) {
+            $mediaBody.children('div.comment-body').html(response.html);
+            $mediaBody.children('div.reply-container').find('li.author-only').remove();
+        }
+    });
+});
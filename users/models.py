@@ -1,9 +1,10 @@
 from hashlib import md5
 
-import mistune
 from django.contrib.auth.models import User
 from django.db import models
 
+from reddit.utils import markdown
+
 
 class RedditUser(models.Model):
     user = models.OneToOneField(User)
@@ -15,6 +16,8 @@ class RedditUser(models.Model):
     about_text = models.TextField(blank=True, null=True, max_length=500,
                                   default=None)
     about_html = models.TextField(blank=True, null=True, default=None)
+    # markdown.RENDER_VERSION of about_html, 0 if unknown
+    render_version = models.PositiveSmallIntegerField(default=0)
     gravatar_hash = models.CharField(max_length=32, null=True, blank=True,
                                      default=None)
     display_picture = models.NullBooleanField(default=False)
@@ -28,7 +31,8 @@ class RedditUser(models.Model):
     link_karma = models.IntegerField(default=0)
 
     def update_profile_data(self):
-        self.about_html = mistune.markdown(self.about_text)
+        self.about_html = markdown.render(self.about_text)
+        self.render_version = markdown.RENDER_VERSION
         if self.display_picture:
             self.gravatar_hash = md5(self.email.lower().encode('utf-8')).hexdigest()
 
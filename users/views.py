@@ -6,6 +6,7 @@ from django.http import HttpResponseBadRequest, Http404
 from django.shortcuts import render, redirect, get_object_or_404
 
 from reddit.forms import UserForm, ProfileForm
+from reddit.utils import markdown
 from reddit.utils.helpers import post_only
 from users.models import RedditUser
 
@@ -13,6 +14,7 @@ from users.models import RedditUser
 def user_profile(request, username):
     user = get_object_or_404(User, username=username)
     profile = RedditUser.objects.get(user=user)
+    markdown.refresh([profile], 'about_text', 'about_html')
 
     return render(request, 'public/profile.html', {'profile': profile})
 